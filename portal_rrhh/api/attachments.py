@@ -0,0 +1,90 @@
+"""
+Attachment prefetch service.
+
+Listings attach the File records of each row. Instead of one unbounded
+`attached_to_name IN (...)` query per endpoint, get_attachments resolves a
+whole page of documents:
+
+- cached attachment lists are read from a Redis hash per doctype
+  (field = document name) with a single HMGET;
+- the missing names are queried in chunks of CHUNK_SIZE and cached,
+  including the documents without attachments, with one pipelined HSET per
+  chunk. The hash expires ATTACHMENT_CACHE_TTL seconds after the last write.
+
+File doc events drop the entry of the document a file is attached to, and
+again after commit in case a concurrent read cached the old list meanwhile.
+"""
+
+import frappe
+
+from portal_rrhh.api.cache import hget_many, hset_many
+
+
+ATTACHMENT_CACHE_PREFIX = "portal_rrhh:attachments:"
+CHUNK_SIZE = 500
+ATTACHMENT_CACHE_TTL = 6 * 3600
+
+
+def _cache_key(doctype):
+    return ATTACHMENT_CACHE_PREFIX + doctype
+
+
+def get_attachments(doctype, names):
+    """
+    Attachments of the given documents: {name: [{name, file_url, file_name}]}.
+    Every requested name is present (empty list when it has no files).
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    if not names:
+        return {}
+
+    result = hget_many(_cache_key(doctype), names)
+    missing = [n for n in names if n not in result]
+
+    for i in range(0, len(missing), CHUNK_SIZE):
+        chunk = missing[i:i + CHUNK_SIZE]
+        loaded = {name: [] for name in chunk}
+        for f in frappe.get_all(
+            "File",
+            filters={"attached_to_doctype": doctype, "attached_to_name": ["in", chunk]},
+            fields=["name", "file_url", "file_name", "attached_to_name"]
+        ):
+            loaded.setdefault(f.attached_to_name, []).append({
+                "name": f.name,
+                "file_url": f.file_url,
+                "file_name": f.file_name
+            })
+
+        hset_many(_cache_key(doctype), loaded, expires_in_sec=ATTACHMENT_CACHE_TTL)
+        result.update(loaded)
+
+    return result
+
+
+def add_attachments(rows, doctype):
+    """
+    Set "attachments" and "attachment" (first file URL, kept for older
+    clients) on each row of a listing.
+    """
+    attachments = get_attachments(doctype, [r.name for r in rows])
+    for r in rows:
+        r["attachments"] = attachments.get(r.name, [])
+        r["attachment"] = r["attachments"][0]["file_url"] if r["attachments"] else None
+    return rows
+
+
+def clear_attachment_cache(doc, method=None):
+    """File doc_events: drop the cached attachments of the document (old and new)."""
+    targets = {(doc.attached_to_doctype, doc.attached_to_name)}
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before:
+        targets.add((before.attached_to_doctype, before.attached_to_name))
+
+    targets = [(doctype, name) for doctype, name in targets if doctype and name]
+    _drop_cached(targets)
+    frappe.db.after_commit.add(lambda: _drop_cached(targets))
+
+
+def _drop_cached(targets):
+    for doctype, name in targets:
+        frappe.cache().hdel(_cache_key(doctype), name)
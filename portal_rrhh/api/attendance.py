@@ -1,8 +1,15 @@
 import frappe
 from frappe import _
-from frappe.utils import now, getdate, get_time, add_days, date_diff, today
+from frappe.utils import now, getdate, get_time, add_days, today
 from frappe.model.document import Document
 
+from portal_rrhh.api.attendance_engine import detect_anomalies
+from portal_rrhh.api.attendance_summary import get_summary_rows, summary_to_day_stats
+from portal_rrhh.api.holidays import get_employee_holiday_lists, get_holiday_calendar
+from portal_rrhh.api.leave_index import load_leave_index
+from portal_rrhh.api.team import get_team_membership, is_dept_manager, is_hr_user
+from portal_rrhh.api.working_days import DEFAULT_WORKING_WEEKDAYS, WorkingDays
+
 
 @frappe.whitelist(allow_guest=False)
 def get_attendance_report(employee, from_date, to_date):
@@ -16,66 +23,109 @@ def get_attendance_report(employee, from_date, to_date):
     - no_break: Jornada > 6h sin descanso de al menos 15 minutos
     - no_checkin: Día laborable sin fichajes ni justificación
     """
-    from datetime import timedelta
-    
     if not employee:
         return {"success": False, "message": _("Employee is required")}
     
     if not from_date or not to_date:
         return {"success": False, "message": _("Dates are required")}
     
-    start_date = getdate(from_date)
-    end_date = getdate(to_date)
-    today_date = getdate(today())
-    
     # Verify the current user can access this employee's data
+    if not get_authorized_report_employees([employee]):
+        return {"success": False, "message": _("Not authorized to view this employee's data")}
+    
+    data = build_attendance_reports([employee], getdate(from_date), getdate(to_date))
+    return {"success": True, "data": data[employee]}
+
+
+@frappe.whitelist(allow_guest=False)
+def get_attendance_report_batch(employees, from_date, to_date):
+    """
+    Batched get_attendance_report for several employees (e.g. a manager's team grid).
+    Permissions are resolved once and every source is loaded with one IN query.
+    
+    Returns {"data": {employee: [days]}, "unauthorized": [employees not accessible]}.
+    """
+    if isinstance(employees, str):
+        employees = frappe.parse_json(employees)
+    
+    employees = list(dict.fromkeys(e for e in (employees or []) if e))
+    if not employees:
+        return {"success": False, "message": _("Employee is required")}
+    
+    if not from_date or not to_date:
+        return {"success": False, "message": _("Dates are required")}
+    
+    allowed = get_authorized_report_employees(employees)
+    allowed_set = set(allowed)
+    
+    return {
+        "success": True,
+        "data": build_attendance_reports(allowed, getdate(from_date), getdate(to_date)),
+        "unauthorized": [e for e in employees if e not in allowed_set]
+    }
+
+
+def get_authorized_report_employees(employees):
+    """
+    Filter the employees whose attendance the current user can view:
+    their own record, HR roles, leave approver or department approver.
+    """
     current_user = frappe.session.user
-    if current_user != "Administrator":
-        user_employee = frappe.db.get_value("Employee", {"user_id": current_user}, "name")
-        if user_employee != employee:
-            roles = frappe.get_roles(current_user)
-            if "HR Manager" not in roles and "HR User" not in roles:
-                emp_approver = frappe.db.get_value("Employee", employee, "leave_approver")
-                if emp_approver != current_user:
-                    emp_dept = frappe.db.get_value("Employee", employee, "department")
-                    is_dept_approver = frappe.db.exists("Department Approver", {
-                        "parent": emp_dept,
-                        "approver": current_user
-                    })
-                    if not is_dept_approver:
-                        return {"success": False, "message": _("Not authorized to view this employee's data")}
-    
-    # Fetch checkins for anomaly detection
-    checkins = frappe.get_all(
-        "Employee Checkin",
-        filters={
-            "employee": employee,
-            "time": ["between", [start_date, end_date + timedelta(days=1)]],
-            "skip_auto_attendance": 0
-        },
-        fields=["time", "log_type"],
-        order_by="time asc"
+    if current_user == "Administrator":
+        return list(employees)
+    
+    team = get_team_membership(current_user)
+    user_employee = team.employee
+    others = [e for e in employees if e != user_employee]
+    if not others:
+        return list(employees)
+    
+    roles = frappe.get_roles(current_user)
+    if is_hr_user(roles):
+        return list(employees)
+    
+    emp_rows = frappe.get_all(
+        "Employee",
+        filters={"name": ["in", others]},
+        fields=["name", "leave_approver", "department"]
     )
+    approver_depts = set(team.departments)
+    
+    permitted = {
+        e.name for e in emp_rows
+        if e.leave_approver == current_user or (e.department and e.department in approver_depts)
+    }
+    return [e for e in employees if e == user_employee or e in permitted]
+
+
+def build_attendance_reports(employees, start_date, end_date):
+    """
+    Build the per-day attendance report for several employees.
+    Each source (checkin summaries, attendance, verified attendance, leaves,
+    holidays) is fetched with a single IN query for all employees.
     
-    # Group checkins by date
-    checkins_by_date = {}
-    for c in checkins:
-        d = c.time.date().strftime("%Y-%m-%d")
-        if d not in checkins_by_date:
-            checkins_by_date[d] = []
-        checkins_by_date[d].append(c)
+    Returns {employee: [day dicts]}.
+    """
+    employees = list(employees)
+    if not employees:
+        return {}
+    
+    today_date = getdate(today())
+    
+    # Checkin summaries per day (daily summary table; raw checkins only for today)
+    summary_map = get_summary_rows(employees, start_date, end_date)
     
     # Fetch attendance records
     attendances = frappe.get_all(
         "Attendance",
         filters={
-            "employee": employee,
+            "employee": ["in", employees],
             "attendance_date": ["between", [start_date, end_date]],
             "docstatus": ["!=", 2]
         },
-        fields=["attendance_date", "status", "working_hours", "in_time", "out_time"]
+        fields=["employee", "attendance_date", "status", "working_hours", "in_time", "out_time"]
     )
-    attendance_map = {a.attendance_date.strftime("%Y-%m-%d"): a for a in attendances}
+    attendance_map = {(a.employee, a.attendance_date.strftime("%Y-%m-%d")): a for a in attendances}
 
     # Fetch Verified Attendance for the period (for is_verified and verified_rest_time)
     verified_map = {}
@@ -83,194 +133,139 @@ def get_attendance_report(employee, from_date, to_date):
         verified_list = frappe.get_all(
             "Verified Attendance",
             filters={
-                "employee": employee,
+                "employee": ["in", employees],
                 "attendance_date": ["between", [start_date, end_date]]
             },
-            fields=["attendance_date", "verified_in_time", "verified_out_time", "rest_time"]
+            fields=["employee", "attendance_date", "verified_in_time", "verified_out_time", "rest_time"]
         )
-        verified_map = {v.attendance_date.strftime("%Y-%m-%d"): v for v in verified_list}
-    
-    # Fetch approved leaves (standard + Spanish)
-    leaves = frappe.get_all(
-        "Leave Application",
-        filters={
-            "employee": employee,
-            "status": "Approved",
-            "from_date": ["<=", end_date],
-            "to_date": [">=", start_date]
-        },
-        fields=["from_date", "to_date", "leave_type"]
-    )
-    
-    spanish_leaves = []
-    if frappe.db.table_exists("tabSpanish Leave Application"):
-        spanish_leaves = frappe.get_all(
-            "Spanish Leave Application",
-            filters={
-                "employee": employee,
-                "status": ["in", ["Aprobada", "Approved"]],
-                "from_date": ["<=", end_date],
-                "to_date": [">=", start_date]
-            },
-            fields=["from_date", "to_date", "leave_type"]
-        )
-    
-    # Build leave map
-    leave_map = {}
-    for leave in leaves + spanish_leaves:
-        l_start = max(leave.from_date, start_date)
-        l_end = min(leave.to_date, end_date)
-        days = date_diff(l_end, l_start)
-        for i in range(days + 1):
-            d = add_days(l_start, i).strftime("%Y-%m-%d")
-            if d not in leave_map:
-                leave_map[d] = []
-            leave_map[d].append(leave.leave_type)
-    
-    # Get holidays
-    holiday_list = frappe.db.get_value("Employee", employee, "holiday_list")
-    holidays = set()
-    if holiday_list:
-        holiday_records = frappe.get_all(
-            "Holiday",
-            filters={
-                "parent": holiday_list,
-                "holiday_date": ["between", [start_date, end_date]]
-            },
-            pluck="holiday_date"
-        )
-        holidays = {h.strftime("%Y-%m-%d") for h in holiday_records}
+        verified_map = {(v.employee, v.attendance_date.strftime("%Y-%m-%d")): v for v in verified_list}
+    
+    # Approved leaves (standard + Spanish) as per-employee intervals
+    leave_index = load_leave_index(employees, start_date, end_date)
+    
+    # Get holidays (cached holiday calendar); lists fall back to the company's default
+    holiday_lists = get_employee_holiday_lists(employees)
+    calendar = get_holiday_calendar(holiday_lists.values(), start_date, end_date)
+    # Weekends are Saturday and Sunday whatever the list's weekly offs, so a
+    # Sunday-only list does not turn Saturdays into no-checkin anomalies
+    working_days = {
+        hl: WorkingDays(calendar, hl, weekdays=DEFAULT_WORKING_WEEKDAYS)
+        for hl in set(holiday_lists.values())
+    }
     
     # Build result data
-    result = []
-    current = start_date
-    
-    while current <= end_date:
-        date_str = current.strftime("%Y-%m-%d")
-        date_obj = current
-        is_today = date_obj == today_date
-        is_weekend = date_obj.weekday() >= 5  # Saturday=5, Sunday=6
-        is_holiday = date_str in holidays
-        has_leave = date_str in leave_map
+    results = {}
+    for employee in employees:
+        result = results[employee] = []
+        if employee not in holiday_lists:
+            # Unknown or deleted employee: empty report
+            continue
+        holiday_list = holiday_lists[employee]
+        workdays = working_days[holiday_list]
+        current = start_date
         
-        hours = 0
-        status_list = []
-        anomaly = None
-        anomaly_desc = None
+        while current <= end_date:
+            date_str = current.strftime("%Y-%m-%d")
+            date_obj = current
+            is_today = date_obj == today_date
+            is_holiday = calendar.is_holiday(holiday_list, date_obj)
+            # Saturday or Sunday that is not a holiday
+            is_weekend = not is_holiday and not workdays.is_working_day(date_obj)
+            key = (employee, date_str)
+            day_leaves = leave_index.at(employee, date_obj)
+            has_leave = bool(day_leaves)
         
-        # Get checkins for this day
-        day_checkins = checkins_by_date.get(date_str, [])
+            hours = 0
+            status_list = []
+            anomaly = None
+            anomaly_desc = None
         
-        # Calculate hours from checkins (always, for any day with checkins)
-        if day_checkins:
-            sorted_checkins = sorted(day_checkins, key=lambda x: x.time)
-            sessions = []
-            current_in_time = None
-            
-            for c in sorted_checkins:
-                if c.log_type == 'IN' and current_in_time is None:
-                    current_in_time = c.time
-                elif c.log_type == 'OUT' and current_in_time:
-                    sessions.append((current_in_time, c.time))
-                    current_in_time = None
-            
-            # Sum all completed sessions
-            if sessions:
-                total_seconds = sum((s[1] - s[0]).total_seconds() for s in sessions)
-                hours = round(total_seconds / 3600.0, 1)
+            # Get checkin summary for this day
+            day_summary = summary_map.get(key)
+        
+            # Calculate hours from checkins (always, for any day with checkins)
+            if day_summary:
+                # Sum all completed sessions
+                if day_summary.session_count:
+                    hours = round(day_summary.worked_seconds / 3600.0, 1)
             
-            # Analyze anomalies (only for past days, not today)
-            if not is_today:
-                ins = [c for c in day_checkins if c.log_type == 'IN']
-                outs = [c for c in day_checkins if c.log_type == 'OUT']
+                # Analyze anomalies (only for past days, not today)
+                if not is_today:
+                    ins, outs = day_summary.in_count, day_summary.out_count
+                    anomaly = day_summary.anomaly_code
                 
-                # Check missing punches
-                if len(ins) > len(outs):
-                    anomaly = "missing_out"
-                    anomaly_desc = f"Falta salida ({len(ins)} entrada(s), {len(outs)} salida(s))"
-                elif len(outs) > len(ins):
-                    anomaly = "missing_in"
-                    anomaly_desc = f"Falta entrada ({len(outs)} salida(s), {len(ins)} entrada(s))"
-                else:
-                    # Check for >6h continuous work without break
-                    for s_in, s_out in sessions:
-                        session_hours = (s_out - s_in).total_seconds() / 3600.0
-                        if session_hours > 6:
-                            anomaly = "no_break"
-                            anomaly_desc = f"Sesión de {session_hours:.1f}h sin descanso"
-                            break
-                    
-                    # Also flag if total >6h with only 1 session
-                    if not anomaly and len(sessions) == 1 and hours > 6:
-                        anomaly = "no_break"
-                        anomaly_desc = f"Jornada de {hours}h sin descanso registrado"
-        else:
-            # No checkins - check attendance record as fallback
-            if date_str in attendance_map:
-                att = attendance_map[date_str]
-                hours = round(att.working_hours or 0, 1)
-                if att.status and att.status not in ["Present", "Work From Home"]:
-                    status_list.append(att.status)
+                    if anomaly == "missing_out":
+                        anomaly_desc = f"Falta salida ({ins} entrada(s), {outs} salida(s))"
+                    elif anomaly == "missing_in":
+                        anomaly_desc = f"Falta entrada ({outs} salida(s), {ins} entrada(s))"
+                    elif anomaly == "no_break":
+                        # >6h continuous work without break
+                        anomaly_desc = f"Sesión de {day_summary.first_long_session / 3600.0:.1f}h sin descanso"
+            else:
+                # No checkins - check attendance record as fallback
+                if key in attendance_map:
+                    att = attendance_map[key]
+                    hours = round(att.working_hours or 0, 1)
+                    if att.status and att.status not in ["Present", "Work From Home"]:
+                        status_list.append(att.status)
             
-            # No checkins on a workday without justification (only for past days)
-            if not is_today and not is_weekend and not is_holiday and not has_leave:
-                if date_obj < today_date:
-                    anomaly = "no_checkin"
-                    anomaly_desc = "Sin fichaje ni justificación"
+                # No checkins on a workday without justification (only for past days)
+                if not is_today and not is_weekend and not is_holiday and not has_leave:
+                    if date_obj < today_date:
+                        anomaly = "no_checkin"
+                        anomaly_desc = "Sin fichaje ni justificación"
         
-        # Check leaves
-        if has_leave:
-            status_list.extend(leave_map[date_str])
+            # Check leaves
+            if has_leave:
+                status_list.extend(l.leave_type for l in day_leaves)
         
-        # Check holidays
-        if is_holiday:
-            status_list.append("Festivo")
-
-        # Build logs for frontend (exact entry/exit times)
-        logs = []
-        for c in sorted(day_checkins, key=lambda x: x.time):
-            logs.append({
-                "type": c.log_type,
-                "time": c.time.strftime("%H:%M")
-            })
-        # If no checkins but we have Attendance with in_time/out_time, use those for display
-        if not logs and date_str in attendance_map:
-            att = attendance_map[date_str]
-            def _to_hh_mm(t):
-                if t is None:
-                    return None
-                if hasattr(t, "strftime"):
-                    return t.strftime("%H:%M")
-                s = str(t)
-                if len(s) >= 5 and s[2] in (":", "."):
-                    return s[:5]
-                return s
-            if getattr(att, "in_time", None):
-                logs.append({"type": "IN", "time": _to_hh_mm(att.in_time)})
-            if getattr(att, "out_time", None):
-                logs.append({"type": "OUT", "time": _to_hh_mm(att.out_time)})
-
-        # Verified attendance for this day
-        verified = verified_map.get(date_str)
-        is_verified = bool(verified)
-        verified_rest_time = None
-        if verified and getattr(verified, "rest_time", None):
-            verified_rest_time = verified.rest_time
+            # Check holidays
+            if is_holiday:
+                status_list.append("Festivo")
+
+            # Build logs for frontend (exact entry/exit times)
+            logs = [
+                {"type": log_type, "time": time_str}
+                for log_type, time_str in (day_summary.punches if day_summary else [])
+            ]
+            # If no checkins but we have Attendance with in_time/out_time, use those for display
+            if not logs and key in attendance_map:
+                att = attendance_map[key]
+                def _to_hh_mm(t):
+                    if t is None:
+                        return None
+                    if hasattr(t, "strftime"):
+                        return t.strftime("%H:%M")
+                    s = str(t)
+                    if len(s) >= 5 and s[2] in (":", "."):
+                        return s[:5]
+                    return s
+                if getattr(att, "in_time", None):
+                    logs.append({"type": "IN", "time": _to_hh_mm(att.in_time)})
+                if getattr(att, "out_time", None):
+                    logs.append({"type": "OUT", "time": _to_hh_mm(att.out_time)})
+
+            # Verified attendance for this day
+            verified = verified_map.get(key)
+            is_verified = bool(verified)
+            verified_rest_time = None
+            if verified and getattr(verified, "rest_time", None):
+                verified_rest_time = verified.rest_time
         
-        result.append({
-            "date": date_str,
-            "hours": hours,
-            "status": ", ".join(status_list) if status_list else None,
-            "anomaly": anomaly,
-            "anomaly_desc": anomaly_desc,
-            "logs": logs,
-            "is_verified": is_verified,
-            "verified_rest_time": verified_rest_time
-        })
+            result.append({
+                "date": date_str,
+                "hours": hours,
+                "status": ", ".join(status_list) if status_list else None,
+                "anomaly": anomaly,
+                "anomaly_desc": anomaly_desc,
+                "logs": logs,
+                "is_verified": is_verified,
+                "verified_rest_time": verified_rest_time
+            })
         
-        current = add_days(current, 1)
+            current = add_days(current, 1)
     
-    return {"success": True, "data": result}
+    return results
 
 
 @frappe.whitelist(allow_guest=False)
@@ -499,8 +494,7 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
     Por defecto filtra por el equipo del usuario actual para eficiencia.
     show_all=True solo funciona para usuarios HR.
     """
-    from frappe.utils import getdate, add_days, date_diff, today as get_today, cint
-    from datetime import timedelta
+    from frappe.utils import getdate, today as get_today, cint
     
     if not from_date or not to_date:
         return {"success": False, "message": _("Dates are required")}
@@ -513,56 +507,29 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
     roles = frappe.get_roles(current_user)
     
     # Determine user permissions
-    is_hr_user = (
+    user_is_hr = (
         current_user == "Administrator" 
         or "HR Manager" in roles
         or "HR User" in roles
         or "Validar HC" in roles
     )
     
-    # Get current employee
-    current_emp = frappe.db.get_value("Employee", {"user_id": current_user}, "name")
+    # Team of the current user (cached per user)
+    team = get_team_membership(current_user)
+    current_emp = team.employee
     
-    # Build list of allowed employee IDs based on user's team
-    allowed_emp_ids = set()
+    # Build list of allowed employee IDs based on user's team:
+    # direct reports, employees where user is leave_approver and department approvers
+    allowed_emp_ids = set(team.direct_reports) | set(team.leave_approver_of)
     available_managers = []  # For frontend filter options
+    if team.direct_reports:
+        available_managers.append(current_emp)
     
-    if current_emp:
-        # Direct reports (reports_to = current employee)
-        direct_reports = frappe.get_all(
-            "Employee",
-            filters={"reports_to": current_emp, "status": "Active"},
-            pluck="name"
-        )
-        allowed_emp_ids.update(direct_reports)
-        if direct_reports:
-            available_managers.append(current_emp)
-    
-    # Employees where user is leave_approver
-    leave_approver_emps = frappe.get_all(
-        "Employee",
-        filters={"leave_approver": current_user, "status": "Active"},
-        pluck="name"
-    )
-    allowed_emp_ids.update(leave_approver_emps)
-    
-    # Department approvers
-    if "Responsable de Departamento" in roles or "Responsable Departamento" in roles:
-        managed_depts = frappe.get_all(
-            "Department Approver",
-            filters={"approver": current_user},
-            pluck="parent"
-        )
-        if managed_depts:
-            dept_emps = frappe.get_all(
-                "Employee",
-                filters={"status": "Active", "department": ["in", managed_depts]},
-                pluck="name"
-            )
-            allowed_emp_ids.update(dept_emps)
+    if is_dept_manager(roles):
+        allowed_emp_ids.update(team.department_employees)
     
     # For HR users: if show_all, don't restrict. Otherwise use their team too.
-    if is_hr_user and cint(show_all):
+    if user_is_hr and cint(show_all):
         # No restriction - will query all active employees
         emp_filters = {"status": "Active"}
     else:
@@ -574,7 +541,7 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
     # Additional filters
     if employee:
         # Verify access if not HR
-        if not is_hr_user and employee not in allowed_emp_ids:
+        if not user_is_hr and employee not in allowed_emp_ids:
             return {"success": True, "data": [], "managers": []}
         emp_filters["name"] = employee
     
@@ -637,15 +604,12 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
             ghost_candidates = set(emps_with_active_offer) - emps_with_checkins
 
     # 3. Fetch Data in Bulk for Date Range
-    checkins = frappe.get_all("Employee Checkin",
-        filters={
-            "employee": ["in", emp_ids],
-            "time": ["between", [start_date, end_date + timedelta(days=1)]],
-            "skip_auto_attendance": 0
-        },
-        fields=["employee", "time", "log_type"],
-        order_by="time asc"
-    )
+    # Checkin days come from the daily summary table (raw checkins only for today)
+    emp_index = {e.name: i for i, e in enumerate(employees)}
+    day_stats = [
+        summary_to_day_stats(row, emp_index[row.employee])
+        for row in get_summary_rows(emp_ids, start_date, end_date).values()
+    ]
     
     attendances = frappe.get_all("Attendance",
         filters={
@@ -655,159 +619,27 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
         fields=["employee", "attendance_date", "status", "late_entry", "early_exit", "in_time", "out_time"]
     )
     
-    leaves = frappe.get_all("Leave Application",
-        filters={
-            "employee": ["in", emp_ids],
-            "status": "Approved",
-            "from_date": ["<=", end_date],
-            "to_date": [">=", start_date]
-        },
-        fields=["employee", "from_date", "to_date", "leave_type"]
-    )
-    
-    # Holidays by list
-    holiday_lists = set(e.holiday_list for e in employees if e.holiday_list)
-    holidays_map = {}
+    # Approved leaves (standard + Spanish) as per-employee intervals
+    leave_index = load_leave_index(emp_ids, start_date, end_date)
     
-    if holiday_lists:
-        for h in frappe.get_all("Holiday",
-            filters={"parent": ["in", list(holiday_lists)], "holiday_date": ["between", [start_date, end_date]]},
-            fields=["parent", "holiday_date"]
-        ):
-            holidays_map.setdefault(h.parent, set()).add(h.holiday_date)
+    # Holidays by list (cached holiday calendar)
+    calendar = get_holiday_calendar([e.holiday_list for e in employees], start_date, end_date)
 
-    # 4. Organize Data by Employee -> Date
-    data_map = {e: {} for e in emp_ids}
-    
-    for c in checkins:
-        d = c.time.date().strftime("%Y-%m-%d")
-        data_map[c.employee].setdefault(d, {"checkins": [], "attendance": None, "leave": None})
-        data_map[c.employee][d]["checkins"].append(c)
-        
-    for a in attendances:
-        d = a.attendance_date.strftime("%Y-%m-%d")
-        data_map[a.employee].setdefault(d, {"checkins": [], "attendance": None, "leave": None})
-        data_map[a.employee][d]["attendance"] = a
-        
-    for l in leaves:
-        l_start = max(l.from_date, start_date)
-        l_end = min(l.to_date, end_date)
-        for i in range(date_diff(l_end, l_start) + 1):
-            d = add_days(l_start, i).strftime("%Y-%m-%d")
-            data_map[l.employee].setdefault(d, {"checkins": [], "attendance": None, "leave": None})
-            data_map[l.employee][d]["leave"] = l
-
-    # 5. Process Anomalies
-    anomalies = []
-    flagged_time_issues = set()  # Track (employee, date) to avoid duplicates
-    
-    for emp_id, days_data in data_map.items():
-        emp = emp_map[emp_id]
-        emp_holidays = holidays_map.get(emp.holiday_list, set())
-        
-        for date_str, info in days_data.items():
-            date_obj = getdate(date_str)
-            logs = info.get("checkins", [])
-            att = info.get("attendance")
-            leave = info.get("leave")
-            is_holiday = date_obj in emp_holidays
-            is_today = date_obj == today_date
-            
-            if logs:
-                ins = [l for l in logs if l.log_type == 'IN']
-                outs = [l for l in logs if l.log_type == 'OUT']
-                
-                # Missing Punch - SKIP for current day (employee may not have clocked out yet)
-                if not is_today:
-                    if len(ins) > len(outs):
-                        anomalies.append({
-                            "employee": emp.employee_name,
-                            "date": date_str,
-                            "type": "Missing Punch",
-                            "description": _("{0} ENTRADA(s) y {1} SALIDA(s). Falta una SALIDA.").format(len(ins), len(outs)),
-                            "severity": "High"
-                        })
-                    elif len(outs) > len(ins):
-                        anomalies.append({
-                            "employee": emp.employee_name,
-                            "date": date_str,
-                            "type": "Missing Punch",
-                            "description": _("{0} SALIDA(s) y {1} ENTRADA(s). Falta una ENTRADA.").format(len(outs), len(ins)),
-                            "severity": "High"
-                        })
-                
-                # Work on Holiday
-                if is_holiday:
-                    anomalies.append({
-                        "employee": emp.employee_name,
-                        "date": date_str,
-                        "type": "Work on Holiday",
-                        "description": _("Fichaje registrado en día festivo."),
-                        "severity": "Medium"
-                    })
-                
-                # Work on Leave
-                if leave:
-                    anomalies.append({
-                        "employee": emp.employee_name,
-                        "date": date_str,
-                        "type": "Work on Leave",
-                        "description": _("Fichaje durante {0}.").format(leave.leave_type),
-                        "severity": "Medium"
-                    })
-                
-                # Time Issues (>6h continuous) - Only for completed sessions
-                sorted_logs = sorted(logs, key=lambda x: x.time)
-                pairs = []
-                current_in = None
-                
-                for log in sorted_logs:
-                    if log.log_type == 'IN' and current_in is None:
-                        current_in = log.time
-                    elif log.log_type == 'OUT' and current_in:
-                        pairs.append((current_in, log.time))
-                        current_in = None
-                
-                for p_in, p_out in pairs:
-                    session_hours = (p_out - p_in).total_seconds() / 3600.0
-                    if session_hours > 6:
-                        key = (emp.employee_name, date_str)
-                        if key not in flagged_time_issues:
-                            flagged_time_issues.add(key)
-                            anomalies.append({
-                                "employee": emp.employee_name,
-                                "date": date_str,
-                                "type": "Excessive Continuous Work",
-                                "description": _("Sesión continua de {0:.1f}h sin descanso.").format(session_hours),
-                                "severity": "High"
-                            })
-            
-            # Attendance-based anomalies
-            if att:
-                if att.late_entry:
-                    anomalies.append({
-                        "employee": emp.employee_name,
-                        "date": date_str,
-                        "type": "Late Entry",
-                        "description": _("Llegada tardía") + (f" ({att.in_time})" if att.in_time else ""),
-                        "severity": "Low"
-                    })
-                if att.early_exit:
-                    anomalies.append({
-                        "employee": emp.employee_name,
-                        "date": date_str,
-                        "type": "Early Exit",
-                        "description": _("Salida anticipada") + (f" ({att.out_time})" if att.out_time else ""),
-                        "severity": "Low"
-                    })
-                if att.status == "Absent" and not leave and not is_holiday:
-                    anomalies.append({
-                        "employee": emp.employee_name,
-                        "date": date_str,
-                        "type": "Absent",
-                        "description": _("Ausencia sin justificación aprobada."),
-                        "severity": "High"
-                    })
+    # 4-5. Process Anomalies (columnar engine over checkins/attendance/leaves)
+    anomalies = detect_anomalies(employees, None, attendances, leave_index, calendar, today_date, day_stats=day_stats)
+
+    # Overlapping approved leaves (e.g. the same absence in both leave doctypes)
+    for emp_id, first, second in leave_index.overlaps():
+        overlap_start = max(first.from_date, second.from_date, start_date)
+        anomalies.append({
+            "employee": emp_map[emp_id].employee_name,
+            "date": overlap_start.strftime("%Y-%m-%d"),
+            "type": "Overlapping Leaves",
+            "description": _("{0} ({1}) se solapa con {2} ({3}).").format(
+                first.leave_type, first.name, second.leave_type, second.name
+            ),
+            "severity": "Medium"
+        })
     
     # 6. Ghost Employees (Job Offer Alta but no checkins)
     for emp_id in ghost_candidates:
@@ -824,7 +656,7 @@ def get_attendance_anomalies(from_date, to_date, employee=None, reports_to=None,
         "success": True, 
         "data": anomalies,
         "managers": [{"value": m.name, "label": m.employee_name} for m in managers],
-        "is_hr_user": is_hr_user
+        "is_hr_user": user_is_hr
     }
 
 
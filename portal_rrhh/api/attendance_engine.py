@@ -0,0 +1,201 @@
+"""
+Columnar attendance engine.
+
+Employee Checkin rows are loaded into parallel arrays (employee code, epoch
+seconds, log type) sorted by (employee, time). Sessions, missing punches and
+long sessions are then derived in linear passes over the arrays, grouped by
+(employee, day ordinal), instead of walking nested per-employee/per-date dicts.
+
+Dates are handled as proleptic ordinals (date.toordinal()) so holiday and
+leave checks are integer comparisons.
+"""
+
+import calendar
+from array import array
+from collections import namedtuple
+from datetime import date
+
+from frappe import _
+
+
+SECONDS_PER_DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+MAX_SESSION_SECONDS = 6 * 3600
+
+# Per (employee, day) aggregate computed from the checkin arrays.
+# sessions: tuple of (in_epoch, out_epoch) for completed IN->OUT pairs
+DayStats = namedtuple("DayStats", [
+    "emp_code", "ordinal", "ins", "outs", "sessions",
+    "worked_seconds", "longest_session", "first_in", "last_out"
+])
+
+
+def to_epoch(dt):
+    """Naive datetime -> epoch seconds, treating it as wall-clock time (no tz shift)."""
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def epoch_to_ordinal(epoch):
+    return int(epoch // SECONDS_PER_DAY) + EPOCH_ORDINAL
+
+
+def ordinal_to_str(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+class CheckinColumns:
+    """Checkins as columnar arrays sorted by (employee code, epoch)."""
+
+    def __init__(self, checkins, emp_ids):
+        self.emp_ids = list(emp_ids)
+        self.emp_index = {e: i for i, e in enumerate(self.emp_ids)}
+
+        rows = [
+            (self.emp_index[c.employee], to_epoch(c.time), c.log_type == "IN")
+            for c in checkins
+            if c.employee in self.emp_index
+        ]
+        rows.sort(key=lambda r: (r[0], r[1]))
+
+        self.emp_code = array("i", (r[0] for r in rows))
+        self.epoch = array("d", (r[1] for r in rows))
+        self.is_in = array("b", (r[2] for r in rows))
+        self.day = array("i", (epoch_to_ordinal(e) for e in self.epoch))
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def day_stats(self):
+        """
+        Single pass over the arrays yielding one DayStats per (employee, day)
+        with at least one checkin, in (employee, day) order.
+        """
+        n = len(self)
+        i = 0
+        emp_code, day, epoch, is_in = self.emp_code, self.day, self.epoch, self.is_in
+
+        while i < n:
+            code, ordinal = emp_code[i], day[i]
+            ins = outs = 0
+            current_in = None
+            sessions = []
+            first_in = last_out = None
+
+            while i < n and emp_code[i] == code and day[i] == ordinal:
+                t = epoch[i]
+                if is_in[i]:
+                    ins += 1
+                    if first_in is None:
+                        first_in = t
+                    if current_in is None:
+                        current_in = t
+                else:
+                    outs += 1
+                    last_out = t
+                    if current_in is not None:
+                        sessions.append((current_in, t))
+                        current_in = None
+                i += 1
+
+            durations = [s_out - s_in for s_in, s_out in sessions]
+            yield DayStats(
+                code, ordinal, ins, outs, tuple(sessions),
+                sum(durations), max(durations) if durations else 0,
+                first_in, last_out
+            )
+
+
+def detect_anomalies(employees, checkins, attendances, leave_index, holiday_calendar, today_date, day_stats=None):
+    """
+    Build the anomaly dicts returned by get_attendance_anomalies.
+
+    Args:
+        employees: Employee rows (name, employee_name, holiday_list)
+        checkins: Employee Checkin rows (employee, time, log_type); ignored when day_stats is given
+        attendances: Attendance rows (employee, attendance_date, status, late_entry, early_exit, in_time, out_time)
+        leave_index: LeaveIndex of the approved leaves (employee, from_date, to_date, leave_type)
+        holiday_calendar: HolidayCalendar covering the employees' holiday lists
+        today_date: date treated as "today" (missing punches are not flagged for it)
+        day_stats: optional precomputed DayStats (e.g. from the daily summary table),
+            with emp_code being the index in employees
+    """
+    emp_index = {e.name: i for i, e in enumerate(employees)}
+    if day_stats is None:
+        day_stats = CheckinColumns(checkins, [e.name for e in employees]).day_stats()
+    today_ord = today_date.toordinal()
+
+    attendance_by_day = {}
+    for a in attendances:
+        code = emp_index.get(a.employee)
+        if code is not None:
+            attendance_by_day[(code, a.attendance_date.toordinal())] = a
+
+    # Merge checkin days and attendance days per employee, ordered by date
+    days = {}
+    for stats in day_stats:
+        days[(stats.emp_code, stats.ordinal)] = stats
+    for key in attendance_by_day:
+        days.setdefault(key, None)
+
+    anomalies = []
+    flagged_time_issues = set()
+
+    for code, ordinal in sorted(days):
+        stats = days[(code, ordinal)]
+        emp = employees[code]
+        day = date.fromordinal(ordinal)
+        date_str = day.isoformat()
+        is_holiday = holiday_calendar.is_holiday(emp.holiday_list, day)
+        day_leaves = leave_index.at(emp.name, day)
+        leave = day_leaves[-1] if day_leaves else None
+
+        def add(type_, description, severity):
+            anomalies.append({
+                "employee": emp.employee_name,
+                "date": date_str,
+                "type": type_,
+                "description": description,
+                "severity": severity
+            })
+
+        if stats:
+            ins, outs = stats.ins, stats.outs
+
+            # Missing Punch - SKIP for current day (employee may not have clocked out yet)
+            if ordinal != today_ord:
+                if ins > outs:
+                    add("Missing Punch", _("{0} ENTRADA(s) y {1} SALIDA(s). Falta una SALIDA.").format(ins, outs), "High")
+                elif outs > ins:
+                    add("Missing Punch", _("{0} SALIDA(s) y {1} ENTRADA(s). Falta una ENTRADA.").format(outs, ins), "High")
+
+            if is_holiday:
+                add("Work on Holiday", _("Fichaje registrado en día festivo."), "Medium")
+
+            if leave:
+                add("Work on Leave", _("Fichaje durante {0}.").format(leave.leave_type), "Medium")
+
+            # Time Issues (>6h continuous) - first long completed session of the day
+            if stats.longest_session > MAX_SESSION_SECONDS:
+                key = (emp.employee_name, date_str)
+                if key not in flagged_time_issues:
+                    flagged_time_issues.add(key)
+                    session_seconds = next(
+                        s_out - s_in for s_in, s_out in stats.sessions
+                        if s_out - s_in > MAX_SESSION_SECONDS
+                    )
+                    add(
+                        "Excessive Continuous Work",
+                        _("Sesión continua de {0:.1f}h sin descanso.").format(session_seconds / 3600.0),
+                        "High"
+                    )
+
+        att = attendance_by_day.get((code, ordinal))
+        if att:
+            if att.late_entry:
+                add("Late Entry", _("Llegada tardía") + (f" ({att.in_time})" if att.in_time else ""), "Low")
+            if att.early_exit:
+                add("Early Exit", _("Salida anticipada") + (f" ({att.out_time})" if att.out_time else ""), "Low")
+            if att.status == "Absent" and not leave and not is_holiday:
+                add("Absent", _("Ausencia sin justificación aprobada."), "High")
+
+    return anomalies
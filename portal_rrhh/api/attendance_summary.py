@@ -0,0 +1,261 @@
+"""
+Precomputed daily attendance summary (DocType "Daily Attendance Summary").
+
+One row per (employee, date) with worked seconds, the completed IN -> OUT
+sessions, first in / last out, punches and the day's checkin anomaly code.
+Rows are refreshed from the Employee Checkin on_update / on_trash hooks (the
+old and the new day when a checkin is edited) and can be rebuilt with
+`bench --site <site> rebuild-attendance-summary`.
+
+Report endpoints read these rows for past days and only compute today's
+figures from raw Employee Checkin rows. Until a full rebuild has completed
+(SUMMARY_READY_KEY, set at the end of it) they compute every day from the raw
+rows instead, so a pending or failed backfill never shows empty days.
+"""
+
+import json
+from datetime import timedelta
+
+import frappe
+from frappe.utils import getdate, now, today
+
+from portal_rrhh.api.attendance_engine import (
+    MAX_SESSION_SECONDS,
+    CheckinColumns,
+    DayStats,
+    ordinal_to_str,
+    to_epoch,
+)
+
+
+SUMMARY_DOCTYPE = "Daily Attendance Summary"
+SUMMARY_READY_KEY = "portal_rrhh_attendance_summary_ready"
+
+SUMMARY_FIELDS = [
+    "employee", "attendance_date", "worked_seconds", "session_count",
+    "longest_session", "first_long_session", "checkin_count", "in_count",
+    "out_count", "first_in", "last_out", "anomaly_code", "punches", "sessions"
+]
+JSON_FIELDS = ("punches", "sessions")
+
+
+def summary_table_exists():
+    return frappe.db.table_exists(SUMMARY_DOCTYPE)
+
+
+def summary_enabled():
+    """Whether reports can read the table: it exists and a full rebuild has completed."""
+    return bool(frappe.db.get_global(SUMMARY_READY_KEY)) and summary_table_exists()
+
+
+def anomaly_code(in_count, out_count, longest_session):
+    """Checkin anomaly of a day: missing_out, missing_in, no_break or None."""
+    if in_count > out_count:
+        return "missing_out"
+    if out_count > in_count:
+        return "missing_in"
+    if longest_session > MAX_SESSION_SECONDS:
+        return "no_break"
+    return None
+
+
+def build_summary_rows(checkins, emp_ids):
+    """
+    Build summary rows (dicts keyed like SUMMARY_FIELDS) from Employee Checkin
+    rows (employee, time, log_type) ordered by time.
+    """
+    columns = CheckinColumns(checkins, emp_ids)
+
+    punches_by_day = {}
+    for c in checkins:
+        punches_by_day.setdefault((c.employee, c.time.date()), []).append(
+            [c.log_type, c.time.strftime("%H:%M")]
+        )
+
+    rows = []
+    for stats in columns.day_stats():
+        employee = columns.emp_ids[stats.emp_code]
+        day = getdate(ordinal_to_str(stats.ordinal))
+        first_long = next(
+            (s_out - s_in for s_in, s_out in stats.sessions if s_out - s_in > MAX_SESSION_SECONDS),
+            0
+        )
+        rows.append(frappe._dict({
+            "employee": employee,
+            "attendance_date": day,
+            "worked_seconds": int(round(stats.worked_seconds)),
+            "session_count": len(stats.sessions),
+            "longest_session": int(round(stats.longest_session)),
+            "first_long_session": int(round(first_long)),
+            "checkin_count": stats.ins + stats.outs,
+            "in_count": stats.ins,
+            "out_count": stats.outs,
+            "first_in": _from_epoch(stats.first_in),
+            "last_out": _from_epoch(stats.last_out),
+            "anomaly_code": anomaly_code(stats.ins, stats.outs, stats.longest_session),
+            "punches": punches_by_day.get((employee, day), []),
+            "sessions": [[s_in, s_out] for s_in, s_out in stats.sessions]
+        }))
+
+    return rows
+
+
+def _from_epoch(epoch):
+    if epoch is None:
+        return None
+    from datetime import datetime
+    return datetime(1970, 1, 1) + timedelta(seconds=epoch)
+
+
+def fetch_checkins(employees, from_date=None, to_date=None, exclude=None):
+    """Employee Checkin rows used by the summary (skip_auto_attendance = 0), ordered by time."""
+    filters = [
+        ["employee", "in", list(employees)],
+        ["skip_auto_attendance", "=", 0]
+    ]
+    if from_date:
+        filters.append(["time", ">=", getdate(from_date)])
+    if to_date:
+        filters.append(["time", "<", getdate(to_date) + timedelta(days=1)])
+    if exclude:
+        filters.append(["name", "!=", exclude])
+
+    return frappe.get_all(
+        "Employee Checkin",
+        filters=filters,
+        fields=["employee", "time", "log_type"],
+        order_by="time asc"
+    )
+
+
+def rebuild_summaries(employees=None, from_date=None, to_date=None, exclude=None):
+    """
+    Recompute summary rows for the given employees (all when None) and date range
+    (whole history when no dates are given). Works one employee at a time so a full
+    rebuild keeps memory bounded. A full rebuild marks the summary as ready for
+    the reports when it finishes. Returns the number of rows written.
+    """
+    if not summary_table_exists():
+        return 0
+
+    full_rebuild = employees is None and not from_date and not to_date
+    if employees is None:
+        employees = frappe.get_all("Employee", pluck="name")
+
+    written = 0
+    for employee in employees:
+        rows = build_summary_rows(
+            fetch_checkins([employee], from_date, to_date, exclude=exclude),
+            [employee]
+        )
+
+        delete_filters = {"employee": employee}
+        if from_date and to_date:
+            delete_filters["attendance_date"] = ["between", [getdate(from_date), getdate(to_date)]]
+        elif from_date:
+            delete_filters["attendance_date"] = [">=", getdate(from_date)]
+        elif to_date:
+            delete_filters["attendance_date"] = ["<=", getdate(to_date)]
+        frappe.db.delete(SUMMARY_DOCTYPE, delete_filters)
+
+        if rows:
+            _insert_rows(rows)
+            written += len(rows)
+
+    if full_rebuild:
+        frappe.db.set_global(SUMMARY_READY_KEY, 1)
+
+    return written
+
+
+def _insert_rows(rows):
+    timestamp = now()
+    user = frappe.session.user
+    employee_names = dict(frappe.get_all(
+        "Employee",
+        filters={"name": ["in", list({r.employee for r in rows})]},
+        fields=["name", "employee_name"],
+        as_list=True
+    ))
+
+    values = []
+    for r in rows:
+        values.append((
+            f"{r.employee}-{r.attendance_date}", user, user, timestamp, timestamp,
+            employee_names.get(r.employee),
+            *[json.dumps(r[f]) if f in JSON_FIELDS else r[f] for f in SUMMARY_FIELDS]
+        ))
+
+    frappe.db.bulk_insert(
+        SUMMARY_DOCTYPE,
+        ["name", "owner", "modified_by", "creation", "modified", "employee_name"] + SUMMARY_FIELDS,
+        values
+    )
+
+
+def on_checkin_change(doc, method=None):
+    """
+    Employee Checkin on_update / on_trash: refresh the summary of the checkin's
+    day and, when an edit moved it (employee or time), of the day it was on.
+    """
+    days = set()
+    if doc.employee and doc.time:
+        days.add((doc.employee, getdate(doc.time)))
+
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before and before.employee and before.time:
+        days.add((before.employee, getdate(before.time)))
+
+    for employee, day in days:
+        rebuild_summaries(
+            [employee], day, day,
+            exclude=doc.name if method == "on_trash" else None
+        )
+
+
+def get_summary_rows(employees, from_date, to_date):
+    """
+    Summary rows for [from_date, to_date], keyed by (employee, "YYYY-MM-DD").
+    Today's rows are computed from raw checkins; past days come from the table.
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    today_date = getdate(today())
+    employees = list(employees)
+    result = {}
+
+    if not employees:
+        return result
+
+    past_end = min(to_date, today_date - timedelta(days=1))
+    if summary_enabled() and from_date <= past_end:
+        for r in frappe.get_all(
+            SUMMARY_DOCTYPE,
+            filters={
+                "employee": ["in", employees],
+                "attendance_date": ["between", [from_date, past_end]]
+            },
+            fields=SUMMARY_FIELDS
+        ):
+            for f in JSON_FIELDS:
+                r[f] = json.loads(r[f]) if isinstance(r[f], str) else (r[f] or [])
+            result[(r.employee, str(r.attendance_date))] = r
+    elif from_date <= past_end:
+        for r in build_summary_rows(fetch_checkins(employees, from_date, past_end), employees):
+            result[(r.employee, str(r.attendance_date))] = r
+
+    live_start = max(from_date, past_end + timedelta(days=1))
+    if live_start <= to_date:
+        for r in build_summary_rows(fetch_checkins(employees, live_start, to_date), employees):
+            result[(r.employee, str(r.attendance_date))] = r
+
+    return result
+
+
+def summary_to_day_stats(row, emp_code):
+    """DayStats view of a summary row for the anomaly engine."""
+    return DayStats(
+        emp_code, getdate(row.attendance_date).toordinal(), row.in_count, row.out_count,
+        tuple((s_in, s_out) for s_in, s_out in row.sessions), row.worked_seconds, row.longest_session,
+        to_epoch(row.first_in) if row.first_in else None,
+        to_epoch(row.last_out) if row.last_out else None
+    )
@@ -0,0 +1,40 @@
+"""
+Batched access to Redis hashes written through frappe.cache().
+
+RedisWrapper only reads and writes one hash field per call (hget/hset).
+These helpers read or write many fields of one hash in a single round trip,
+keeping the key prefix (make_key) and the pickled values of
+RedisWrapper.hset, so entries stay compatible with hget/hset/hdel.
+"""
+
+import pickle
+
+import frappe
+
+
+def hget_many(name, keys):
+    """{key: value} of the given fields of hash `name` that are cached."""
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    cache = frappe.cache()
+    values = cache.hmget(cache.make_key(name), keys)
+    return {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+
+
+def hset_many(name, mapping, expires_in_sec=None):
+    """
+    Store {key: value} in hash `name` in one round trip. With expires_in_sec
+    the whole hash expires that many seconds after this write.
+    """
+    if not mapping:
+        return
+
+    cache = frappe.cache()
+    key = cache.make_key(name)
+    pipe = cache.pipeline()
+    pipe.hset(key, mapping={field: pickle.dumps(value) for field, value in mapping.items()})
+    if expires_in_sec:
+        pipe.expire(key, expires_in_sec)
+    pipe.execute()
@@ -0,0 +1,237 @@
+"""
+Competency gap summary (DocType "Competency Gap Summary").
+
+Gap counts of completed appraisals aggregated by (appraisal cycle, company,
+department, designation, competency): evaluations with a gap, gap sum, max
+gap and critical evaluations (gap >= 2). Rows with an empty competency hold
+the appraisal totals of the group (completed appraisals and appraisals with
+a critical gap).
+
+The rows of a cycle are recomputed from the Competency Appraisal hooks, so
+the gap analysis endpoints read a table whose size depends on the number of
+groups instead of the appraisal history. Department and designation are
+those of the employee when the cycle was last refreshed; rebuild everything
+with `bench --site <site> rebuild-competency-gaps`.
+
+The endpoints read the summary only after a rebuild of every cycle has
+completed (GAP_SUMMARY_READY_KEY, set at the end of it); until then they
+compute the gaps from the appraisals. Refreshes of the same cycle are
+serialized with a row lock, so concurrent saves cannot both delete and then
+both insert the cycle's rows.
+"""
+
+import frappe
+from frappe.utils import flt, now
+
+
+GAP_SUMMARY_DOCTYPE = "Competency Gap Summary"
+GAP_SUMMARY_READY_KEY = "portal_rrhh_competency_gap_summary_ready"
+GROUP_FIELDS = ["appraisal_cycle", "company", "department", "designation", "competency"]
+MEASURE_FIELDS = ["appraisal_count", "critical_appraisals", "gap_count", "gap_sum", "max_gap", "critical_count"]
+
+# Dimensions the gap analysis can be grouped by (drill-down)
+GAP_DIMENSIONS = ("competency", "appraisal_cycle", "company", "department", "designation")
+CRITICAL_GAP = 2
+
+
+def gap_summary_table_exists():
+    return frappe.db.table_exists(GAP_SUMMARY_DOCTYPE)
+
+
+def gap_summary_enabled():
+    """Whether the endpoints can read the summary: it exists and a full rebuild has completed."""
+    return bool(frappe.db.get_global(GAP_SUMMARY_READY_KEY)) and gap_summary_table_exists()
+
+
+def lock_cycle(appraisal_cycle):
+    """Row lock serializing the refreshes of one cycle until the transaction ends."""
+    if appraisal_cycle and frappe.db.sql(
+        "SELECT name FROM `tabAppraisal Cycle` WHERE name = %s FOR UPDATE", appraisal_cycle
+    ):
+        return
+    # Appraisals without cycle (or a deleted cycle): the summary DocType row is the lock
+    frappe.db.sql("SELECT name FROM `tabDocType` WHERE name = %s FOR UPDATE", GAP_SUMMARY_DOCTYPE)
+
+
+def compute_cycle_gaps(appraisal_cycle, exclude=None):
+    """
+    Summary rows of one cycle (None for appraisals without cycle).
+    exclude: name of an appraisal being deleted.
+    """
+    values = {"cycle": appraisal_cycle, "exclude": exclude or "", "critical": CRITICAL_GAP}
+    where = """
+        ca.status = 'Completado'
+        AND ca.appraisal_cycle <=> %(cycle)s
+        AND ca.name != %(exclude)s
+    """
+
+    competency_rows = frappe.db.sql(f"""
+        SELECT
+            ca.appraisal_cycle, ca.company, e.department, e.designation, ce.competency,
+            COUNT(*) AS gap_count,
+            SUM(ce.level_gap) AS gap_sum,
+            MAX(ce.level_gap) AS max_gap,
+            SUM(ce.level_gap >= %(critical)s) AS critical_count
+        FROM `tabCompetency Evaluation` ce
+        INNER JOIN `tabCompetency Appraisal` ca ON ce.parent = ca.name
+        LEFT JOIN `tabEmployee` e ON e.name = ca.employee
+        WHERE {where} AND ce.level_gap > 0
+        GROUP BY ca.appraisal_cycle, ca.company, e.department, e.designation, ce.competency
+    """, values, as_dict=True)
+
+    total_rows = frappe.db.sql(f"""
+        SELECT
+            ca.appraisal_cycle, ca.company, e.department, e.designation, NULL AS competency,
+            COUNT(*) AS appraisal_count,
+            SUM(EXISTS(
+                SELECT 1 FROM `tabCompetency Evaluation` ce
+                WHERE ce.parent = ca.name AND ce.level_gap >= %(critical)s
+            )) AS critical_appraisals
+        FROM `tabCompetency Appraisal` ca
+        LEFT JOIN `tabEmployee` e ON e.name = ca.employee
+        WHERE {where}
+        GROUP BY ca.appraisal_cycle, ca.company, e.department, e.designation
+    """, values, as_dict=True)
+
+    return competency_rows + total_rows
+
+
+def refresh_cycle_gaps(appraisal_cycle, exclude=None):
+    """Replace the summary rows of one cycle. Returns the number of rows written."""
+    if not gap_summary_table_exists():
+        return 0
+
+    lock_cycle(appraisal_cycle)
+    rows = compute_cycle_gaps(appraisal_cycle, exclude=exclude)
+    frappe.db.sql(
+        f"DELETE FROM `tab{GAP_SUMMARY_DOCTYPE}` WHERE appraisal_cycle <=> %(cycle)s",
+        {"cycle": appraisal_cycle}
+    )
+    _insert_rows(rows)
+    return len(rows)
+
+
+def rebuild_competency_gaps(appraisal_cycles=None):
+    """
+    Recompute the summary of the given cycles (all when None). Returns the
+    number of rows written. Rebuilding every cycle marks the summary as ready
+    for reads.
+    """
+    if not gap_summary_table_exists():
+        return 0
+
+    full_rebuild = appraisal_cycles is None
+    if full_rebuild:
+        appraisal_cycles = frappe.db.sql_list("""
+            SELECT DISTINCT appraisal_cycle FROM `tabCompetency Appraisal`
+            UNION
+            SELECT DISTINCT appraisal_cycle FROM `tabCompetency Gap Summary`
+        """)
+
+    written = sum(refresh_cycle_gaps(cycle) for cycle in appraisal_cycles)
+
+    if full_rebuild:
+        frappe.db.set_global(GAP_SUMMARY_READY_KEY, 1)
+
+    return written
+
+
+def _insert_rows(rows):
+    if not rows:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        GAP_SUMMARY_DOCTYPE,
+        ["name", "owner", "modified_by", "creation", "modified"] + GROUP_FIELDS + MEASURE_FIELDS,
+        [
+            (
+                frappe.generate_hash(length=10), user, user, timestamp, timestamp,
+                *[r.get(f) for f in GROUP_FIELDS],
+                *[r.get(f) or 0 for f in MEASURE_FIELDS]
+            )
+            for r in rows
+        ]
+    )
+
+
+def on_appraisal_change(doc, method=None):
+    """
+    Competency Appraisal doc_events (on_update also runs on submit): refresh the
+    cycle (old and new) when the appraisal is or was completed.
+    """
+    before = doc.get_doc_before_save() if method != "on_trash" else None
+    if doc.status != "Completado" and not (before and before.status == "Completado"):
+        return
+
+    cycles = {doc.appraisal_cycle}
+    if before:
+        cycles.add(before.appraisal_cycle)
+
+    # Always lock the cycles in the same order
+    for cycle in sorted(cycles, key=lambda c: c or ""):
+        refresh_cycle_gaps(cycle, exclude=doc.name if method == "on_trash" else None)
+
+
+def _summary_conditions(filters):
+    conditions = []
+    values = {}
+    for field in GROUP_FIELDS:
+        if filters.get(field):
+            conditions.append(f"g.{field} = %({field})s")
+            values[field] = filters[field]
+    return conditions, values
+
+
+def get_gap_summary(filters=None, group_by="competency", limit=20):
+    """
+    Gap analysis read from the summary: evaluation_count, avg_gap, max_gap and
+    critical_count per value of group_by (one of GAP_DIMENSIONS), restricted by
+    the cycle/company/department/designation/competency filters.
+    Grouped by competency, rows also carry the competency name, code and category.
+    """
+    if group_by not in GAP_DIMENSIONS:
+        frappe.throw(frappe._("No se puede agrupar por {0}").format(group_by))
+
+    conditions, values = _summary_conditions(filters or {})
+    conditions.append("g.competency IS NOT NULL")
+    values["limit"] = int(limit)
+
+    if group_by == "competency":
+        select = "g.competency, c.competency_name, c.competency_code, c.category"
+        join = "INNER JOIN `tabCompetency` c ON c.name = g.competency"
+        group = "g.competency, c.competency_name, c.competency_code, c.category"
+    else:
+        select = f"g.{group_by}"
+        join = ""
+        group = f"g.{group_by}"
+
+    return frappe.db.sql(f"""
+        SELECT
+            {select},
+            SUM(g.gap_count) AS evaluation_count,
+            SUM(g.gap_sum) / SUM(g.gap_count) AS avg_gap,
+            MAX(g.max_gap) AS max_gap,
+            SUM(g.critical_count) AS critical_count
+        FROM `tabCompetency Gap Summary` g
+        {join}
+        WHERE {" AND ".join(conditions)}
+        GROUP BY {group}
+        HAVING avg_gap > 0
+        ORDER BY avg_gap DESC
+        LIMIT %(limit)s
+    """, values, as_dict=True)
+
+
+def get_critical_appraisal_count(filters=None):
+    """Completed appraisals with at least one critical gap, from the summary totals."""
+    conditions, values = _summary_conditions(filters or {})
+    conditions.append("g.competency IS NULL")
+
+    result = frappe.db.sql(f"""
+        SELECT SUM(g.critical_appraisals)
+        FROM `tabCompetency Gap Summary` g
+        WHERE {" AND ".join(conditions)}
+    """, values)
+    return int(flt(result[0][0])) if result else 0
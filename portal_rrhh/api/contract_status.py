@@ -0,0 +1,246 @@
+"""
+Per-employee contract status index (DocType "Employee Contract Status").
+
+One row per employee with the status derived from the Job Offers sharing the
+employee's DNI/NIE (Alta / Baja / Sin Hojas / Sin DNI), the companies of the
+Alta and of all Job Offers, provinces, the number of Alta Job Offers and the
+latest end date. Rows are refreshed from Job Offer, Modificaciones RRHH and
+Employee hooks and can be rebuilt with
+`bench --site <site> rebuild-contract-status`.
+
+Listings read the index only after a full rebuild has completed
+(CONTRACT_STATUS_READY_KEY, set at the end of it); until then they derive the
+status from the Job Offers, so a pending or failed backfill never shows every
+employee as "Sin Hojas".
+"""
+
+import json
+
+import frappe
+from frappe.utils import getdate, now
+
+
+CONTRACT_STATUS_DOCTYPE = "Employee Contract Status"
+CONTRACT_STATUS_READY_KEY = "portal_rrhh_contract_status_ready"
+
+CONTRACT_STATUS_FIELDS = [
+    "employee", "custom_dninie", "contract_status", "active_job_offers",
+    "latest_fecha_fin", "active_companies", "all_companies", "provinces"
+]
+JSON_FIELDS = ("active_companies", "all_companies", "provinces")
+
+# Text shown next to the companies in the employee listings
+STATUS_TEXT = {
+    "Alta": "De alta en:",
+    "Baja": "Hojas antiguas en:",
+    "Sin Hojas": "Sin hojas",
+    "Sin DNI": "Sin DNI",
+}
+
+REBUILD_CHUNK_SIZE = 500
+
+
+def contract_status_table_exists():
+    return frappe.db.table_exists(CONTRACT_STATUS_DOCTYPE)
+
+
+def contract_status_enabled():
+    """Whether listings can read the index: it exists and a full rebuild has completed."""
+    return bool(frappe.db.get_global(CONTRACT_STATUS_READY_KEY)) and contract_status_table_exists()
+
+
+def compute_contract_status(dni, job_offers, modificaciones=()):
+    """
+    Contract status of an employee from its Job Offers (company, workflow_state,
+    custom_provincia, custom_fecha_fin) and Alta Modificaciones RRHH
+    (custom_provincia, end_date).
+    """
+    if not dni:
+        return {
+            "contract_status": "Sin DNI", "active_job_offers": 0, "latest_fecha_fin": None,
+            "active_companies": [], "all_companies": [], "provinces": []
+        }
+
+    states = [jo.workflow_state for jo in job_offers if jo.workflow_state]
+    if "Alta" in states:
+        status = "Alta"
+    elif states:
+        status = "Baja"
+    else:
+        status = "Sin Hojas"
+
+    end_dates = [getdate(jo.custom_fecha_fin) for jo in job_offers if jo.custom_fecha_fin]
+    end_dates += [getdate(m.end_date) for m in modificaciones if m.end_date]
+    provinces = {jo.custom_provincia for jo in job_offers if jo.custom_provincia}
+    provinces.update(m.custom_provincia for m in modificaciones if m.custom_provincia)
+
+    return {
+        "contract_status": status,
+        "active_job_offers": len([s for s in states if s == "Alta"]),
+        "latest_fecha_fin": max(end_dates) if end_dates else None,
+        "active_companies": sorted({jo.company for jo in job_offers if jo.company and jo.workflow_state == "Alta"}),
+        "all_companies": sorted({jo.company for jo in job_offers if jo.company}),
+        "provinces": sorted(provinces),
+    }
+
+
+def build_contract_status_rows(employees, exclude=None):
+    """
+    Rows for the given Employee records (name, employee_name, custom_dninie).
+    exclude: (doctype, name) of a document being deleted.
+    """
+    dnis = list({e.custom_dninie for e in employees if e.custom_dninie})
+    names = [e.name for e in employees]
+    exclude_doctype, exclude_name = exclude or (None, None)
+
+    job_offers_by_dni = {}
+    if dnis:
+        for jo in frappe.get_all(
+            "Job Offer",
+            filters={"custom_dninie": ["in", dnis]},
+            fields=["name", "custom_dninie", "company", "workflow_state", "custom_provincia", "custom_fecha_fin"]
+        ):
+            if exclude_doctype == "Job Offer" and jo.name == exclude_name:
+                continue
+            job_offers_by_dni.setdefault(jo.custom_dninie, []).append(jo)
+
+    modificaciones_by_employee = {}
+    for mod in frappe.get_all(
+        "Modificaciones RRHH",
+        filters={"employee": ["in", names], "docstatus": 1, "workflow_state": "Alta"},
+        fields=["name", "employee", "custom_provincia", "end_date"]
+    ):
+        if exclude_doctype == "Modificaciones RRHH" and mod.name == exclude_name:
+            continue
+        modificaciones_by_employee.setdefault(mod.employee, []).append(mod)
+
+    rows = []
+    for e in employees:
+        row = compute_contract_status(
+            e.custom_dninie,
+            job_offers_by_dni.get(e.custom_dninie, []),
+            modificaciones_by_employee.get(e.name, [])
+        )
+        row.update({"employee": e.name, "employee_name": e.employee_name, "custom_dninie": e.custom_dninie})
+        rows.append(frappe._dict(row))
+
+    return rows
+
+
+def rebuild_contract_status(employees=None, exclude=None):
+    """
+    Recompute index rows for the given employees (all when None), in chunks of
+    REBUILD_CHUNK_SIZE. Returns the number of rows written. A full rebuild
+    marks the index as ready for reads.
+    """
+    if not contract_status_table_exists():
+        return 0
+
+    filters = {}
+    if employees is not None:
+        employees = list(employees)
+        if not employees:
+            return 0
+        filters["name"] = ["in", employees]
+
+    records = frappe.get_all(
+        "Employee",
+        filters=filters,
+        fields=["name", "employee_name", "custom_dninie"],
+        order_by="name asc"
+    )
+
+    written = 0
+    for i in range(0, len(records), REBUILD_CHUNK_SIZE):
+        chunk = records[i:i + REBUILD_CHUNK_SIZE]
+        rows = build_contract_status_rows(chunk, exclude=exclude)
+        frappe.db.delete(CONTRACT_STATUS_DOCTYPE, {"employee": ["in", [e.name for e in chunk]]})
+        _insert_rows(rows)
+        written += len(rows)
+
+    if employees is None:
+        frappe.db.set_global(CONTRACT_STATUS_READY_KEY, 1)
+
+    return written
+
+
+def _insert_rows(rows):
+    if not rows:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        CONTRACT_STATUS_DOCTYPE,
+        ["name", "owner", "modified_by", "creation", "modified", "employee_name"] + CONTRACT_STATUS_FIELDS,
+        [
+            (
+                r.employee, user, user, timestamp, timestamp, r.employee_name,
+                *[json.dumps(r[f]) if f in JSON_FIELDS else r[f] for f in CONTRACT_STATUS_FIELDS]
+            )
+            for r in rows
+        ]
+    )
+
+
+def employees_for_dnis(dnis):
+    dnis = [d for d in dnis if d]
+    if not dnis:
+        return []
+    return frappe.get_all("Employee", filters={"custom_dninie": ["in", dnis]}, pluck="name")
+
+
+def on_job_offer_change(doc, method=None):
+    """Job Offer doc_events: refresh the employees sharing its DNI/NIE (old and new)."""
+    dnis = {doc.get("custom_dninie")}
+    before = doc.get_doc_before_save() if method != "on_trash" else None
+    if before:
+        dnis.add(before.get("custom_dninie"))
+
+    rebuild_contract_status(
+        employees_for_dnis(dnis),
+        exclude=("Job Offer", doc.name) if method == "on_trash" else None
+    )
+
+
+def on_modificacion_change(doc, method=None):
+    """Modificaciones RRHH doc_events: refresh the modification's employee."""
+    if not doc.get("employee"):
+        return
+
+    rebuild_contract_status(
+        [doc.employee],
+        exclude=("Modificaciones RRHH", doc.name) if method == "on_trash" else None
+    )
+
+
+def on_employee_change(doc, method=None):
+    """Employee doc_events: drop the row on delete, refresh it when the DNI/NIE or name changes."""
+    if not contract_status_table_exists():
+        return
+
+    if method == "on_trash":
+        frappe.db.delete(CONTRACT_STATUS_DOCTYPE, {"employee": doc.name})
+        return
+
+    if doc.has_value_changed("custom_dninie") or doc.has_value_changed("employee_name"):
+        rebuild_contract_status([doc.name])
+
+
+def get_contract_status_map(employees):
+    """Index rows keyed by employee, with the JSON fields decoded. Empty if the index is missing."""
+    employees = list(employees)
+    if not employees or not contract_status_enabled():
+        return {}
+
+    result = {}
+    for r in frappe.get_all(
+        CONTRACT_STATUS_DOCTYPE,
+        filters={"employee": ["in", employees]},
+        fields=CONTRACT_STATUS_FIELDS
+    ):
+        for f in JSON_FIELDS:
+            r[f] = json.loads(r[f]) if isinstance(r[f], str) else (r[f] or [])
+        result[r.employee] = r
+
+    return result
@@ -1,71 +1,16 @@
 import frappe
 from frappe import _
-from frappe.utils import getdate, today, add_days, date_diff, nowdate, get_first_day, get_last_day, flt
+from frappe.utils import getdate, today, add_days, date_diff, nowdate, get_first_day, get_last_day, flt, cint
 from datetime import datetime, timedelta
 
+from portal_rrhh.api.attachments import add_attachments
+from portal_rrhh.api.attendance_summary import get_summary_rows
+from portal_rrhh.api.contract_status import contract_status_enabled, get_contract_status_map
+from portal_rrhh.api.team import get_managed_employees
 
-def get_managed_employees(user=None):
-    """
-    Get employees that the current user manages (as department head).
-    Returns a list of employee IDs that this user can manage.
-    """
-    if not user:
-        user = frappe.session.user
-    
-    if user == "Administrator":
-        # Admin sees all active employees
-        return frappe.get_all("Employee", filters={"status": "Active"}, pluck="name")
-    
-    roles = frappe.get_roles(user)
-    
-    # Check if user has management roles
-    is_hr_manager = "HR Manager" in roles or "HR User" in roles
-    is_dept_manager = "Responsable de Departamento" in roles or "Responsable Departamento" in roles
-    
-    if is_hr_manager:
-        # HR managers can see all employees
-        return frappe.get_all("Employee", filters={"status": "Active"}, pluck="name")
-    
-    allowed_employees = set()
-    
-    # Get employees where this user is leave_approver
-    employees_by_approver = frappe.get_all(
-        "Employee",
-        filters={"leave_approver": user, "status": "Active"},
-        pluck="name"
-    )
-    allowed_employees.update(employees_by_approver)
-    
-    # Get employees where this user is reports_to (through Employee link)
-    user_employee = frappe.db.get_value("Employee", {"user_id": user}, "name")
-    if user_employee:
-        employees_by_reports_to = frappe.get_all(
-            "Employee",
-            filters={"reports_to": user_employee, "status": "Active"},
-            pluck="name"
-        )
-        allowed_employees.update(employees_by_reports_to)
-    
-    # Get departments where this user is an approver
-    if is_dept_manager:
-        managed_departments = frappe.get_all(
-            "Department Approver",
-            filters={
-                "approver": user,
-                "parentfield": ["in", ["leave_approvers", "expense_approvers", "shift_request_approver"]]
-            },
-            pluck="parent"
-        )
-        
-        if managed_departments:
-            dept_employees = frappe.get_all(
-                "Employee",
-                filters={"status": "Active", "department": ["in", managed_departments]},
-                pluck="name"
-            )
-            allowed_employees.update(dept_employees)
-    
-    return list(allowed_employees)
+
+DASHBOARD_CACHE_PREFIX = "portal_rrhh:department_dashboard:"
+DASHBOARD_CACHE_TTL = 60
 
 
 @frappe.whitelist()
@@ -78,8 +23,16 @@ def get_department_dashboard():
     - Attendance summary
     - Job offers
     - Timesheets
+    
+    The result is cached per user for DASHBOARD_CACHE_TTL seconds and dropped
+    when a leave request or checkin changes (see clear_dashboard_cache).
     """
     user = frappe.session.user
+    cache_key = DASHBOARD_CACHE_PREFIX + user
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached
+    
     managed_employees = get_managed_employees(user)
     
     if not managed_employees:
@@ -90,25 +43,48 @@ def get_department_dashboard():
         }
     
     today_date = getdate(today())
-    current_month_start = get_first_day(today_date)
-    current_month_end = get_last_day(today_date)
     week_start = today_date - timedelta(days=today_date.weekday())
-    week_end = week_start + timedelta(days=6)
-    
-    # Get employee details
+    ctx = frappe._dict({
+        "user": user,
+        "managed_employees": managed_employees,
+        "today_date": today_date,
+        "current_month_start": get_first_day(today_date),
+        "current_month_end": get_last_day(today_date),
+        "week_start": week_start,
+        "week_end": week_start + timedelta(days=6),
+    })
+    
+    # Each provider adds its keys to data and may read earlier sections
+    data = {}
+    for provider in DASHBOARD_SECTIONS:
+        data.update(provider(ctx, data))
+    
+    result = {"success": True, "data": data}
+    frappe.cache().set_value(cache_key, result, expires_in_sec=DASHBOARD_CACHE_TTL)
+    return result
+
+
+def clear_dashboard_cache(doc=None, method=None):
+    """Drop cached department dashboards (doc_events handler for leaves and checkins)."""
+    frappe.cache().delete_keys(DASHBOARD_CACHE_PREFIX)
+
+
+def dashboard_team_section(ctx, data):
+    """Employee details and team summary"""
     employees = frappe.get_all(
         "Employee",
-        filters={"name": ["in", managed_employees]},
+        filters={"name": ["in", ctx.managed_employees]},
         fields=[
             "name", "employee_name", "department", "designation", 
             "status", "date_of_joining", "image", "company_email",
-            "personal_email", "cell_number", "custom_centro"
+            "personal_email", "cell_number", "custom_centro", "custom_dninie"
         ]
     )
     
-    employee_map = {e.name: e for e in employees}
+    # DNIs are only used by the job offers section
+    ctx.employee_dnis = [dni for dni in (e.pop("custom_dninie") for e in employees) if dni]
+    ctx.employee_map = {e.name: e for e in employees}
     
-    # === TEAM SUMMARY ===
     team_summary = {
         "total_employees": len(employees),
         "active_employees": len([e for e in employees if e.status == "Active"]),
@@ -116,7 +92,13 @@ def get_department_dashboard():
         "designations": list(set([e.designation for e in employees if e.designation]))
     }
     
-    # === LEAVE REQUESTS (Spanish Leave Application) ===
+    return {"team_summary": team_summary, "employees": employees}
+
+
+def dashboard_leave_section(ctx, data):
+    """Spanish Leave Application requests: pending, approved this month, upcoming"""
+    managed_employees = ctx.managed_employees
+    
     # Pending requests
     pending_leaves = frappe.get_all(
         "Spanish Leave Application",
@@ -138,8 +120,8 @@ def get_department_dashboard():
         filters={
             "employee": ["in", managed_employees],
             "status": "Aprobada",
-            "from_date": ["<=", current_month_end],
-            "to_date": [">=", current_month_start]
+            "from_date": ["<=", ctx.current_month_end],
+            "to_date": [">=", ctx.current_month_start]
         },
         fields=[
             "name", "employee", "employee_name", "leave_type", "status",
@@ -154,7 +136,7 @@ def get_department_dashboard():
         filters={
             "employee": ["in", managed_employees],
             "status": "Aprobada",
-            "from_date": ["between", [today_date, add_days(today_date, 30)]]
+            "from_date": ["between", [ctx.today_date, add_days(ctx.today_date, 30)]]
         },
         fields=[
             "name", "employee", "employee_name", "leave_type",
@@ -169,17 +151,23 @@ def get_department_dashboard():
         lt = leave.leave_type or "Sin tipo"
         leave_type_counts[lt] = leave_type_counts.get(lt, 0) + 1
     
-    leave_summary = {
-        "pending_count": len(pending_leaves),
-        "pending_requests": pending_leaves,
-        "approved_this_month": len(approved_leaves_month),
-        "approved_leaves_month": approved_leaves_month,
-        "upcoming_leaves": upcoming_leaves,
-        "by_type": leave_type_counts
+    return {
+        "leave_summary": {
+            "pending_count": len(pending_leaves),
+            "pending_requests": pending_leaves,
+            "approved_this_month": len(approved_leaves_month),
+            "approved_leaves_month": approved_leaves_month,
+            "upcoming_leaves": upcoming_leaves,
+            "by_type": leave_type_counts
+        }
     }
+
+
+def dashboard_attendance_section(ctx, data):
+    """Today's attendance and this week's checkins"""
+    managed_employees = ctx.managed_employees
+    today_date = ctx.today_date
     
-    # === ATTENDANCE SUMMARY ===
-    # Today's attendance
     today_attendances = frappe.get_all(
         "Attendance",
         filters={
@@ -190,70 +178,55 @@ def get_department_dashboard():
         fields=["employee", "status", "in_time", "out_time", "working_hours"]
     )
     
-    present_today = [a for a in today_attendances if a.status == "Present"]
-    absent_today = [a for a in today_attendances if a.status == "Absent"]
-    on_leave_today = [a for a in today_attendances if a.status == "On Leave"]
-    wfh_today = [a for a in today_attendances if a.status == "Work From Home"]
+    status_counts = {}
+    for a in today_attendances:
+        status_counts[a.status] = status_counts.get(a.status, 0) + 1
     
     # Employees without attendance today
-    employees_with_attendance = [a.employee for a in today_attendances]
+    employees_with_attendance = {a.employee for a in today_attendances}
     employees_without_attendance = [e for e in managed_employees if e not in employees_with_attendance]
     
-    # This week checkins
-    week_checkins = frappe.get_all(
-        "Employee Checkin",
-        filters={
-            "employee": ["in", managed_employees],
-            "time": ["between", [week_start, week_end + timedelta(days=1)]]
-        },
-        fields=["employee", "time", "log_type"]
-    )
+    # This week checkins (daily summary table; raw checkins only for today)
+    week_summaries = get_summary_rows(managed_employees, ctx.week_start, min(ctx.week_end, today_date))
     
     # Group by employee and count checkins per day
     checkin_summary = {}
-    for checkin in week_checkins:
-        emp = checkin.employee
+    for (emp, _date), day in week_summaries.items():
         if emp not in checkin_summary:
-            checkin_summary[emp] = {"total_checkins": 0, "days_worked": set()}
-        checkin_summary[emp]["total_checkins"] += 1
-        checkin_summary[emp]["days_worked"].add(checkin.time.date())
-    
-    # Convert sets to counts
-    for emp in checkin_summary:
-        checkin_summary[emp]["days_worked"] = len(checkin_summary[emp]["days_worked"])
-    
-    attendance_summary = {
-        "today": {
-            "total": len(today_attendances),
-            "present": len(present_today),
-            "absent": len(absent_today),
-            "on_leave": len(on_leave_today),
-            "wfh": len(wfh_today),
-            "no_record": len(employees_without_attendance)
-        },
-        "employees_without_attendance_today": [
-            {
-                "name": e,
-                "employee_name": employee_map.get(e, {}).get("employee_name", e)
-            }
-            for e in employees_without_attendance[:10]  # Limit to 10
-        ],
-        "week_checkins": checkin_summary
-    }
-    
-    # === JOB OFFERS ===
-    # Get DNIs of managed employees
-    employee_dnis = []
-    for emp in employees:
-        dni = frappe.db.get_value("Employee", emp.name, "custom_dninie")
-        if dni:
-            employee_dnis.append(dni)
+            checkin_summary[emp] = {"total_checkins": 0, "days_worked": 0}
+        checkin_summary[emp]["total_checkins"] += day.checkin_count
+        checkin_summary[emp]["days_worked"] += 1
     
+    employee_map = ctx.employee_map or {}
+    return {
+        "attendance_summary": {
+            "today": {
+                "total": len(today_attendances),
+                "present": status_counts.get("Present", 0),
+                "absent": status_counts.get("Absent", 0),
+                "on_leave": status_counts.get("On Leave", 0),
+                "wfh": status_counts.get("Work From Home", 0),
+                "no_record": len(employees_without_attendance)
+            },
+            "employees_without_attendance_today": [
+                {
+                    "name": e,
+                    "employee_name": employee_map.get(e, {}).get("employee_name", e)
+                }
+                for e in employees_without_attendance[:10]  # Limit to 10
+            ],
+            "week_checkins": checkin_summary
+        }
+    }
+
+
+def dashboard_job_offer_section(ctx, data):
+    """Job Offers of the managed employees (matched by DNI/NIE)"""
     job_offers = []
-    if employee_dnis:
+    if ctx.employee_dnis:
         job_offers = frappe.get_all(
             "Job Offer",
-            filters={"custom_dninie": ["in", employee_dnis]},
+            filters={"custom_dninie": ["in", ctx.employee_dnis]},
             fields=[
                 "name", "applicant_name", "status", "workflow_state",
                 "designation", "company", "custom_fecha_inicio", "custom_fecha_fin",
@@ -270,26 +243,28 @@ def get_department_dashboard():
     expiring_soon = []
     for jo in active_job_offers:
         if jo.custom_fecha_fin:
-            end_date = getdate(jo.custom_fecha_fin)
-            days_until_expiry = date_diff(end_date, today_date)
+            days_until_expiry = date_diff(getdate(jo.custom_fecha_fin), ctx.today_date)
             if 0 <= days_until_expiry <= 30:
                 jo["days_until_expiry"] = days_until_expiry
                 expiring_soon.append(jo)
     
-    job_offer_summary = {
-        "total": len(job_offers),
-        "active": len(active_job_offers),
-        "expiring_soon": expiring_soon,
-        "recent": job_offers[:5]  # Last 5
+    return {
+        "job_offer_summary": {
+            "total": len(job_offers),
+            "active": len(active_job_offers),
+            "expiring_soon": expiring_soon,
+            "recent": job_offers[:5]  # Last 5
+        }
     }
-    
-    # === TIMESHEETS ===
-    # This month timesheets
+
+
+def dashboard_timesheet_section(ctx, data):
+    """This month's timesheets"""
     timesheets = frappe.get_all(
         "Timesheet",
         filters={
-            "employee": ["in", managed_employees],
-            "start_date": [">=", current_month_start],
+            "employee": ["in", ctx.managed_employees],
+            "start_date": [">=", ctx.current_month_start],
             "docstatus": ["!=", 2]
         },
         fields=[
@@ -299,59 +274,103 @@ def get_department_dashboard():
         order_by="start_date desc"
     )
     
-    # Group by status
-    ts_draft = [t for t in timesheets if t.docstatus == 0]
-    ts_submitted = [t for t in timesheets if t.docstatus == 1]
-    
-    # Total hours this month
-    total_hours = sum([flt(t.total_hours) for t in timesheets])
-    
-    timesheet_summary = {
-        "total": len(timesheets),
-        "draft": len(ts_draft),
-        "submitted": len(ts_submitted),
-        "total_hours": round(total_hours, 2),
-        "recent": timesheets[:5]
+    return {
+        "timesheet_summary": {
+            "total": len(timesheets),
+            "draft": len([t for t in timesheets if t.docstatus == 0]),
+            "submitted": len([t for t in timesheets if t.docstatus == 1]),
+            "total_hours": round(sum(flt(t.total_hours) for t in timesheets), 2),
+            "recent": timesheets[:5]
+        }
     }
-    
-    # === CALENDAR EVENTS (Leaves for calendar view) ===
+
+
+def dashboard_calendar_section(ctx, data):
+    """Calendar events built from the leave section (no extra queries)"""
+    leave_summary = data.get("leave_summary") or {}
     calendar_events = []
-    
-    # Add approved leaves
-    for leave in approved_leaves_month:
-        calendar_events.append({
-            "id": leave.name,
-            "title": f"{leave.employee_name} - {leave.leave_type}",
-            "start": str(leave.from_date),
-            "end": str(leave.to_date),
-            "type": "leave",
-            "color": "#EF4444"  # Red for leaves
-        })
-    
-    # Add upcoming leaves
-    for leave in upcoming_leaves:
-        if leave.name not in [e["id"] for e in calendar_events]:
+    seen = set()
+    
+    # Approved leaves in red, upcoming leaves not already listed in orange
+    for leaves, color in (
+        (leave_summary.get("approved_leaves_month", []), "#EF4444"),
+        (leave_summary.get("upcoming_leaves", []), "#F59E0B")
+    ):
+        for leave in leaves:
+            if leave.name in seen:
+                continue
+            seen.add(leave.name)
             calendar_events.append({
                 "id": leave.name,
                 "title": f"{leave.employee_name} - {leave.leave_type}",
                 "start": str(leave.from_date),
                 "end": str(leave.to_date),
                 "type": "leave",
-                "color": "#F59E0B"  # Orange for upcoming
+                "color": color
             })
     
-    return {
-        "success": True,
-        "data": {
-            "team_summary": team_summary,
-            "leave_summary": leave_summary,
-            "attendance_summary": attendance_summary,
-            "job_offer_summary": job_offer_summary,
-            "timesheet_summary": timesheet_summary,
-            "calendar_events": calendar_events,
-            "employees": employees
-        }
-    }
+    return {"calendar_events": calendar_events}
+
+
+# Dashboard sections in evaluation order (calendar reads the leave section)
+DASHBOARD_SECTIONS = [
+    dashboard_team_section,
+    dashboard_leave_section,
+    dashboard_attendance_section,
+    dashboard_job_offer_section,
+    dashboard_timesheet_section,
+    dashboard_calendar_section,
+]
+
+
+def get_pending_leave_counts(employees):
+    """Open Spanish Leave Applications per employee: {employee: count}"""
+    if not employees:
+        return {}
+    
+    return dict(frappe.get_all(
+        "Spanish Leave Application",
+        filters={"employee": ["in", employees], "status": "Abierta"},
+        fields=["employee", "count(name) as count"],
+        group_by="employee",
+        as_list=True
+    ))
+
+
+def get_attendance_by_employee(employees, attendance_date):
+    """Latest non-cancelled Attendance of each employee for a date: {employee: {status, in_time, out_time}}"""
+    if not employees:
+        return {}
+    
+    result = {}
+    for att in frappe.get_all(
+        "Attendance",
+        filters={
+            "employee": ["in", employees],
+            "attendance_date": attendance_date,
+            "docstatus": ["!=", 2]
+        },
+        fields=["employee", "status", "in_time", "out_time"],
+        order_by="modified desc"
+    ):
+        employee = att.pop("employee")
+        result.setdefault(employee, att)
+    
+    return result
+
+
+def get_active_job_offer_counts(dnis):
+    """Job Offers in state 'Alta' per DNI/NIE: {dni: count}"""
+    if not dnis:
+        return {}
+    
+    return dict(frappe.get_all(
+        "Job Offer",
+        filters={"custom_dninie": ["in", list(set(dnis))], "workflow_state": "Alta"},
+        fields=["custom_dninie", "count(name) as count"],
+        group_by="custom_dninie",
+        as_list=True
+    ))
 
 
 @frappe.whitelist()
@@ -372,46 +391,39 @@ def get_team_members():
             "name", "employee_name", "department", "designation",
             "status", "date_of_joining", "image", "company_email",
             "personal_email", "cell_number", "custom_centro",
-            "leave_approver", "reports_to"
+            "leave_approver", "reports_to", "custom_dninie"
         ],
         order_by="employee_name asc"
     )
     
-    # Enrich with additional data
+    # Enrich with additional data (one grouped query per source)
+    employee_ids = [emp.name for emp in employees]
+    dni_map = {emp.name: emp.pop("custom_dninie") for emp in employees}
+    pending_leaves = get_pending_leave_counts(employee_ids)
+    today_attendance = get_attendance_by_employee(employee_ids, today())
+    if contract_status_enabled():
+        # Alta Job Offer counts from the Employee Contract Status index
+        status_map = get_contract_status_map(employee_ids)
+        job_offers = {dni_map[e]: row.active_job_offers for e, row in status_map.items() if dni_map.get(e)}
+    else:
+        job_offers = get_active_job_offer_counts([dni for dni in dni_map.values() if dni])
+    
     for emp in employees:
-        # Get pending leave count
-        emp["pending_leaves"] = frappe.db.count(
-            "Spanish Leave Application",
-            filters={"employee": emp.name, "status": "Abierta"}
-        )
-        
-        # Get today's attendance
-        today_attendance = frappe.db.get_value(
-            "Attendance",
-            {"employee": emp.name, "attendance_date": today(), "docstatus": ["!=", 2]},
-            ["status", "in_time", "out_time"],
-            as_dict=True
-        )
-        emp["today_attendance"] = today_attendance
-        
-        # Get active job offer count
-        dni = frappe.db.get_value("Employee", emp.name, "custom_dninie")
-        if dni:
-            emp["active_job_offers"] = frappe.db.count(
-                "Job Offer",
-                filters={"custom_dninie": dni, "workflow_state": "Alta"}
-            )
-        else:
-            emp["active_job_offers"] = 0
+        dni = dni_map.get(emp.name)
+        emp["pending_leaves"] = pending_leaves.get(emp.name, 0)
+        emp["today_attendance"] = today_attendance.get(emp.name)
+        emp["active_job_offers"] = job_offers.get(dni, 0) if dni else 0
     
     return employees
 
 
 @frappe.whitelist()
-def get_pending_approvals():
+def get_pending_approvals(with_attachments=1):
     """
     Get all pending approvals for the current manager.
     Includes: Leave requests, Attendance regularization, etc.
+    with_attachments: If 0, leave attachments are not included
+    (load them with spanish_leave.get_leave_attachments)
     """
     user = frappe.session.user
     
@@ -431,23 +443,12 @@ def get_pending_approvals():
     )
     
     # Add attachments
-    if pending_leaves:
-        leave_names = [l.name for l in pending_leaves]
-        files = frappe.get_all(
-            "File",
-            filters={
-                "attached_to_doctype": "Spanish Leave Application",
-                "attached_to_name": ["in", leave_names]
-            },
-            fields=["file_url", "attached_to_name"]
-        )
-        file_map = {f.attached_to_name: f.file_url for f in files}
-        for l in pending_leaves:
-            l["attachment"] = file_map.get(l.name)
+    if cint(with_attachments):
+        add_attachments(pending_leaves, "Spanish Leave Application")
     
     # Get pending attendance requests if doctype exists
     pending_attendance_requests = []
-    if frappe.db.table_exists("tabAttendance Request"):
+    if frappe.db.table_exists("Attendance Request"):
         pending_attendance_requests = frappe.get_all(
             "Attendance Request",
             filters={
@@ -1,45 +1,61 @@
 import frappe
 from frappe import _
 
+from portal_rrhh.api.contract_status import STATUS_TEXT, contract_status_enabled, get_contract_status_map
+from portal_rrhh.api.employee_search import SEARCH_MATCH_LIMIT, search_employees
+from portal_rrhh.api.permissions import NO_ACCESS, filter_readable, get_permission_predicate
+
 def filter_by_permissions(documents, doctype):
-    """Filtra documentos según los permisos del usuario"""
+    """Filtra documentos según los permisos del usuario (una consulta para todo el conjunto)"""
     if not documents:
         return []
     
-    filtered = []
-    for doc in documents:
-        doc_name = doc.get('name') if isinstance(doc, dict) else doc
-        try:
-            # Verificar permisos de lectura usando frappe.get_doc con ignore_permissions=False
-            # Esto respeta automáticamente los permisos de usuario y roles
-            if frappe.has_permission(doctype, "read", doc_name if isinstance(doc_name, str) else doc):
-                filtered.append(doc)
-        except frappe.PermissionError:
-            # Si no tiene permisos, omitir el documento
-            continue
-        except Exception:
-            # Si hay algún error, verificar usando get_doc_permissions
-            try:
-                doc_obj = frappe.get_doc(doctype, doc_name) if isinstance(doc_name, str) else doc
-                perms = frappe.permissions.get_doc_permissions(doc_obj)
-                if perms.get("read"):
-                    filtered.append(doc)
-            except:
-                continue
-    
-    return filtered
+    names = [doc.get('name') if isinstance(doc, dict) else doc for doc in documents]
+    readable = filter_readable(doctype, names)
+    return [doc for doc, name in zip(documents, names) if name in readable]
+
+def like_filter(value):
+    """Valor de filtro LIKE: respeta ['like', patrón] o envuelve el texto con %"""
+    if isinstance(value, list) and value and value[0] == 'like':
+        return value
+    value = value.strip() if isinstance(value, str) else str(value).strip()
+    return ["like", f"%{value}%"] if value else None
+
+
+def parse_cursor(cursor):
+    """Cursor de paginación [valor de ordenación, name] (lista o JSON)"""
+    if not cursor:
+        return None
+    if isinstance(cursor, str):
+        cursor = frappe.parse_json(cursor)
+    if not isinstance(cursor, (list, tuple)) or len(cursor) != 2:
+        frappe.throw(_("Cursor de paginación no válido"))
+    return cursor
+
+
+def estimate_table_rows(doctype):
+    """Número aproximado de filas según las estadísticas de la tabla (tiempo constante)"""
+    result = frappe.db.sql("""
+        SELECT TABLE_ROWS FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (f"tab{doctype}",))
+    return int(result[0][0] or 0) if result else 0
+
 
 @frappe.whitelist()
-def get_employees(filters=None, limit=None, offset=None):
+def get_employees(filters=None, limit=None, offset=None, cursor=None, count="exact"):
     """Get list of employees with essential fields and companies from Job Offers - Optimized version
     
     Args:
         filters: JSON string with filter criteria
         limit: Maximum number of records to return (for pagination)
-        offset: Number of records to skip (for pagination)
+        offset: Number of records to skip (for pagination, ignored when cursor is given)
+        cursor: [employee_name, name] of the last row of the previous page (keyset pagination)
+        count: 'exact' (default), 'estimate' (table statistics, unfiltered lists only) or 'none'
     
     Returns:
-        dict with 'data' (list of employees) and 'total' (total count for pagination)
+        dict with 'data' (list of employees), 'total' (total count for pagination),
+        'total_is_estimate', 'has_more' and 'next_cursor'
     """
     import json as json_lib
     
@@ -48,12 +64,14 @@ def get_employees(filters=None, limit=None, offset=None):
         filters = json_lib.loads(filters)
     
     # Parse pagination params
-    limit_start = int(offset) if offset else 0
+    cursor = parse_cursor(cursor)
+    limit_start = int(offset) if offset and not cursor else 0
     page_length = int(limit) if limit else None
 
     # Usar frappe.get_list para respetar permisos automáticamente
-    filters_dict = {}
+    filters_list = []
     or_filters = []
+    job_offer_filters = {}
     
     # Aplicar filtros adicionales
     if filters:
@@ -61,28 +79,47 @@ def get_employees(filters=None, limit=None, offset=None):
         if filters.get('search_text'):
             search_text = filters['search_text'].strip()
             if search_text:
-                or_filters = [
-                    ["employee_name", "like", f"%{search_text}%"],
-                    ["custom_dninie", "like", f"%{search_text}%"]
-                ]
+                matches = search_employees(search_text, fields=("employee_name", "custom_dninie"))
+                if not matches:
+                    return {"data": [], "total": 0, "total_is_estimate": False, "has_more": False, "next_cursor": None}
+                if len(matches) < SEARCH_MATCH_LIMIT:
+                    filters_list.append(["name", "in", matches])
+                else:
+                    # Búsqueda demasiado amplia para una lista IN: se filtra con LIKE en SQL
+                    or_filters = [[field, "like", f"%{search_text}%"] for field in ("employee_name", "custom_dninie")]
         
-        if filters.get('employee_name'):
-            if isinstance(filters['employee_name'], list) and filters['employee_name'][0] == 'like':
-                filters_dict['employee_name'] = filters['employee_name']
-            else:
-                filters_dict['employee_name'] = ["like", f"%{filters['employee_name']}%"]
-        
-        if filters.get('custom_dninie'):
-            if isinstance(filters['custom_dninie'], list) and filters['custom_dninie'][0] == 'like':
-                filters_dict['custom_dninie'] = filters['custom_dninie']
-            else:
-                filters_dict['custom_dninie'] = ["like", f"%{filters['custom_dninie']}%"]
+        for field in ('employee_name', 'custom_dninie'):
+            if filters.get(field) and like_filter(filters[field]):
+                filters_list.append([field, *like_filter(filters[field])])
         
         # Filtro por responsable (reports_to)
         if filters.get('reports_to'):
             reports_to_filter = filters['reports_to'].strip() if isinstance(filters['reports_to'], str) else str(filters['reports_to']).strip()
             if reports_to_filter:
-                filters_dict['reports_to'] = reports_to_filter
+                filters_list.append(['reports_to', '=', reports_to_filter])
+        
+        # Provincia y company se resuelven en SQL: solo empleados con alguna Job Offer que coincida
+        if filters.get('provincia') and like_filter(filters['provincia']):
+            job_offer_filters['custom_provincia'] = like_filter(filters['provincia'])
+        if filters.get('company') and like_filter(filters['company']):
+            job_offer_filters['company'] = like_filter(filters['company'])
+
+    if job_offer_filters:
+        # Solo cuentan las Job Offers que el usuario puede leer, con la misma condición
+        # que aplicaba get_list (sin hooks has_permission por documento)
+        job_offer_predicate = get_permission_predicate("Job Offer")
+        if job_offer_predicate == NO_ACCESS:
+            return {"data": [], "total": 0, "total_is_estimate": False, "has_more": False, "next_cursor": None}
+        semi_join = [
+            f"`tabJob Offer`.`{field}` LIKE {frappe.db.escape(value[1])}"
+            for field, value in job_offer_filters.items()
+        ]
+        if job_offer_predicate:
+            semi_join.append(f"({job_offer_predicate})")
+        filters_list.append(
+            "`tabEmployee`.custom_dninie IN (SELECT `tabJob Offer`.custom_dninie FROM `tabJob Offer` "
+            f"WHERE {' AND '.join(semi_join)})"
+        )
 
     # Verificar primero si el usuario tiene permisos de lectura en Employee
     try:
@@ -90,24 +127,36 @@ def get_employees(filters=None, limit=None, offset=None):
         role_permissions = frappe.permissions.get_role_permissions(meta, user=frappe.session.user)
         if not role_permissions.get("read") and not role_permissions.get("select"):
             # No tiene permisos básicos de lectura, devolver lista vacía
-            return {"data": [], "total": 0}
+            return {"data": [], "total": 0, "total_is_estimate": False, "has_more": False, "next_cursor": None}
     except Exception:
         # Si hay error verificando permisos, continuar pero filtrar después
         pass
 
-    # Get total count first (without pagination) for UI
-    if or_filters:
-        # frappe.db.count doesn't support or_filters, so use get_list with count
+    # Total para la UI (mismos filtros y permisos que la lista, sin el cursor)
+    total_is_estimate = False
+    if count == "none":
+        total_count = None
+    elif count == "estimate" and not filters_list and not or_filters:
+        total_count = estimate_table_rows("Employee")
+        total_is_estimate = True
+    else:
         count_result = frappe.get_list(
             "Employee",
-            filters=filters_dict,
-            or_filters=or_filters,
+            filters=filters_list,
+            or_filters=or_filters or None,
             fields=["count(name) as total"],
             as_list=True
         )
         total_count = count_result[0][0] if count_result else 0
-    else:
-        total_count = frappe.db.count("Employee", filters=filters_dict)
+
+    # Keyset: filas posteriores a (employee_name, name) del cursor
+    page_filters = list(filters_list)
+    if cursor:
+        last_name, last_id = (frappe.db.escape(v) for v in cursor)
+        page_filters.append(
+            f"(`tabEmployee`.employee_name > {last_name} OR "
+            f"(`tabEmployee`.employee_name = {last_name} AND `tabEmployee`.name > {last_id}))"
+        )
 
     # Obtener empleados usando frappe.get_list que respeta permisos automáticamente
     list_kwargs = {
@@ -128,19 +177,53 @@ def get_employees(filters=None, limit=None, offset=None):
             "custom_no_seguridad_social",
             "image"
         ],
-        "filters": filters_dict,
-        "order_by": "employee_name asc"
+        "filters": page_filters,
+        "order_by": "employee_name asc, name asc"
     }
     
     if or_filters:
         list_kwargs["or_filters"] = or_filters
     
     if page_length:
+        # Una fila extra para saber si hay más páginas
         list_kwargs["limit_start"] = limit_start
-        list_kwargs["limit_page_length"] = page_length
+        list_kwargs["limit_page_length"] = page_length + 1
     
     employees = frappe.get_list("Employee", **list_kwargs)
 
+    has_more = bool(page_length) and len(employees) > page_length
+    if has_more:
+        employees = employees[:page_length]
+    next_cursor = [employees[-1].employee_name, employees[-1].name] if has_more else None
+
+    def result(data):
+        return {
+            "data": data,
+            "total": total_count,
+            "total_is_estimate": total_is_estimate,
+            "has_more": has_more,
+            "next_cursor": next_cursor
+        }
+
+    # Sin filtros de Job Offer, el estado sale del índice Employee Contract Status (una fila por empleado)
+    if not job_offer_filters and contract_status_enabled():
+        status_map = get_contract_status_map([emp.name for emp in employees])
+        for employee in employees:
+            row = status_map.get(employee.name)
+            if not employee.get('custom_dninie'):
+                status = 'Sin DNI'
+            else:
+                status = row.contract_status if row and row.contract_status != 'Sin DNI' else 'Sin Hojas'
+            employee['status'] = status
+            employee['status_text'] = STATUS_TEXT[status]
+            if status == 'Alta':
+                employee['companies'] = row.active_companies
+            elif status == 'Baja':
+                employee['companies'] = row.all_companies
+            else:
+                employee['companies'] = []
+        return result(employees)
+
     # Get all DNIs/NIEs for batch query
     employee_dnis = [emp.get('custom_dninie') for emp in employees if emp.get('custom_dninie')]
 
@@ -151,33 +234,14 @@ def get_employees(filters=None, limit=None, offset=None):
             if not employee.get('custom_dninie'):
                 employee['status'] = 'Sin DNI'
                 employee['status_text'] = 'Sin DNI'
-        return {"data": employees, "total": total_count}
+        return result(employees)
 
     # Obtener job offers usando frappe.get_list para respetar permisos
-    job_offer_filters = {"custom_dninie": ["in", employee_dnis]}
-    
-    # Aplicar filtros para provincia y company si se proporcionan
-    if filters:
-        if filters.get('provincia'):
-            provincia_filter = filters['provincia'].strip() if isinstance(filters['provincia'], str) else str(filters['provincia']).strip()
-            if provincia_filter:
-                if isinstance(provincia_filter, list) and provincia_filter[0] == 'like':
-                    job_offer_filters['custom_provincia'] = provincia_filter
-                else:
-                    job_offer_filters['custom_provincia'] = ["like", f"%{provincia_filter}%"]
-        
-        if filters.get('company'):
-            company_filter = filters['company'].strip() if isinstance(filters['company'], str) else str(filters['company']).strip()
-            if company_filter:
-                if isinstance(company_filter, list) and company_filter[0] == 'like':
-                    job_offer_filters['company'] = company_filter
-                else:
-                    job_offer_filters['company'] = ["like", f"%{company_filter}%"]
-
+    # (con los filtros de provincia/company, solo cuentan las Job Offers que coinciden)
     all_job_offers = frappe.get_list(
         "Job Offer",
         fields=["company", "workflow_state", "custom_dninie", "custom_provincia"],
-        filters=job_offer_filters
+        filters={"custom_dninie": ["in", employee_dnis], **job_offer_filters}
     )
 
     # Group job offers by DNI/NIE for efficient lookup
@@ -188,29 +252,14 @@ def get_employees(filters=None, limit=None, offset=None):
             job_offers_by_dni[dni] = []
         job_offers_by_dni[dni].append(jo)
 
-    # If filters for provincia or company are active, filter employees by matching job offers
-    has_job_offer_filters = filters and (filters.get('provincia') or filters.get('company'))
-    matching_dnis = set()
-    
-    if has_job_offer_filters:
-        # Get DNI/NIEs that have matching job offers
-        matching_dnis = set([jo['custom_dninie'] for jo in all_job_offers if jo.get('custom_dninie')])
-    
     # Process each employee with pre-loaded job offers
-    filtered_employees = []
     for employee in employees:
         employee_dni = employee.get('custom_dninie')
         
-        # If filters for provincia/company are active, only include employees with matching job offers
-        if has_job_offer_filters:
-            if not employee_dni or employee_dni not in matching_dnis:
-                continue
-        
         if not employee_dni:
             employee['companies'] = []
             employee['status'] = 'Sin DNI'
             employee['status_text'] = 'Sin DNI'
-            filtered_employees.append(employee)
             continue
 
         # Get job offers for this employee from pre-loaded data
@@ -237,10 +286,8 @@ def get_employees(filters=None, limit=None, offset=None):
             employee['status'] = 'Sin Hojas'
             employee['companies'] = []
             employee['status_text'] = 'Sin hojas'
-        
-        filtered_employees.append(employee)
 
-    return {"data": filtered_employees, "total": total_count}
+    return result(employees)
 
 @frappe.whitelist()
 def get_employee(name):
@@ -0,0 +1,259 @@
+"""
+Shared employee search service.
+
+Employee text search used to be `LIKE '%text%'` over several columns in each
+endpoint, which cannot use an index. This module keeps an in-process trigram
+index over the accent-folded employee name, ID, DNI/NIE, emails and user:
+
+- Every searchable value is folded (lowercase, accents removed) and split
+  into trigrams; postings map trigram -> set of employee positions.
+- A query is folded the same way; the candidates are the intersection of
+  the postings of its trigrams, then verified with a substring check, so the
+  matches are the same as `LIKE '%text%'` but accent-insensitive.
+- Results are ranked: exact match, prefix of the name, prefix of a word,
+  then any substring; ties by employee name.
+
+Each worker builds the index once and then applies changes incrementally:
+Employee doc events append the employee ID to a change log in Redis, and the
+next search in a worker reloads only the employees logged since its last
+search. A full rebuild happens when the version stored in Redis changes
+(renames, or the change log growing past MAX_PENDING_CHANGES).
+
+Endpoints keep their own permission and role checks and only use the service
+to resolve matching employee IDs. Searches are capped at SEARCH_MATCH_LIMIT
+ranked IDs so callers never build unbounded `name IN (...)` lists; callers
+that need every match fall back to SQL when the cap is reached.
+"""
+
+import heapq
+import time
+import unicodedata
+
+import frappe
+
+
+SEARCH_VERSION_KEY = "portal_rrhh:employee_search_version"
+# Redis list of employee IDs changed since the last full rebuild
+SEARCH_CHANGES_KEY = "portal_rrhh:employee_search_changes"
+MAX_PENDING_CHANGES = 1000
+
+# Maximum number of IDs a search returns
+SEARCH_MATCH_LIMIT = 500
+
+# Searchable Employee fields
+SEARCH_FIELDS = (
+    "name", "employee_name", "first_name", "last_name", "custom_dninie",
+    "personal_email", "company_email", "user_id", "attendance_device_id"
+)
+# Fields that identify an employee in autocompletes (name, ID and DNI/NIE)
+IDENTITY_FIELDS = ("name", "employee_name", "custom_dninie")
+
+_index = {}
+
+
+def fold(text):
+    """Lowercase and strip accents ('Peñalver Ávila' -> 'penalver avila')"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class EmployeeSearchIndex:
+    """Trigram index over the folded SEARCH_FIELDS of every employee."""
+
+    def __init__(self, employees):
+        # names[i] is None for employees deleted since the index was built
+        self.names = []
+        self.positions = {}
+        self.status = []
+        self.sort_keys = []
+        # values[field][i]: folded value of the field for employee i
+        self.values = {f: [] for f in SEARCH_FIELDS}
+        self.postings = {}
+        # Number of entries of the Redis change log already applied
+        self.applied_changes = 0
+
+        for emp in employees:
+            self._add(emp)
+
+    def _add(self, emp):
+        i = len(self.names)
+        self.names.append(emp.name)
+        self.positions[emp.name] = i
+        self.status.append(None)
+        self.sort_keys.append("")
+        for field in SEARCH_FIELDS:
+            self.values[field].append("")
+        self._set(i, emp)
+
+    def _set(self, i, emp):
+        self.status[i] = emp.status
+        self.sort_keys[i] = fold(emp.employee_name) or fold(emp.name)
+        for field in SEARCH_FIELDS:
+            value = fold(emp.get(field))
+            self.values[field][i] = value
+            for gram in trigrams(value):
+                self.postings.setdefault(gram, set()).add(i)
+
+    def _clear(self, i):
+        for field in SEARCH_FIELDS:
+            for gram in trigrams(self.values[field][i]):
+                self.postings.get(gram, set()).discard(i)
+            self.values[field][i] = ""
+
+    def update(self, names, employees):
+        """Reindex the given employee IDs from their current rows (missing rows are deleted)."""
+        rows = {emp.name: emp for emp in employees}
+        for name in names:
+            i = self.positions.get(name)
+            emp = rows.get(name)
+            if i is not None:
+                self._clear(i)
+                if emp:
+                    self._set(i, emp)
+                else:
+                    self.names[i] = self.status[i] = None
+                    del self.positions[name]
+            elif emp:
+                self._add(emp)
+
+    def candidates(self, query):
+        grams = trigrams(query)
+        if not grams:
+            # Queries shorter than a trigram are checked against every employee
+            return range(len(self.names))
+
+        # Intersect starting from the rarest trigram
+        postings = sorted((self.postings.get(g, set()) for g in grams), key=len)
+        result = set(postings[0])
+        for p in postings[1:]:
+            result &= p
+            if not result:
+                break
+        return result
+
+    def search(self, text, fields=SEARCH_FIELDS, status=None, exclude=None, limit=SEARCH_MATCH_LIMIT):
+        """Ranked employee IDs whose folded fields contain the folded text."""
+        query = fold(text)
+        if not query:
+            return []
+
+        exclude = set(exclude or [])
+        scored = []
+        for i in self.candidates(query):
+            if self.names[i] is None or self.names[i] in exclude:
+                continue
+            if status and self.status[i] != status:
+                continue
+
+            rank = None
+            for field in fields:
+                value = self.values[field][i]
+                pos = value.find(query)
+                if pos < 0:
+                    continue
+                if value == query:
+                    field_rank = 0
+                elif pos == 0:
+                    field_rank = 1
+                elif not value[pos - 1].isalnum():
+                    field_rank = 2
+                else:
+                    field_rank = 3
+                rank = field_rank if rank is None else min(rank, field_rank)
+
+            if rank is not None:
+                scored.append((rank, self.sort_keys[i], self.names[i]))
+
+        # Partial sort: only the best `limit` entries are needed
+        scored = heapq.nsmallest(limit, scored) if limit else sorted(scored)
+        return [name for _rank, _key, name in scored]
+
+
+def load_employees(names=None):
+    filters = {"name": ["in", list(names)]} if names is not None else None
+    return frappe.get_all("Employee", filters=filters, fields=["status", *SEARCH_FIELDS])
+
+
+def get_search_index():
+    """
+    Index of the current site: rebuilt when the Redis version changed,
+    otherwise brought up to date with the pending change log entries.
+    """
+    cache = frappe.cache()
+    version = cache.get_value(SEARCH_VERSION_KEY)
+    if version is None:
+        version = str(time.time())
+        cache.set_value(SEARCH_VERSION_KEY, version)
+
+    site = frappe.local.site
+    cached = _index.get(site)
+    changes = cache.llen(SEARCH_CHANGES_KEY)
+
+    if cached and cached[0] == version and changes >= cached[1].applied_changes:
+        index = cached[1]
+        if changes > index.applied_changes:
+            names = {
+                frappe.safe_decode(n)
+                for n in cache.lrange(SEARCH_CHANGES_KEY, index.applied_changes, changes - 1)
+            }
+            index.update(names, load_employees(names))
+            index.applied_changes = changes
+        return index
+
+    index = EmployeeSearchIndex(load_employees())
+    # Rows loaded now already include every logged change
+    index.applied_changes = changes
+    _index[site] = (version, index)
+    return index
+
+
+def search_employees(text, fields=SEARCH_FIELDS, status=None, exclude=None, limit=SEARCH_MATCH_LIMIT):
+    """
+    Ranked employee IDs matching text (accent-insensitive substring match).
+
+    Args:
+        text: search text
+        fields: Employee fields to match (subset of SEARCH_FIELDS)
+        status: only employees with this status (e.g. 'Active')
+        exclude: employee IDs to leave out
+        limit: maximum number of IDs (at most SEARCH_MATCH_LIMIT)
+    """
+    limit = min(limit or SEARCH_MATCH_LIMIT, SEARCH_MATCH_LIMIT)
+    return get_search_index().search(text, fields=fields, status=status, exclude=exclude, limit=limit)
+
+
+def reset_search_index():
+    """Make every worker rebuild its index on the next search."""
+    cache = frappe.cache()
+    cache.set_value(SEARCH_VERSION_KEY, str(time.time()))
+    cache.delete_value(SEARCH_CHANGES_KEY)
+
+
+def invalidate_search_index(doc=None, method=None, *args):
+    """
+    Employee doc_events: log the employee so workers reindex only that row.
+    Renames reset the whole index.
+    """
+    if doc is None or method == "after_rename":
+        frappe.db.after_commit.add(reset_search_index)
+        return
+
+    if method == "on_update":
+        if not any(doc.has_value_changed(f) for f in ("status", *SEARCH_FIELDS)):
+            return
+
+    # After commit, so workers reloading the row see the new values
+    frappe.db.after_commit.add(lambda: log_search_change(doc.name))
+
+
+def log_search_change(name):
+    cache = frappe.cache()
+    cache.rpush(SEARCH_CHANGES_KEY, name)
+    if cache.llen(SEARCH_CHANGES_KEY) > MAX_PENDING_CHANGES:
+        reset_search_index()
@@ -1,8 +1,17 @@
+
 import frappe
 from frappe import _
-from frappe.utils import today, getdate, formatdate, flt
+from frappe.utils import cint, today, getdate, formatdate, flt
 from datetime import datetime
 
+from frappe.query_builder.functions import Count
+from pypika import analytics as an
+from pypika.terms import LiteralValue
+
+from portal_rrhh.api.cache import hget_many, hset_many
+from portal_rrhh.api.competency_gaps import gap_summary_enabled, get_critical_appraisal_count, get_gap_summary
+from portal_rrhh.api.permissions import NO_ACCESS, filter_readable, get_permission_predicate, has_permission_hooks
+
 
 @frappe.whitelist()
 def get_appraisals(filters=None, limit=20, offset=0, order_by="creation desc"):
@@ -11,12 +20,18 @@ def get_appraisals(filters=None, limit=20, offset=0, order_by="creation desc"):
     Employee = frappe.qb.DocType("Employee")
     AppraisalCycle = frappe.qb.DocType("Appraisal Cycle")
     CompetencyProfile = frappe.qb.DocType("Competency Profile")
+    CompetencyEvaluation = frappe.qb.DocType("Competency Evaluation")
     
     # Parse filters
     if filters and isinstance(filters, str):
         import json
         filters = json.loads(filters)
     
+    # Permisos de lectura como condición SQL (antes se filtraba cada fila tras paginar)
+    permission_predicate = get_permission_predicate("Competency Appraisal")
+    if permission_predicate == NO_ACCESS:
+        return {'appraisals': [], 'total_count': 0}
+    
     query = (
         frappe.qb.from_(CompetencyAppraisal)
         .left_join(Employee).on(CompetencyAppraisal.employee == Employee.name)
@@ -43,10 +58,15 @@ def get_appraisals(filters=None, limit=20, offset=0, order_by="creation desc"):
             AppraisalCycle.cycle_name,
             AppraisalCycle.start_date,
             AppraisalCycle.end_date,
-            CompetencyProfile.profile_name
+            CompetencyProfile.profile_name,
+            # Total de filas que cumplen filtros y permisos, para la paginación
+            an.Count(CompetencyAppraisal.name).over().as_("total_count")
         )
     )
     
+    if permission_predicate:
+        query = query.where(LiteralValue(permission_predicate))
+    
     # Apply filters
     if filters:
         if filters.get('status'):
@@ -104,28 +124,37 @@ def get_appraisals(filters=None, limit=20, offset=0, order_by="creation desc"):
                 query = query.orderby(CompetencyAppraisal.total_score, order=frappe.qb.asc)
     
     # Apply pagination
-    appraisals = query.limit(limit).offset(offset).run(as_dict=True)
-    
-    # Filtrar por permisos - solo incluir evaluaciones que el usuario puede leer
-    filtered_appraisals = []
-    for appraisal in appraisals:
-        try:
-            # Verificar permisos de lectura para cada evaluación
-            if frappe.has_permission("Competency Appraisal", "read", appraisal.get('name')):
-                filtered_appraisals.append(appraisal)
-        except:
-            # Si hay error verificando permisos, omitir el documento
-            continue
-    
-    appraisals = filtered_appraisals
+    appraisals = query.limit(cint(limit)).offset(cint(offset)).run(as_dict=True)
+    
+    if appraisals:
+        total_count = appraisals[0].total_count
+    elif cint(offset):
+        # Página fuera de rango: contar sin paginar
+        total_count = frappe.qb.from_(query).select(Count("*")).run()[0][0]
+    else:
+        total_count = 0
+    
+    # Los hooks has_permission no caben en SQL: se comprueban solo las filas de la página
+    # (la página puede quedar más corta y total_count es aproximado para esos DocTypes)
+    if appraisals and has_permission_hooks("Competency Appraisal"):
+        readable = filter_readable("Competency Appraisal", [a.name for a in appraisals])
+        appraisals = [a for a in appraisals if a.name in readable]
+    
+    # Número de competencias, agrupando solo las filas hijas de la página
+    competency_counts = {}
+    if appraisals:
+        competency_counts = dict(
+            frappe.qb.from_(CompetencyEvaluation)
+            .select(CompetencyEvaluation.parent, Count("*"))
+            .where(CompetencyEvaluation.parent.isin([a.name for a in appraisals]))
+            .groupby(CompetencyEvaluation.parent)
+            .run()
+        )
     
     # Enrich with additional data
     for appraisal in appraisals:
-        # Get competency evaluations count
-        appraisal['competency_count'] = frappe.db.count(
-            "Competency Evaluation",
-            {"parent": appraisal.name}
-        )
+        appraisal.pop('total_count', None)
+        appraisal['competency_count'] = competency_counts.get(appraisal.name, 0)
         
         # Format dates
         if appraisal.get('evaluation_date'):
@@ -133,12 +162,9 @@ def get_appraisals(filters=None, limit=20, offset=0, order_by="creation desc"):
         if appraisal.get('creation'):
             appraisal['creation_formatted'] = formatdate(appraisal['creation'])
     
-    # Nota: El total_count no refleja el filtrado por permisos porque se calcula antes
-    # Para obtener un conteo preciso, sería necesario obtener todos los registros y filtrarlos
-    # Por ahora, usamos el conteo de los resultados filtrados como aproximación
     return {
         'appraisals': appraisals,
-        'total_count': len(appraisals)  # Usar el conteo de resultados filtrados
+        'total_count': total_count
     }
 
 
@@ -151,26 +177,19 @@ def get_appraisal_details(name):
     if not frappe.has_permission("Competency Appraisal", "read", appraisal):
         frappe.throw(_("No tienes permisos para ver esta evaluación"), frappe.PermissionError)
     
-    # Get competency evaluations with full details
+    # Get competency evaluations with full details (definiciones precargadas en bloque)
+    competencies = get_competency_definitions([e.competency for e in appraisal.competency_evaluations])
     competency_evaluations = []
     for eval_item in appraisal.competency_evaluations:
-        competency = frappe.get_doc("Competency", eval_item.competency)
-        
-        # Get competency levels
-        levels = []
-        for level in competency.competency_levels:
-            levels.append({
-                'level_number': level.level_number,
-                'level_name': level.level_name,
-                'description': level.description
-            })
+        competency = competencies.get(eval_item.competency) or {}
+        levels = competency.get('levels', [])
         
         competency_evaluations.append({
             'competency': eval_item.competency,
-            'competency_name': competency.competency_name,
-            'competency_code': competency.competency_code,
-            'category': competency.category,
-            'description': competency.description,
+            'competency_name': competency.get('competency_name'),
+            'competency_code': competency.get('competency_code'),
+            'category': competency.get('category'),
+            'description': competency.get('description'),
             'expected_level': eval_item.expected_level,
             'achieved_level': eval_item.achieved_level,
             'level_gap': eval_item.level_gap,
@@ -180,37 +199,48 @@ def get_appraisal_details(name):
             'employee_comments': eval_item.employee_comments,
             'evidence': eval_item.evidence,
             'levels': levels,
-            'max_level': max([l.level_number for l in competency.competency_levels]) if competency.competency_levels else 0
+            'max_level': max([l['level_number'] for l in levels]) if levels else 0
         })
     
     # Get employee info
-    employee = frappe.get_doc("Employee", appraisal.employee)
+    employee = frappe.db.get_value(
+        "Employee", appraisal.employee,
+        ["name", "employee_name", "department", "designation", "company", "image", "date_of_joining"],
+        as_dict=True
+    )
     
     # Get appraisal cycle info
     cycle = None
     if appraisal.appraisal_cycle:
-        cycle = frappe.get_doc("Appraisal Cycle", appraisal.appraisal_cycle)
+        cycle = frappe.db.get_value(
+            "Appraisal Cycle", appraisal.appraisal_cycle,
+            ["name", "cycle_name", "start_date", "end_date"],
+            as_dict=True
+        )
     
     # Get competency profile info
     profile = None
     if appraisal.competency_profile:
-        profile = frappe.get_doc("Competency Profile", appraisal.competency_profile)
+        profile = frappe.db.get_value(
+            "Competency Profile", appraisal.competency_profile,
+            ["name", "profile_name"],
+            as_dict=True
+        )
     
     # Get previous appraisal if exists
     previous_appraisal = None
     if appraisal.previous_appraisal:
-        try:
-            previous_appraisal = frappe.get_doc("Competency Appraisal", appraisal.previous_appraisal)
-        except frappe.DoesNotExistError:
-            pass
+        previous_appraisal = frappe.db.get_value(
+            "Competency Appraisal", appraisal.previous_appraisal,
+            ["name", "employee", "employee_name", "appraisal_cycle", "competency_profile",
+             "status", "evaluation_date", "total_score", "self_appraisal_score"],
+            as_dict=True
+        )
     
     # Get evaluator info
     evaluator = None
     if appraisal.evaluated_by:
-        try:
-            evaluator = frappe.get_doc("User", appraisal.evaluated_by)
-        except frappe.DoesNotExistError:
-            pass
+        evaluator = frappe.db.get_value("User", appraisal.evaluated_by, ["name", "full_name"], as_dict=True)
     
     # Calculate statistics
     stats = {
@@ -225,26 +255,62 @@ def get_appraisal_details(name):
     return {
         'appraisal': appraisal.as_dict(),
         'competency_evaluations': competency_evaluations,
-        'employee': {
-            'name': employee.name,
-            'employee_name': employee.employee_name,
-            'department': employee.department,
-            'designation': employee.designation,
-            'company': employee.company,
-            'image': employee.image,
-            'date_of_joining': employee.date_of_joining
-        },
-        'cycle': cycle.as_dict() if cycle else None,
-        'profile': profile.as_dict() if profile else None,
-        'previous_appraisal': previous_appraisal.as_dict() if previous_appraisal else None,
-        'evaluator': {
-            'name': evaluator.name,
-            'full_name': evaluator.full_name
-        } if evaluator else None,
+        'employee': employee,
+        'cycle': cycle,
+        'profile': profile,
+        'previous_appraisal': previous_appraisal,
+        'evaluator': evaluator,
         'statistics': stats
     }
 
 
+COMPETENCY_CACHE_KEY = "portal_rrhh:competency_definitions"
+
+
+def get_competency_definitions(names):
+    """
+    Definiciones de Competency (nombre, código, categoría, descripción y niveles)
+    por nombre. Se leen de la caché de Redis con un HMGET y las que faltan se
+    cargan con dos consultas (Competency y su tabla competency_levels).
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    if not names:
+        return {}
+    
+    # Solo las competencias pedidas, en una única lectura del hash
+    result = hget_many(COMPETENCY_CACHE_KEY, names)
+    missing = [n for n in names if n not in result]
+    if not missing:
+        return result
+    
+    levels_doctype = frappe.get_meta("Competency").get_field("competency_levels").options
+    levels_by_competency = {}
+    loaded = {}
+    for level in frappe.get_all(
+        levels_doctype,
+        filters={"parent": ["in", missing], "parenttype": "Competency", "parentfield": "competency_levels"},
+        fields=["parent", "level_number", "level_name", "description"],
+        order_by="idx asc"
+    ):
+        levels_by_competency.setdefault(level.pop("parent"), []).append(dict(level))
+    
+    for competency in frappe.get_all(
+        "Competency",
+        filters={"name": ["in", missing]},
+        fields=["name", "competency_name", "competency_code", "category", "description"]
+    ):
+        loaded[competency.name] = dict(competency, levels=levels_by_competency.get(competency.name, []))
+    
+    hset_many(COMPETENCY_CACHE_KEY, loaded)
+    result.update(loaded)
+    return result
+
+
+def clear_competency_cache(doc, method=None):
+    """Competency doc_events: quitar la definición de la caché"""
+    frappe.cache().hdel(COMPETENCY_CACHE_KEY, doc.name)
+
+
 @frappe.whitelist()
 def create_appraisal(data):
     """Crear nueva evaluación"""
@@ -354,73 +420,109 @@ def get_appraisal_statistics(filters=None):
         import json
         filters = json.loads(filters)
     
-    # Base filters
-    base_filters = {}
-    if filters:
-        if filters.get('appraisal_cycle'):
-            base_filters['appraisal_cycle'] = filters['appraisal_cycle']
-        if filters.get('company'):
-            base_filters['company'] = filters['company']
-    
-    # Total evaluaciones
-    total_appraisals = frappe.db.count("Competency Appraisal", base_filters)
+    appraisal_cycle = (filters or {}).get('appraisal_cycle') or None
+    company = (filters or {}).get('company') or None
     
-    # Por estado
-    status_counts = {}
-    for status in ["Borrador", "Auto-evaluado", "Enviado", "Completado", "Cancelado"]:
-        status_filters = {**base_filters, 'status': status}
-        status_counts[status] = frappe.db.count("Competency Appraisal", status_filters)
+    cache_key = f"{APPRAISAL_STATS_CACHE_PREFIX}{appraisal_cycle or ''}:{company or ''}"
+    stats = frappe.cache().get_value(cache_key)
+    if stats is None:
+        stats = compute_appraisal_statistics(appraisal_cycle, company)
+        frappe.cache().set_value(cache_key, stats, expires_in_sec=APPRAISAL_STATS_CACHE_TTL)
     
-    # Promedio de puntuación (solo completadas)
-    avg_score_result = frappe.db.sql("""
-        SELECT AVG(total_score) as avg_score, COUNT(*) as count
-        FROM `tabCompetency Appraisal`
-        WHERE status = 'Completado'
-        AND total_score IS NOT NULL
-    """, as_dict=True)
-    
-    avg_score = avg_score_result[0].avg_score if avg_score_result and avg_score_result[0].avg_score else 0
-    completed_count = avg_score_result[0].count if avg_score_result else 0
-    
-    # Evaluaciones pendientes
-    pending_filters = {**base_filters, 'status': ['in', ['Borrador', 'Auto-evaluado']]}
-    pending_count = frappe.db.count("Competency Appraisal", pending_filters)
-    
-    # Evaluaciones por mes (últimos 6 meses)
-    monthly_data = frappe.db.sql("""
+    return stats
+
+
+APPRAISAL_STATS_CACHE_PREFIX = "portal_rrhh:appraisal_statistics:"
+# El histórico mensual depende de la fecha actual, así que la caché también caduca
+APPRAISAL_STATS_CACHE_TTL = 3600
+APPRAISAL_STATUSES = ["Borrador", "Auto-evaluado", "Enviado", "Completado", "Cancelado"]
+PENDING_STATUSES = ("Borrador", "Auto-evaluado")
+
+
+def compute_appraisal_statistics(appraisal_cycle=None, company=None):
+    """
+    Estadísticas de evaluaciones en dos consultas agrupadas que respetan
+    los filtros de ciclo y empresa:
+    - por estado: total, suma/nº de puntuaciones y evaluaciones con brechas críticas
+      (las brechas críticas se leen del resumen Competency Gap Summary si existe)
+    - por mes de creación (últimos 6 meses)
+    """
+    use_gap_summary = gap_summary_enabled()
+    conditions = ["1 = 1"]
+    values = {}
+    if appraisal_cycle:
+        conditions.append("ca.appraisal_cycle = %(appraisal_cycle)s")
+        values["appraisal_cycle"] = appraisal_cycle
+    if company:
+        conditions.append("ca.company = %(company)s")
+        values["company"] = company
+    where = " AND ".join(conditions)
+    
+    critical_select, critical_join = "0", ""
+    if not use_gap_summary:
+        critical_select = "COUNT(gaps.parent)"
+        critical_join = """LEFT JOIN (
+            SELECT DISTINCT parent
+            FROM `tabCompetency Evaluation`
+            WHERE level_gap >= 2
+        ) gaps ON gaps.parent = ca.name"""
+    
+    by_status = frappe.db.sql(f"""
+        SELECT
+            ca.status,
+            COUNT(*) AS count,
+            SUM(ca.total_score) AS score_sum,
+            COUNT(ca.total_score) AS score_count,
+            {critical_select} AS critical_gaps
+        FROM `tabCompetency Appraisal` ca
+        {critical_join}
+        WHERE {where}
+        GROUP BY ca.status
+    """, values, as_dict=True)
+    
+    monthly_data = frappe.db.sql(f"""
         SELECT 
-            DATE_FORMAT(creation, '%%Y-%%m') as month,
+            DATE_FORMAT(ca.creation, '%%Y-%%m') as month,
             COUNT(*) as count
-        FROM `tabCompetency Appraisal`
-        WHERE creation >= DATE_SUB(NOW(), INTERVAL 6 MONTH)
-        GROUP BY DATE_FORMAT(creation, '%%Y-%%m')
+        FROM `tabCompetency Appraisal` ca
+        WHERE {where}
+        AND ca.creation >= DATE_SUB(NOW(), INTERVAL 6 MONTH)
+        GROUP BY DATE_FORMAT(ca.creation, '%%Y-%%m')
         ORDER BY month DESC
-    """, as_dict=True)
-    
-    # Evaluaciones con brechas críticas
-    critical_gaps = frappe.db.sql("""
-        SELECT COUNT(DISTINCT parent) as count
-        FROM `tabCompetency Evaluation`
-        WHERE level_gap >= 2
-        AND parent IN (
-            SELECT name FROM `tabCompetency Appraisal` 
-            WHERE status = 'Completado'
-        )
-    """, as_dict=True)
+    """, values, as_dict=True)
+    
+    rows = {r.status: r for r in by_status}
+    completed = rows.get("Completado") or frappe._dict(score_sum=None, score_count=0, critical_gaps=0)
+    
+    if use_gap_summary:
+        completed.critical_gaps = get_critical_appraisal_count({
+            'appraisal_cycle': appraisal_cycle,
+            'company': company
+        })
     
-    critical_gaps_count = critical_gaps[0].count if critical_gaps else 0
+    # Promedio de puntuación (solo completadas)
+    avg_score = completed.score_sum / completed.score_count if completed.score_count else 0
     
     return {
-        'total_appraisals': total_appraisals,
-        'status_counts': status_counts,
+        'total_appraisals': sum(r.count for r in by_status),
+        'status_counts': {status: rows[status].count if status in rows else 0 for status in APPRAISAL_STATUSES},
         'average_score': flt(avg_score, 2),
-        'completed_count': completed_count,
-        'pending_count': pending_count,
-        'critical_gaps_count': critical_gaps_count,
+        'completed_count': completed.score_count,
+        'pending_count': sum(rows[status].count for status in PENDING_STATUSES if status in rows),
+        'critical_gaps_count': completed.critical_gaps,
         'monthly_data': monthly_data
     }
 
 
+def clear_appraisal_statistics_cache(doc, method=None):
+    """Competency Appraisal doc_events: invalidar las estadísticas cacheadas"""
+    if method == "on_update" and doc.status != "Completado":
+        if not any(doc.has_value_changed(f) for f in ("status", "total_score", "appraisal_cycle", "company")):
+            return
+    
+    frappe.cache().delete_keys(APPRAISAL_STATS_CACHE_PREFIX)
+
+
 @frappe.whitelist()
 def get_appraisal_cycles(filters=None):
     """Obtener ciclos de evaluación"""
@@ -513,22 +615,30 @@ def get_competencies(filters=None):
 
 
 @frappe.whitelist()
-def get_gap_analysis(filters=None):
-    """Obtener análisis de brechas de competencias"""
+def get_gap_analysis(filters=None, group_by="competency"):
+    """
+    Obtener análisis de brechas de competencias desde el resumen materializado
+    (Competency Gap Summary).
+    
+    Filtros de drill-down: appraisal_cycle, company, department, designation, competency.
+    group_by: competency (por defecto), appraisal_cycle, company, department o designation.
+    """
     if filters and isinstance(filters, str):
         import json
         filters = json.loads(filters)
     
-    # Base query
-    base_filters = {}
-    if filters:
-        if filters.get('appraisal_cycle'):
-            base_filters['appraisal_cycle'] = filters['appraisal_cycle']
-        if filters.get('company'):
-            base_filters['company'] = filters['company']
+    if gap_summary_enabled():
+        return get_gap_summary(filters, group_by=group_by or "competency")
+    
+    # Sin tabla de resumen (antes de migrar): consulta directa por competencia
+    conditions = ["ce.level_gap > 0", "ca.status = 'Completado'"]
+    values = {}
+    for field in ("appraisal_cycle", "company"):
+        if (filters or {}).get(field):
+            conditions.append(f"ca.{field} = %({field})s")
+            values[field] = filters[field]
     
-    # Get evaluations with gaps
-    gap_analysis = frappe.db.sql("""
+    gap_analysis = frappe.db.sql(f"""
         SELECT 
             ce.competency,
             c.competency_name,
@@ -541,20 +651,24 @@ def get_gap_analysis(filters=None):
         FROM `tabCompetency Evaluation` ce
         INNER JOIN `tabCompetency Appraisal` ca ON ce.parent = ca.name
         INNER JOIN `tabCompetency` c ON ce.competency = c.name
-        WHERE ce.level_gap > 0
-        AND ca.status = 'Completado'
+        WHERE {" AND ".join(conditions)}
         GROUP BY ce.competency, c.competency_name, c.competency_code, c.category
         HAVING avg_gap > 0
         ORDER BY avg_gap DESC
         LIMIT 20
-    """, as_dict=True)
+    """, values, as_dict=True)
     
     return gap_analysis
 
 
 @frappe.whitelist()
 def bulk_create_appraisals(data):
-    """Crear múltiples evaluaciones desde un ciclo"""
+    """
+    Crear múltiples evaluaciones desde un ciclo.
+    
+    Con data['background'] la creación se encola (encolar_creacion_evaluaciones) y se
+    devuelve el job_id; el resultado final llega por realtime o get_estado_creacion_evaluaciones.
+    """
     import json
     if isinstance(data, str):
         data = json.loads(data)
@@ -563,63 +677,231 @@ def bulk_create_appraisals(data):
     if not cycle_name:
         frappe.throw(_("Debe especificar un ciclo de evaluación"))
     
-    cycle = frappe.get_doc("Appraisal Cycle", cycle_name)
+    if not frappe.db.exists("Appraisal Cycle", cycle_name):
+        frappe.throw(_("Ciclo de evaluación {0} no encontrado").format(cycle_name), frappe.DoesNotExistError)
+    
     employees = data.get('employees', [])
+    if cint(data.get('background')):
+        return encolar_creacion_evaluaciones(cycle_name, employees)
+    
+    return crear_evaluaciones_bulk(cycle_name, employees)
+
+
+EVALUACIONES_MASIVAS_EVENT = "evaluaciones_masivas_progress"
+EVALUACIONES_BULK_CHUNK = 100
+
+
+def get_job_id_creacion_evaluaciones(appraisal_cycle):
+    """Job id estable por ciclo (evita dos creaciones simultáneas del mismo ciclo)"""
+    return f"evaluaciones_masivas::{appraisal_cycle}"
+
+
+def get_cache_key_creacion_evaluaciones(appraisal_cycle):
+    return f"portal_rrhh:evaluaciones_masivas:estado:{appraisal_cycle}"
+
+
+def publicar_progreso_evaluaciones(progreso, user=None):
+    """Guarda el último progreso en caché y lo publica por realtime al usuario que lanzó el job"""
+    frappe.cache().set_value(
+        get_cache_key_creacion_evaluaciones(progreso['appraisal_cycle']),
+        progreso,
+        expires_in_sec=86400
+    )
+    frappe.publish_realtime(EVALUACIONES_MASIVAS_EVENT, progreso, user=user)
+
+
+def encolar_creacion_evaluaciones(appraisal_cycle, employees):
+    """
+    Encola la creación masiva de evaluaciones del ciclo en segundo plano.
+    
+    Devuelve el job_id inmediatamente. El progreso se publica por realtime
+    (evento EVALUACIONES_MASIVAS_EVENT) y se puede consultar con
+    get_estado_creacion_evaluaciones.
+    """
+    job_id = get_job_id_creacion_evaluaciones(appraisal_cycle)
+    
+    # Descartar el estado de una ejecución anterior ya terminada
+    frappe.cache().delete_value(get_cache_key_creacion_evaluaciones(appraisal_cycle))
+    
+    frappe.enqueue(
+        "portal_rrhh.api.evaluaciones.procesar_creacion_evaluaciones",
+        queue="long",
+        timeout=3600,
+        job_id=job_id,
+        deduplicate=True,
+        appraisal_cycle=appraisal_cycle,
+        employees=list(employees),
+        user=frappe.session.user
+    )
+    
+    return {
+        'job_id': job_id,
+        'total': len(employees),
+        'message': _('Creación de {0} evaluaciones encolada').format(len(employees))
+    }
+
+
+@frappe.whitelist()
+def get_estado_creacion_evaluaciones(appraisal_cycle):
+    """
+    Devuelve el último progreso publicado del job de creación masiva
+    (para clientes sin conexión realtime o que se reconectan).
+    """
+    estado = frappe.cache().get_value(get_cache_key_creacion_evaluaciones(appraisal_cycle))
+    
+    return estado or {
+        'job_id': get_job_id_creacion_evaluaciones(appraisal_cycle),
+        'appraisal_cycle': appraisal_cycle,
+        'status': 'sin_iniciar'
+    }
+
+
+def procesar_creacion_evaluaciones(appraisal_cycle, employees, user=None):
+    """
+    Job en segundo plano: crea las evaluaciones por bloques, hace commit tras
+    cada bloque y publica el progreso. Al terminar, 'resultado' contiene la misma
+    estructura que bulk_create_appraisals (created, errors, message).
+    """
+    progreso = {
+        'job_id': get_job_id_creacion_evaluaciones(appraisal_cycle),
+        'appraisal_cycle': appraisal_cycle,
+        'status': 'en_curso',
+        'total': len(employees),
+        'procesadas': 0,
+        'creadas': 0,
+        'errores': 0
+    }
+    publicar_progreso_evaluaciones(progreso, user)
+    
+    def on_chunk(procesadas, resultado):
+        frappe.db.commit()
+        progreso.update({
+            'procesadas': procesadas,
+            'creadas': len(resultado['created']),
+            'errores': len(resultado['errors'])
+        })
+        publicar_progreso_evaluaciones(progreso, user)
+    
+    try:
+        resultado = crear_evaluaciones_bulk(appraisal_cycle, employees, on_chunk=on_chunk)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(message=str(e)[:500], title="Evaluaciones Masivas Job Error")
+        progreso.update({'status': 'error', 'error': str(e)})
+        publicar_progreso_evaluaciones(progreso, user)
+        raise
+    
+    frappe.db.commit()
+    frappe.cache().delete_keys(APPRAISAL_STATS_CACHE_PREFIX)
+    
+    progreso.update({
+        'status': 'completado',
+        'procesadas': progreso['total'],
+        'creadas': len(resultado['created']),
+        'errores': len(resultado['errors']),
+        'resultado': resultado
+    })
+    publicar_progreso_evaluaciones(progreso, user)
+
+
+def get_datos_creacion_evaluaciones(appraisal_cycle, employees):
+    """
+    Datos para crear las evaluaciones de un ciclo, con una consulta para cada uno:
+    - empleados: {employee: fila con designation y company}
+    - perfiles: {(designation, company): perfil de competencias}
+    - existentes: empleados con una evaluación no cancelada en el ciclo
+    """
+    empleados = {
+        e.name: e for e in frappe.get_all(
+            "Employee",
+            filters={"name": ["in", employees]},
+            fields=["name", "designation", "company"]
+        )
+    }
+    
+    designations = {e.designation for e in empleados.values() if e.designation}
+    companies = {e.company for e in empleados.values() if e.company}
+    perfiles = {}
+    if designations and companies:
+        for p in frappe.get_all(
+            "Competency Profile",
+            filters={"designation": ["in", list(designations)], "company": ["in", list(companies)]},
+            fields=["name", "designation", "company"],
+            order_by="modified desc"
+        ):
+            perfiles.setdefault((p.designation, p.company), p.name)
+    
+    existentes = set(frappe.get_all(
+        "Competency Appraisal",
+        filters={
+            "employee": ["in", employees],
+            "appraisal_cycle": appraisal_cycle,
+            "status": ["!=", "Cancelado"]
+        },
+        pluck="employee"
+    ))
+    
+    return empleados, perfiles, existentes
+
+
+def crear_evaluaciones_bulk(appraisal_cycle, employees, on_chunk=None):
+    """
+    Crea las evaluaciones en borrador del ciclo para los empleados indicados.
+    
+    - Empleados, perfiles y evaluaciones existentes se resuelven con una consulta
+      cada uno (get_datos_creacion_evaluaciones).
+    - Cada evaluación se inserta con insert() para que el DocType rellene sus
+      competencias, dentro de un savepoint para aislar los errores.
+    
+    on_chunk: callback opcional (procesadas, resultado) tras cada bloque de
+    EVALUACIONES_BULK_CHUNK empleados.
+    """
+    employees = list(employees)
+    empleados, perfiles, existentes = get_datos_creacion_evaluaciones(appraisal_cycle, employees) if employees else ({}, {}, set())
     
     created = []
     errors = []
+    savepoint = "evaluaciones_bulk"
     
-    for employee_name in employees:
-        try:
-            employee = frappe.get_doc("Employee", employee_name)
-            
-            # Get competency profile for employee designation
-            profile = frappe.db.get_value(
-                "Competency Profile",
-                {"designation": employee.designation, "company": employee.company},
-                "name"
-            )
-            
-            if not profile:
-                errors.append({
-                    'employee': employee_name,
-                    'error': _("No se encontró perfil de competencias para {0}").format(employee.designation)
-                })
-                continue
-            
-            # Check if appraisal already exists
-            existing = frappe.db.exists(
-                "Competency Appraisal",
-                {
-                    "employee": employee_name,
-                    "appraisal_cycle": cycle_name,
-                    "status": ["!=", "Cancelado"]
-                }
-            )
-            
-            if existing:
-                errors.append({
-                    'employee': employee_name,
-                    'error': _("Ya existe una evaluación para este empleado en este ciclo")
-                })
-                continue
-            
-            appraisal = frappe.get_doc({
-                'doctype': 'Competency Appraisal',
+    for i, employee_name in enumerate(employees, 1):
+        employee = empleados.get(employee_name)
+        if not employee:
+            errors.append({
+                'employee': employee_name,
+                'error': _("Empleado {0} no encontrado").format(employee_name)
+            })
+        elif not perfiles.get((employee.designation, employee.company)):
+            errors.append({
                 'employee': employee_name,
-                'appraisal_cycle': cycle_name,
-                'competency_profile': profile,
-                'status': 'Borrador'
+                'error': _("No se encontró perfil de competencias para {0}").format(employee.designation)
             })
-            
-            appraisal.insert()
-            created.append(appraisal.name)
-            
-        except Exception as e:
+        elif employee_name in existentes:
             errors.append({
                 'employee': employee_name,
-                'error': str(e)
+                'error': _("Ya existe una evaluación para este empleado en este ciclo")
             })
+        else:
+            frappe.db.savepoint(savepoint)
+            try:
+                appraisal = frappe.get_doc({
+                    'doctype': 'Competency Appraisal',
+                    'employee': employee_name,
+                    'appraisal_cycle': appraisal_cycle,
+                    'competency_profile': perfiles[(employee.designation, employee.company)],
+                    'status': 'Borrador'
+                })
+                appraisal.insert()
+                created.append(appraisal.name)
+                existentes.add(employee_name)
+            except Exception as e:
+                frappe.db.rollback(save_point=savepoint)
+                errors.append({
+                    'employee': employee_name,
+                    'error': str(e)
+                })
+        
+        if on_chunk and (i % EVALUACIONES_BULK_CHUNK == 0 or i == len(employees)):
+            on_chunk(i, {'created': created, 'errors': errors})
     
     return {
         'created': created,
@@ -0,0 +1,175 @@
+"""
+Holiday calendar cache.
+
+The holidays of a Holiday List are kept per (holiday_list, year) as two
+bitsets (Python ints, bit i = day i of the year counting from 1 January):
+every holiday, and the weekly offs among them. Lookups are a shift and a
+mask, with no SQL once the year is cached.
+
+- Each worker keeps the bitsets in process, tagged with a version stored
+  in Redis (read once per request through the request-local cache).
+- Bitsets missing in process are read from a Redis hash and, if missing
+  there too, loaded for every requested pair with a single Holiday query.
+- Holiday List doc events bump the version and drop the Redis hash.
+"""
+
+import time
+from datetime import date
+
+import frappe
+from frappe.utils import getdate
+
+
+HOLIDAY_CACHE_KEY = "portal_rrhh:holiday_calendar"
+HOLIDAY_VERSION_KEY = "portal_rrhh:holiday_calendar_version"
+
+_calendars = {}
+
+
+def day_of_year(d):
+    return d.timetuple().tm_yday - 1
+
+
+class HolidayCalendar:
+    """Holiday bitsets of several holiday lists, keyed by (holiday_list, year)."""
+
+    def __init__(self, years):
+        # {(holiday_list, year): (holiday_bits, weekly_off_bits)}
+        self.years = years
+
+    def is_holiday(self, holiday_list, d):
+        bits = self.years.get((holiday_list, d.year))
+        return bool(bits and bits[0] >> day_of_year(d) & 1)
+
+    def is_weekly_off(self, holiday_list, d):
+        bits = self.years.get((holiday_list, d.year))
+        return bool(bits and bits[1] >> day_of_year(d) & 1)
+
+    def dates(self, holiday_list, start_date, end_date, weekly_offs=True):
+        """Holiday dates of the list between start_date and end_date, sorted."""
+        result = []
+        for year in range(start_date.year, end_date.year + 1):
+            holidays, offs = self.years.get((holiday_list, year), (0, 0))
+            bits = holidays if weekly_offs else holidays & ~offs
+            jan1 = date(year, 1, 1).toordinal()
+            while bits:
+                low = bits & -bits
+                d = date.fromordinal(jan1 + low.bit_length() - 1)
+                if start_date <= d <= end_date:
+                    result.append(d)
+                bits ^= low
+        return result
+
+
+def _get_version():
+    version = frappe.cache().get_value(HOLIDAY_VERSION_KEY)
+    if version is None:
+        version = str(time.time())
+        frappe.cache().set_value(HOLIDAY_VERSION_KEY, version)
+    return version
+
+
+def _load_years(pairs):
+    """Bitsets of the (holiday_list, year) pairs with one Holiday query."""
+    years = {pair: [0, 0] for pair in pairs}
+    lists = list({hl for hl, _year in pairs})
+    first = min(year for _hl, year in pairs)
+    last = max(year for _hl, year in pairs)
+
+    for h in frappe.get_all(
+        "Holiday",
+        filters={
+            "parent": ["in", lists],
+            "holiday_date": ["between", [date(first, 1, 1), date(last, 12, 31)]]
+        },
+        fields=["parent", "holiday_date", "weekly_off"]
+    ):
+        bits = years.get((h.parent, h.holiday_date.year))
+        if bits is None:
+            continue
+        bit = 1 << day_of_year(h.holiday_date)
+        bits[0] |= bit
+        if h.weekly_off:
+            bits[1] |= bit
+
+    return {pair: tuple(bits) for pair, bits in years.items()}
+
+
+def get_holiday_calendar(holiday_lists, start_date, end_date):
+    """HolidayCalendar covering the given holiday lists for every year of the range."""
+    start_date, end_date = getdate(start_date), getdate(end_date)
+    pairs = [
+        (hl, year)
+        for hl in set(holiday_lists) if hl
+        for year in range(start_date.year, end_date.year + 1)
+    ]
+
+    version = _get_version()
+    site = frappe.local.site
+    cached = _calendars.get(site)
+    if not cached or cached[0] != version:
+        cached = _calendars[site] = (version, {})
+    local = cached[1]
+
+    missing = []
+    for pair in pairs:
+        if pair in local:
+            continue
+        bits = frappe.cache().hget(HOLIDAY_CACHE_KEY, f"{pair[0]}::{pair[1]}")
+        if bits is None:
+            missing.append(pair)
+        else:
+            local[pair] = tuple(bits)
+
+    if missing:
+        for pair, bits in _load_years(missing).items():
+            frappe.cache().hset(HOLIDAY_CACHE_KEY, f"{pair[0]}::{pair[1]}", bits)
+            local[pair] = bits
+
+    return HolidayCalendar({pair: local[pair] for pair in pairs})
+
+
+def get_employee_holiday_list(employee):
+    """Holiday List of the employee, or the default one of their company."""
+    holiday_list, company = frappe.db.get_value("Employee", employee, ["holiday_list", "company"]) or (None, None)
+    if not holiday_list and company:
+        holiday_list = frappe.db.get_value("Company", company, "default_holiday_list")
+    return holiday_list
+
+
+def get_employee_holiday_lists(employees):
+    """
+    {employee: Holiday List} for several employees, with the same fallback to
+    the company's default list as get_employee_holiday_list. Unknown employees
+    are left out.
+    """
+    employees = list(employees)
+    if not employees:
+        return {}
+
+    rows = frappe.get_all(
+        "Employee",
+        filters={"name": ["in", employees]},
+        fields=["name", "holiday_list", "company"]
+    )
+    companies = list({r.company for r in rows if not r.holiday_list and r.company})
+    company_lists = dict(frappe.get_all(
+        "Company",
+        filters={"name": ["in", companies]},
+        fields=["name", "default_holiday_list"],
+        as_list=True
+    )) if companies else {}
+
+    return {r.name: r.holiday_list or company_lists.get(r.company) for r in rows}
+
+
+def _drop_holiday_cache():
+    frappe.cache().delete_value(HOLIDAY_CACHE_KEY)
+    frappe.cache().set_value(HOLIDAY_VERSION_KEY, str(time.time()))
+
+
+def clear_holiday_cache(doc=None, method=None):
+    """Holiday List doc_events: make every worker reload its holiday bitsets."""
+    _drop_holiday_cache()
+    # Again after commit, in case another request cached the old rows meanwhile
+    frappe.db.after_commit.add(_drop_holiday_cache)
@@ -5,6 +5,8 @@ from frappe import _
 from frappe.model.docstatus import DocStatus
 from frappe.utils import cint, cstr, getdate, formatdate
 
+from portal_rrhh.api.employee_search import IDENTITY_FIELDS, search_employees
+
 
 def _user_can_manage_employee_incentives():
 	"""Portal users often lack Employee read; gate búsqueda de empleados en incentivos."""
@@ -331,16 +333,19 @@ def search_employees_for_incentive(search_text=None, limit=50):
 	if len(search) < 2:
 		return []
 
-	pattern = f"%{search}%"
-	params = {"p": pattern, "lim": lim}
 	exclude_employee = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
-	exclude_sql = ""
-	if exclude_employee:
-		exclude_sql = " AND e.name != %(exclude_employee)s"
-		params["exclude_employee"] = exclude_employee
+	names = search_employees(
+		search,
+		fields=IDENTITY_FIELDS,
+		status="Active",
+		exclude=[exclude_employee] if exclude_employee else None,
+		limit=lim,
+	)
+	if not names:
+		return []
 
 	rows = frappe.db.sql(
-		f"""
+		"""
 		SELECT
 			e.name,
 			e.employee_name,
@@ -350,21 +355,14 @@ def search_employees_for_incentive(search_text=None, limit=50):
 			rt.employee_name AS reports_to_name
 		FROM `tabEmployee` e
 		LEFT JOIN `tabEmployee` rt ON rt.name = e.reports_to
-		WHERE e.status = 'Active'
-			AND (
-				e.employee_name LIKE %(p)s
-				OR e.name LIKE %(p)s
-				OR IFNULL(e.custom_dninie, '') LIKE %(p)s
-			)
-			{exclude_sql}
-		ORDER BY e.employee_name ASC
-		LIMIT %(lim)s
+		WHERE e.name IN %(names)s
+			AND e.status = 'Active'
 		""",
-		params,
+		{"names": tuple(names)},
 		as_dict=True,
 	)
 
-	return rows
+	return _in_search_order(rows, names)
 
 
 @frappe.whitelist()
@@ -380,26 +378,29 @@ def search_employees_for_approver(search_text=None, limit=50):
 	if len(search) < 2:
 		return []
 
-	pattern = f"%{search}%"
-	params = {"p": pattern, "lim": lim}
+	names = search_employees(search, fields=IDENTITY_FIELDS, status="Active", limit=lim)
+	if not names:
+		return []
 
-	return frappe.db.sql(
+	rows = frappe.db.sql(
 		"""
 		SELECT e.name, e.employee_name, e.department, e.designation
 		FROM `tabEmployee` e
-		WHERE e.status = 'Active'
-			AND (
-				e.employee_name LIKE %(p)s
-				OR e.name LIKE %(p)s
-				OR IFNULL(e.custom_dninie, '') LIKE %(p)s
-			)
-		ORDER BY e.employee_name ASC
-		LIMIT %(lim)s
+		WHERE e.name IN %(names)s
+			AND e.status = 'Active'
 		""",
-		params,
+		{"names": tuple(names)},
 		as_dict=True,
 	)
 
+	return _in_search_order(rows, names)
+
+
+def _in_search_order(rows, names):
+	"""Ordena las filas según el ranking del buscador de empleados."""
+	position = {name: i for i, name in enumerate(names)}
+	return sorted(rows, key=lambda r: position[r.name])
+
 
 @frappe.whitelist()
 def search_docente_employees_for_incentive(search_text=None, limit=50):
@@ -0,0 +1,127 @@
+"""
+Leave coverage index.
+
+Approved Leave Applications and Spanish Leave Applications are merged into
+per-employee interval lists sorted by from_date, each with the running
+maximum of to_date. A query for [start, end] bisects the from_dates for the
+last candidate and the running maxima for the first one, so range and point
+lookups never expand a leave into its days. Overlapping leaves of an
+employee (e.g. the same absence recorded in both doctypes) are reported by
+a single sweep over the sorted intervals.
+"""
+
+from bisect import bisect_left, bisect_right
+
+import frappe
+
+
+SPANISH_LEAVE_DOCTYPE = "Spanish Leave Application"
+SPANISH_APPROVED_STATUSES = ["Aprobada", "Approved"]
+LEAVE_FIELDS = ["name", "employee", "from_date", "to_date", "leave_type"]
+
+
+class LeaveIndex:
+    """Per-employee sorted leave intervals with range, point and overlap queries."""
+
+    def __init__(self, leaves):
+        intervals = {}
+        for leave in leaves:
+            if leave.from_date and leave.to_date:
+                intervals.setdefault(leave.employee, []).append(
+                    (leave.from_date.toordinal(), leave.to_date.toordinal(), leave)
+                )
+
+        # Per employee: (from ordinals, running max of to ordinals, intervals)
+        self._index = {}
+        for employee, rows in intervals.items():
+            rows.sort(key=lambda row: row[0])
+            starts = [row[0] for row in rows]
+            max_ends = []
+            current = None
+            for row in rows:
+                current = row[1] if current is None else max(current, row[1])
+                max_ends.append(current)
+            self._index[employee] = (starts, max_ends, rows)
+
+    def query(self, employee, start_date, end_date):
+        """Leaves of the employee overlapping [start_date, end_date], in from_date order."""
+        entry = self._index.get(employee)
+        if not entry:
+            return []
+
+        starts, max_ends, rows = entry
+        first, last = start_date.toordinal(), end_date.toordinal()
+        # Intervals before lo all end before the range; intervals from hi on start after it
+        lo = bisect_left(max_ends, first)
+        hi = bisect_right(starts, last)
+        return [leave for _from, to, leave in rows[lo:hi] if to >= first]
+
+    def at(self, employee, d):
+        """Leaves of the employee covering the date."""
+        return self.query(employee, d, d)
+
+    def is_covered(self, employee, d):
+        return bool(self.at(employee, d))
+
+    def overlaps(self, employee=None):
+        """
+        Pairs of overlapping leaves as (employee, leave_a, leave_b), leave_a
+        starting first; for one employee or all of them.
+        """
+        employees = [employee] if employee else list(self._index)
+        result = []
+        for emp in employees:
+            entry = self._index.get(emp)
+            if not entry:
+                continue
+            active = []
+            for from_ord, to_ord, leave in entry[2]:
+                active = [(end, other) for end, other in active if end >= from_ord]
+                result.extend((emp, other, leave) for _end, other in active)
+                active.append((to_ord, leave))
+        return result
+
+
+def get_approved_leaves(employees, start_date, end_date):
+    """
+    Approved Leave Applications and Spanish Leave Applications of the
+    employees overlapping the range, tagged with their doctype.
+    """
+    employees = list(employees)
+    if not employees:
+        return []
+
+    leaves = frappe.get_all(
+        "Leave Application",
+        filters={
+            "employee": ["in", employees],
+            "status": "Approved",
+            "from_date": ["<=", end_date],
+            "to_date": [">=", start_date]
+        },
+        fields=LEAVE_FIELDS
+    )
+    for leave in leaves:
+        leave.doctype = "Leave Application"
+
+    if frappe.db.table_exists(SPANISH_LEAVE_DOCTYPE):
+        spanish_leaves = frappe.get_all(
+            SPANISH_LEAVE_DOCTYPE,
+            filters={
+                "employee": ["in", employees],
+                "status": ["in", SPANISH_APPROVED_STATUSES],
+                "from_date": ["<=", end_date],
+                "to_date": [">=", start_date]
+            },
+            fields=LEAVE_FIELDS
+        )
+        for leave in spanish_leaves:
+            leave.doctype = SPANISH_LEAVE_DOCTYPE
+        leaves += spanish_leaves
+
+    return leaves
+
+
+def load_leave_index(employees, start_date, end_date):
+    """LeaveIndex of the approved leaves (both doctypes) of the employees in the range."""
+    return LeaveIndex(get_approved_leaves(employees, start_date, end_date))
@@ -4,8 +4,10 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, today, getdate
+from frappe.utils.background_jobs import is_job_enqueued
+from frappe.utils import cint, flt, now, today, getdate
 import json
+import os
 
 # Importar funciones compartidas del DocType
 from hrms_integrations.hrms_integrations.doctype.liquidacion_nomina.liquidacion_nomina import (
@@ -19,8 +21,37 @@ from hrms_integrations.hrms_integrations.doctype.liquidacion_nomina.liquidacion_
 	MONTH_MAP
 )
 
+from portal_rrhh.api.nominas_export import (
+	ExcelStreamWriter,
+	ColumnTotals,
+	attach_tempfile,
+	count_liquidaciones_export,
+	iter_liquidaciones_export
+)
+
 DOCTYPE_NAME = "Liquidacion Nomina"
 
+# Columnas de los Excel: (cabecera, ancho, formato)
+REPORTE_COLUMNAS = [
+	("Empresa", 15, None), ("Empleado", 25, None), ("DNI/NIE", 12, None),
+	("Designation", 15, None), ("Course", 30, None),
+	("Horas Normales", 12, None), ("Horas Extras", 12, None), ("Total Horas", 12, None),
+	("Días Trabajados", 12, None),
+	("Precio/Hora", 12, "currency"), ("Precio/Hora Extra", 12, "currency"),
+	("Bruto", 12, "currency"), ("Vacaciones Mes", 12, "currency"), ("Bruto - Vacaciones", 15, "currency"),
+	("Base SS", 12, "currency"), ("Importe SS", 12, "currency"), ("TOTAL", 12, "currency"),
+	("Estado", 15, None), ("Fecha Liquidación", 15, None)
+]
+
+ASESORIA_COLUMNAS = [
+	("Mes", 10, None), ("Año", 8, None), ("Docente", 25, None), ("DNI/NIE", 12, None),
+	("Cargo", 15, None), ("Empresa", 20, None), ("Provincia", 15, None), ("Curso", 30, None),
+	("Horas N.", 10, "number"), ("Horas E.", 10, "number"), ("Total H.", 10, "number"),
+	("€/Hora", 10, "currency"), ("Bruto+V", 12, "currency"), ("Vacaciones", 12, "currency"),
+	("Bruto", 12, "currency"), ("SS Empresa", 12, "currency"), ("TOTAL", 12, "currency"),
+	("Últ. Mes", 10, None)
+]
+
 
 @frappe.whitelist()
 def get_prevision_mes(mes, año, employee=None, course=None):
@@ -37,81 +68,13 @@ def get_prevision_mes(mes, año, employee=None, course=None):
 	previsiones = []
 	documentos_procesados = set()  # Para evitar duplicados
 	
-	# Obtener Job Offers (activos y con histórico pendiente)
+	# Obtener Job Offers y Modificaciones RRHH (activos y con histórico pendiente)
 	job_offers = get_job_offers_docentes(
 		employee=employee, 
 		mes=mes, 
 		año=año, 
 		incluir_historico=True
 	)
-	
-	for jo in job_offers:
-		# Obtener courses del Job Offer
-		courses = get_courses_from_job_offer(jo.name)
-		
-		# Si no hay cursos asignados, incluir el docente sin curso
-		if not courses:
-			doc_key = f"JO-{jo.name}-SIN_CURSO"
-			if doc_key not in documentos_procesados:
-				documentos_procesados.add(doc_key)
-				
-				# Si no se filtró por curso específico, incluir
-				if not course:
-					prevision = calcular_prevision_sin_curso(
-						employee=jo.employee,
-						employee_name=jo.employee_name,
-						dni_nie=jo.dni_nie,
-						designation=jo.designation,
-						company=jo.company,
-						source_type="Job Offer",
-						source_doc=jo.name,
-						mes=mes,
-						año=año,
-						precio_hora=jo.precio_hora,
-						workflow_state=jo.workflow_state,
-						fecha_inicio=jo.fecha_inicio,
-						fecha_fin=jo.fecha_fin
-					)
-					if prevision:
-						previsiones.append(prevision)
-		
-		for course_name in courses:
-			# Evitar duplicados
-			doc_key = f"JO-{jo.name}-{course_name}"
-			if doc_key in documentos_procesados:
-				continue
-			documentos_procesados.add(doc_key)
-			
-			# Filtrar por course si se especificó (búsqueda parcial)
-			if course and course.lower() not in course_name.lower():
-				continue
-			
-			# Verificar si ya existe liquidación para este empleado + curso + mes
-			if existe_liquidacion(jo.name, course_name, mes, año, employee=jo.employee):
-				continue
-			
-			# Calcular previsión
-			prevision = calcular_prevision_liquidacion(
-				employee=jo.employee,
-				employee_name=jo.employee_name,
-				dni_nie=jo.dni_nie,
-				designation=jo.designation,
-				company=jo.company,
-				source_type="Job Offer",
-				source_doc=jo.name,
-				course=course_name,
-				mes=mes,
-				año=año,
-				precio_hora=jo.precio_hora,
-				workflow_state=jo.workflow_state,
-				fecha_inicio=jo.fecha_inicio,
-				fecha_fin=jo.fecha_fin
-			)
-			
-			if prevision:
-				previsiones.append(prevision)
-	
-	# Obtener Modificaciones RRHH (activas y con histórico pendiente)
 	modificaciones = get_modificaciones_docentes(
 		employee=employee, 
 		mes=mes, 
@@ -119,39 +82,60 @@ def get_prevision_mes(mes, año, employee=None, course=None):
 		incluir_historico=True
 	)
 	
+	# Documentos origen con sus cursos, en el mismo orden que se presentan
+	cursos_jo, cursos_mod = get_cursos_fuentes(job_offers, modificaciones)
+	fuentes = []
+	for jo in job_offers:
+		fuentes.append(("JO", "Job Offer", jo, cursos_jo.get(jo.name, [])))
 	for mod in modificaciones:
-		# Obtener courses de la Modificación (del job_offer original)
-		courses = get_courses_from_modificacion(mod.name)
+		# Los courses de la Modificación vienen del job_offer original
+		fuentes.append(("MOD", "Modificaciones RRHH", mod, cursos_mod.get(mod.name, [])))
+	
+	# Cargar en bloque todo lo necesario para el mes (liquidaciones existentes,
+	# identificadores de curso y horas de calendario) en lugar de consultar por fila
+	cursos_mes = set()
+	for _prefix, _source_type, _doc, courses in fuentes:
+		cursos_mes.update(
+			c for c in courses
+			if not course or course.lower() in c.lower()
+		)
+	
+	existentes = get_liquidaciones_existentes(mes, año)
+	course_displays = get_course_displays(cursos_mes)
+	horas_por_curso = get_horas_cursos_mes(cursos_mes, mes, año)
+	
+	for prefix, source_type, doc, courses in fuentes:
+		datos_comunes = {
+			'employee': doc.employee,
+			'employee_name': doc.employee_name,
+			'dni_nie': doc.dni_nie,
+			'designation': doc.designation,
+			'company': doc.company,
+			'source_type': source_type,
+			'source_doc': doc.name,
+			'mes': mes,
+			'año': año,
+			'precio_hora': doc.precio_hora,
+			'workflow_state': doc.workflow_state,
+			'fecha_inicio': doc.fecha_inicio,
+			'fecha_fin': doc.fecha_fin
+		}
 		
 		# Si no hay cursos asignados, incluir el docente sin curso
 		if not courses:
-			doc_key = f"MOD-{mod.name}-SIN_CURSO"
+			doc_key = f"{prefix}-{doc.name}-SIN_CURSO"
 			if doc_key not in documentos_procesados:
 				documentos_procesados.add(doc_key)
 				
 				# Si no se filtró por curso específico, incluir
 				if not course:
-					prevision = calcular_prevision_sin_curso(
-						employee=mod.employee,
-						employee_name=mod.employee_name,
-						dni_nie=mod.dni_nie,
-						designation=mod.designation,
-						company=mod.company,
-						source_type="Modificaciones RRHH",
-						source_doc=mod.name,
-						mes=mes,
-						año=año,
-						precio_hora=mod.precio_hora,
-						workflow_state=mod.workflow_state,
-						fecha_inicio=mod.fecha_inicio,
-						fecha_fin=mod.fecha_fin
-					)
+					prevision = calcular_prevision_sin_curso(**datos_comunes)
 					if prevision:
 						previsiones.append(prevision)
 		
 		for course_name in courses:
 			# Evitar duplicados
-			doc_key = f"MOD-{mod.name}-{course_name}"
+			doc_key = f"{prefix}-{doc.name}-{course_name}"
 			if doc_key in documentos_procesados:
 				continue
 			documentos_procesados.add(doc_key)
@@ -161,25 +145,15 @@ def get_prevision_mes(mes, año, employee=None, course=None):
 				continue
 			
 			# Verificar si ya existe liquidación para este empleado + curso + mes
-			if existe_liquidacion(mod.name, course_name, mes, año, employee=mod.employee):
+			if liquidacion_existente(existentes, doc.name, course_name, employee=doc.employee):
 				continue
 			
 			# Calcular previsión
 			prevision = calcular_prevision_liquidacion(
-				employee=mod.employee,
-				employee_name=mod.employee_name,
-				dni_nie=mod.dni_nie,
-				designation=mod.designation,
-				company=mod.company,
-				source_type="Modificaciones RRHH",
-				source_doc=mod.name,
 				course=course_name,
-				mes=mes,
-				año=año,
-				precio_hora=mod.precio_hora,
-				workflow_state=mod.workflow_state,
-				fecha_inicio=mod.fecha_inicio,
-				fecha_fin=mod.fecha_fin
+				course_display=course_displays.get(course_name),
+				horas_data=horas_por_curso.get(course_name),
+				**datos_comunes
 			)
 			
 			if prevision:
@@ -259,7 +233,7 @@ def crear_liquidaciones_mes(mes, año, liquidaciones_data):
 
 
 @frappe.whitelist()
-def generar_liquidaciones_masivas(mes, año):
+def generar_liquidaciones_masivas(mes, año, bulk=0):
 	"""
 	Genera todas las liquidaciones pendientes para el mes especificado.
 	
@@ -272,10 +246,14 @@ def generar_liquidaciones_masivas(mes, año):
 	Args:
 		mes: Mes para generar liquidaciones (ej: 'Febrero')
 		año: Año para generar liquidaciones
+		bulk: Si es 1, inserta por bloques con bulk_insert en lugar de documento a documento
 	
 	Returns:
 		dict con resumen del proceso (creadas, omitidas, errores, por_docente)
 	"""
+	# El modo bulk no pasa por doc.insert(), así que el permiso de creación se comprueba aquí
+	frappe.has_permission(DOCTYPE_NAME, "create", throw=True)
+	
 	año = int(año)
 	
 	# Obtener todas las previsiones pendientes
@@ -292,83 +270,171 @@ def generar_liquidaciones_masivas(mes, año):
 			'message': _("No hay liquidaciones pendientes para {0} {1}").format(mes, año)
 		}
 	
-	# Agrupar por docente para el reporte
-	por_docente = {}
-	creadas = 0
-	omitidas = 0
-	errores = []
-	
-	for prev in previsiones:
-		employee_name = prev.get('employee_name', 'Desconocido')
-		employee = prev.get('employee')
-		
-		if employee_name not in por_docente:
-			por_docente[employee_name] = {
-				'employee': employee,
-				'liquidaciones': [],
-				'creadas': 0,
-				'errores': 0
-			}
-		
-		try:
-			# Verificar nuevamente si ya existe (por si se creó entre la previsión y ahora)
-			if existe_liquidacion(prev['source_doc'], prev['course'], mes, año, employee=prev['employee']):
-				omitidas += 1
-				continue
-			
-			# Crear liquidación
-			doc = frappe.new_doc(DOCTYPE_NAME)
-			doc.employee = prev['employee']
-			doc.mes = mes
-			doc.año = año
-			doc.company = prev['company']
-			doc.source_document_type = prev['source_type']
-			doc.source_document = prev['source_doc']
-			doc.course = prev['course']
-			doc.precio_hora = prev['precio_hora']
-			doc.horas_extras = flt(prev.get('horas_extras', 0))
-			doc.precio_hora_extra = flt(prev.get('precio_hora_extra', 0))
-			doc.es_ultimo_mes = prev.get('es_ultimo_mes', 0)
-			doc.estado = "Borrador"  # Estado Borrador para permitir edición
-			
-			doc.insert()
-			# NO hacemos submit() - queda en docstatus=0 (Borrador)
-			
-			creadas += 1
-			por_docente[employee_name]['creadas'] += 1
-			por_docente[employee_name]['liquidaciones'].append({
-				'name': doc.name,
-				'course': prev['course'],
-				'total': doc.total  # Usar el total calculado por el DocType
-			})
-			
-		except frappe.exceptions.ValidationError as e:
-			error_msg = f"{employee_name} - {prev.get('course', 'N/A')}: {str(e)}"
-			errores.append(error_msg)
-			por_docente[employee_name]['errores'] += 1
-		except Exception as e:
-			error_msg = f"{employee_name} - {prev.get('course', 'N/A')}: {str(e)}"
-			errores.append(error_msg)
-			por_docente[employee_name]['errores'] += 1
-			frappe.log_error(message=str(e)[:500], title="Liquidaciones Masivas Error")
+	if cint(bulk):
+		resultado = crear_liquidaciones_bulk(previsiones, mes, año)
+	else:
+		resultado = crear_liquidaciones_una_a_una(previsiones, mes, año)
 	
 	# Resumen por docente (solo los que tuvieron liquidaciones)
 	resumen_docentes = {
-		nombre: datos for nombre, datos in por_docente.items() 
+		nombre: datos for nombre, datos in resultado['por_docente'].items() 
 		if datos['creadas'] > 0 or datos['errores'] > 0
 	}
 	
 	return {
 		'success': True,
-		'creadas': creadas,
-		'omitidas': omitidas,
-		'errores': errores,
+		'creadas': resultado['creadas'],
+		'omitidas': resultado['omitidas'],
+		'errores': resultado['errores'],
 		'total_docentes': len(resumen_docentes),
 		'por_docente': resumen_docentes,
-		'message': _("Se crearon {0} liquidaciones en borrador para {1} docentes. Revísalas y valídalas.").format(creadas, len(resumen_docentes))
+		'message': _("Se crearon {0} liquidaciones en borrador para {1} docentes. Revísalas y valídalas.").format(resultado['creadas'], len(resumen_docentes))
+	}
+
+
+@frappe.whitelist()
+def encolar_liquidaciones_masivas(mes, año):
+	"""
+	Encola la generación masiva de liquidaciones en segundo plano.
+	
+	Devuelve el job_id inmediatamente. El progreso se publica por realtime
+	(evento LIQUIDACIONES_MASIVAS_EVENT) y se puede consultar con
+	get_estado_liquidaciones_masivas. Si un job anterior para el mismo mes
+	se interrumpió, el nuevo continúa donde se quedó: las liquidaciones ya
+	creadas (y confirmadas por bloque) no vuelven a aparecer en la previsión.
+	"""
+	# El job crea las liquidaciones con bulk_insert, sin el control de permisos de doc.insert()
+	frappe.has_permission(DOCTYPE_NAME, "create", throw=True)
+	
+	año = int(año)
+	job_id = get_job_id_liquidaciones_masivas(mes, año)
+	
+	# Estado de una ejecución anterior: si no terminó, el nuevo job la reanuda
+	anterior = frappe.cache().get_value(get_cache_key_liquidaciones_masivas("estado", mes, año)) or {}
+	frappe.cache().delete_value(get_cache_key_liquidaciones_masivas("estado", mes, año))
+	
+	frappe.enqueue(
+		"portal_rrhh.api.nominas.procesar_liquidaciones_masivas",
+		queue="long",
+		timeout=3600,
+		job_id=job_id,
+		deduplicate=True,
+		mes=mes,
+		año=año,
+		user=frappe.session.user,
+		reanudado=anterior.get('status') in ('en_curso', 'error')
+	)
+	
+	return {
+		'success': True,
+		'job_id': job_id,
+		'message': _("Generación de liquidaciones de {0} {1} encolada").format(mes, año)
 	}
 
 
+@frappe.whitelist()
+def get_estado_liquidaciones_masivas(mes, año):
+	"""
+	Devuelve el último progreso publicado del job de generación masiva
+	(para clientes sin conexión realtime o que se reconectan).
+	
+	en_cola indica si el job sigue en la cola o ejecutándose; un estado
+	'en_curso' de un job que ya no está en cola se devuelve como 'perdido'
+	(worker caído o caché reiniciada) para que el cliente pueda reanudarlo.
+	"""
+	año = int(año)
+	job_id = get_job_id_liquidaciones_masivas(mes, año)
+	estado = frappe.cache().get_value(get_cache_key_liquidaciones_masivas("estado", mes, año)) or {
+		'job_id': job_id,
+		'status': 'sin_iniciar'
+	}
+	
+	estado['en_cola'] = is_job_enqueued(job_id)
+	if estado['status'] == 'en_curso' and not estado['en_cola']:
+		estado['status'] = 'perdido'
+	
+	return estado
+
+
+def procesar_liquidaciones_masivas(mes, año, user=None, reanudado=False):
+	"""
+	Job en segundo plano: crea las liquidaciones pendientes por bloques (modo bulk),
+	hace commit tras cada bloque y publica el progreso.
+	
+	El punto de reanudación está en la base de datos: la previsión excluye las
+	liquidaciones ya creadas, así que tras una interrupción solo quedan pendientes
+	los bloques que no llegaron a confirmarse.
+	"""
+	año = int(año)
+	job_id = get_job_id_liquidaciones_masivas(mes, año)
+	
+	pendientes = get_prevision_mes(mes, año).get('previsiones', [])
+	
+	progreso = {
+		'job_id': job_id,
+		'mes': mes,
+		'año': año,
+		'status': 'en_curso',
+		'total': len(pendientes),
+		'procesadas': 0,
+		'reanudado': bool(reanudado)
+	}
+	publicar_progreso_liquidaciones(progreso, user)
+	
+	def on_chunk(bloque, resultado):
+		frappe.db.commit()
+		
+		docentes = {p.get('employee_name', 'Desconocido') for p in bloque}
+		progreso.update({
+			'procesadas': progreso['procesadas'] + len(bloque),
+			'creadas': resultado['creadas'],
+			'omitidas': resultado['omitidas'],
+			'errores': len(resultado['errores']),
+			'docentes': {
+				nombre: {
+					'creadas': resultado['por_docente'][nombre]['creadas'],
+					'errores': resultado['por_docente'][nombre]['errores']
+				}
+				for nombre in docentes if nombre in resultado['por_docente']
+			}
+		})
+		publicar_progreso_liquidaciones(progreso, user)
+	
+	try:
+		resultado = crear_liquidaciones_bulk(pendientes, mes, año, on_chunk=on_chunk)
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(message=str(e)[:500], title="Liquidaciones Masivas Job Error")
+		progreso.update({'status': 'error', 'error': str(e)})
+		publicar_progreso_liquidaciones(progreso, user)
+		raise
+	
+	frappe.db.commit()
+	
+	resumen_docentes = {
+		nombre: datos for nombre, datos in resultado['por_docente'].items()
+		if datos['creadas'] > 0 or datos['errores'] > 0
+	}
+	progreso.update({
+		'status': 'completado',
+		'procesadas': progreso['total'],
+		'creadas': resultado['creadas'],
+		'omitidas': resultado['omitidas'],
+		'errores': len(resultado['errores']),
+		'docentes': {},
+		'resultado': {
+			'success': True,
+			'creadas': resultado['creadas'],
+			'omitidas': resultado['omitidas'],
+			'errores': resultado['errores'],
+			'total_docentes': len(resumen_docentes),
+			'por_docente': resumen_docentes,
+			'message': _("Se crearon {0} liquidaciones en borrador para {1} docentes. Revísalas y valídalas.").format(resultado['creadas'], len(resumen_docentes))
+		}
+	})
+	publicar_progreso_liquidaciones(progreso, user)
+
+
 @frappe.whitelist()
 def get_liquidaciones_mes(mes, año, employee=None, course=None, estado=None):
 	"""
@@ -401,8 +467,9 @@ def get_liquidaciones_mes(mes, año, employee=None, course=None, estado=None):
 	)
 	
 	# Añadir course_display a cada liquidación
+	course_displays = get_course_displays(liq['course'] for liq in liquidaciones)
 	for liq in liquidaciones:
-		liq['course_display'] = frappe.db.get_value('Course', liq['course'], 'custom_display_identifier') or liq['course']
+		liq['course_display'] = course_displays.get(liq['course']) or liq['course']
 	
 	# Calcular resumen
 	resumen = calcular_resumen(liquidaciones)
@@ -679,136 +746,56 @@ def generar_reporte_excel(mes, año, liquidaciones_ids=None):
 	filters = {
 		"mes": mes,
 		"año": int(año),
-		"docstatus": 1
+		"docstatus": 1,
+		"names": liquidaciones_ids
 	}
 	
-	if liquidaciones_ids:
-		filters["name"] = ["in", liquidaciones_ids]
-	
-	liquidaciones = frappe.get_all(DOCTYPE_NAME,
-		filters=filters,
-		fields="*",
-		order_by="company asc, employee_name asc"
-	)
-	
-	if not liquidaciones:
-		frappe.throw(_("No hay liquidaciones para exportar"))
-	
 	# Generar Excel
 	try:
-		from openpyxl import Workbook
-		from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-		from openpyxl.utils import get_column_letter
-		import io
-		
-		wb = Workbook()
-		ws = wb.active
-		ws.title = f"Liquidaciones {mes} {año}"
-		
-		# Estilos
-		header_font = Font(bold=True, color="FFFFFF")
-		header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-		header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-		thin_border = Border(
-			left=Side(style='thin'),
-			right=Side(style='thin'),
-			top=Side(style='thin'),
-			bottom=Side(style='thin')
-		)
-		currency_format = '#,##0.00 €'
+		writer = ExcelStreamWriter(f"Liquidaciones {mes} {año}", REPORTE_COLUMNAS)
+	except ImportError:
+		frappe.throw(_("El módulo openpyxl no está instalado. Ejecute: pip install openpyxl"))
+	
+	try:
+		writer.write_header()
+		totales = ColumnTotals(len(REPORTE_COLUMNAS), [5, 6, 7, 11, 12, 13, 14, 15, 16])
 		
-		# Headers
-		headers = [
-			"Empresa", "Empleado", "DNI/NIE", "Designation", "Course",
-			"Horas Normales", "Horas Extras", "Total Horas", "Días Trabajados",
-			"Precio/Hora", "Precio/Hora Extra",
-			"Bruto", "Vacaciones Mes", "Bruto - Vacaciones",
-			"Base SS", "Importe SS", "TOTAL",
-			"Estado", "Fecha Liquidación"
-		]
+		# Datos (en streaming, sin cargar todas las liquidaciones en memoria)
+		with frappe.db.unbuffered_cursor():
+			for liq in iter_liquidaciones_export(filters):
+				row_data = [
+					liq.company,
+					liq.employee_name,
+					liq.dni_nie,
+					liq.designation,
+					liq.course,
+					liq.horas_normales,
+					liq.horas_extras,
+					liq.total_horas,
+					liq.dias_trabajados,
+					liq.precio_hora,
+					liq.precio_hora_extra,
+					liq.bruto,
+					liq.vacaciones_mes,
+					liq.bruto_menos_vacaciones,
+					liq.base_ss,
+					liq.importe_ss,
+					liq.total,
+					liq.estado,
+					str(liq.fecha_liquidacion) if liq.fecha_liquidacion else ""
+				]
+				writer.write_row(row_data)
+				totales.add(row_data)
 		
-		for col_num, header in enumerate(headers, 1):
-			cell = ws.cell(row=1, column=col_num, value=header)
-			cell.font = header_font
-			cell.fill = header_fill
-			cell.alignment = header_alignment
-			cell.border = thin_border
-		
-		# Datos
-		for row_num, liq in enumerate(liquidaciones, 2):
-			row_data = [
-				liq.company,
-				liq.employee_name,
-				liq.dni_nie,
-				liq.designation,
-				liq.course,
-				liq.horas_normales,
-				liq.horas_extras,
-				liq.total_horas,
-				liq.dias_trabajados,
-				liq.precio_hora,
-				liq.precio_hora_extra,
-				liq.bruto,
-				liq.vacaciones_mes,
-				liq.bruto_menos_vacaciones,
-				liq.base_ss,
-				liq.importe_ss,
-				liq.total,
-				liq.estado,
-				str(liq.fecha_liquidacion) if liq.fecha_liquidacion else ""
-			]
-			
-			for col_num, value in enumerate(row_data, 1):
-				cell = ws.cell(row=row_num, column=col_num, value=value)
-				cell.border = thin_border
-				
-				# Formato de moneda para columnas de importes
-				if col_num in [10, 11, 12, 13, 14, 15, 16, 17]:
-					cell.number_format = currency_format
+		if not writer.rows_written:
+			frappe.throw(_("No hay liquidaciones para exportar"))
 		
 		# Fila de totales
-		total_row = len(liquidaciones) + 2
-		ws.cell(row=total_row, column=1, value="TOTALES").font = Font(bold=True)
-		
-		# Sumar columnas numéricas
-		sum_columns = {
-			6: sum(flt(l.horas_normales) for l in liquidaciones),
-			7: sum(flt(l.horas_extras) for l in liquidaciones),
-			8: sum(flt(l.total_horas) for l in liquidaciones),
-			12: sum(flt(l.bruto) for l in liquidaciones),
-			13: sum(flt(l.vacaciones_mes) for l in liquidaciones),
-			14: sum(flt(l.bruto_menos_vacaciones) for l in liquidaciones),
-			15: sum(flt(l.base_ss) for l in liquidaciones),
-			16: sum(flt(l.importe_ss) for l in liquidaciones),
-			17: sum(flt(l.total) for l in liquidaciones),
-		}
-		
-		for col, value in sum_columns.items():
-			cell = ws.cell(row=total_row, column=col, value=value)
-			cell.font = Font(bold=True)
-			cell.border = thin_border
-			if col >= 10:
-				cell.number_format = currency_format
-		
-		# Ajustar anchos de columna
-		column_widths = [15, 25, 12, 15, 30, 12, 12, 12, 12, 12, 12, 12, 12, 15, 12, 12, 12, 15, 15]
-		for i, width in enumerate(column_widths, 1):
-			ws.column_dimensions[get_column_letter(i)].width = width
-		
-		# Guardar en buffer
-		output = io.BytesIO()
-		wb.save(output)
-		output.seek(0)
+		writer.write_totals(totales.row())
 		
 		# Guardar como archivo en Frappe
 		filename = f"Liquidaciones_{mes}_{año}.xlsx"
-		file_doc = frappe.get_doc({
-			"doctype": "File",
-			"file_name": filename,
-			"content": output.getvalue(),
-			"is_private": 1
-		})
-		file_doc.save(ignore_permissions=True)
+		file_doc = attach_tempfile(writer.save_to_tempfile(), filename)
 		
 		return {
 			'success': True,
@@ -817,8 +804,8 @@ def generar_reporte_excel(mes, año, liquidaciones_ids=None):
 			'message': _("Reporte generado correctamente")
 		}
 		
-	except ImportError:
-		frappe.throw(_("El módulo openpyxl no está instalado. Ejecute: pip install openpyxl"))
+	except frappe.ValidationError:
+		raise
 	except Exception as e:
 		frappe.log_error(f"Error generando Excel: {str(e)}", "Generar Reporte Excel")
 		frappe.throw(_("Error generando el reporte: {0}").format(str(e)))
@@ -830,7 +817,8 @@ def generar_reporte_excel(mes, año, liquidaciones_ids=None):
 
 def calcular_prevision_liquidacion(employee, employee_name, dni_nie, designation, company,
 									source_type, source_doc, course, mes, año, precio_hora,
-									workflow_state=None, fecha_inicio=None, fecha_fin=None):
+									workflow_state=None, fecha_inicio=None, fecha_fin=None,
+									course_display=None, horas_data=None):
 	"""
 	Calcula la previsión de liquidación para un empleado/course/mes.
 	
@@ -849,12 +837,16 @@ def calcular_prevision_liquidacion(employee, employee_name, dni_nie, designation
 		workflow_state: Estado actual del workflow (Alta, Baja, etc.)
 		fecha_inicio: Fecha de inicio del contrato
 		fecha_fin: Fecha de fin del contrato
+		course_display: custom_display_identifier ya cargado (opcional)
+		horas_data: Horas del calendario ya calculadas (opcional)
 	"""
 	# Obtener custom_display_identifier del curso
-	course_display = frappe.db.get_value('Course', course, 'custom_display_identifier') or course
+	if not course_display:
+		course_display = frappe.db.get_value('Course', course, 'custom_display_identifier') or course
 	
 	# 1. Calcular horas desde el calendario
-	horas_data = calcular_horas_mes_desde_calendario(course, mes, año)
+	if horas_data is None:
+		horas_data = calcular_horas_mes_desde_calendario(course, mes, año)
 	
 	if not horas_data or horas_data['total_horas'] == 0:
 		return None
@@ -862,21 +854,8 @@ def calcular_prevision_liquidacion(employee, employee_name, dni_nie, designation
 	horas_normales = horas_data['total_horas']
 	dias_trabajados = horas_data['dias_trabajados']
 	
-	# 2. Calcular importes
-	importe_horas_normales = horas_normales * flt(precio_hora)
-	bruto = importe_horas_normales
-	
-	# 3. Calcular vacaciones (8.33%)
-	vacaciones_mes = round(bruto * 0.0833, 2)
-	
-	# 4. Calcular bruto menos vacaciones
-	bruto_menos_vacaciones = bruto - vacaciones_mes
-	
-	# 5. Calcular SS (32.07%)
-	importe_ss = round(bruto_menos_vacaciones * 0.3207, 2)
-	
-	# 6. Calcular total
-	total = bruto_menos_vacaciones + importe_ss
+	# 2. Calcular importes (vacaciones, SS y total con las reglas del DocType)
+	importes = calcular_importes_liquidacion(horas_normales, 0, precio_hora, 0)
 	
 	return {
 		'employee': employee,
@@ -896,15 +875,15 @@ def calcular_prevision_liquidacion(employee, employee_name, dni_nie, designation
 		'dias_trabajados': dias_trabajados,
 		'precio_hora': precio_hora,
 		'precio_hora_extra': round(flt(precio_hora) * 1.2, 2),
-		'importe_horas_normales': importe_horas_normales,
+		'importe_horas_normales': importes['bruto'],
 		'importe_horas_extras': 0,
-		'bruto': bruto,
-		'vacaciones_mes': vacaciones_mes,
-		'bruto_menos_vacaciones': bruto_menos_vacaciones,
+		'bruto': importes['bruto'],
+		'vacaciones_mes': importes['vacaciones_mes'],
+		'bruto_menos_vacaciones': importes['bruto_menos_vacaciones'],
 		'vacaciones_acumuladas': 0,
-		'base_ss': bruto_menos_vacaciones,
-		'importe_ss': importe_ss,
-		'total': total,
+		'base_ss': importes['base_ss'],
+		'importe_ss': importes['importe_ss'],
+		'total': importes['total'],
 		'estado': 'Previsión',
 		'es_ultimo_mes': 0,
 		'workflow_state': workflow_state,
@@ -959,6 +938,385 @@ def calcular_prevision_sin_curso(employee, employee_name, dni_nie, designation,
 	}
 
 
+LIQUIDACIONES_MASIVAS_EVENT = "liquidaciones_masivas_progress"
+
+
+def get_job_id_liquidaciones_masivas(mes, año):
+	"""Job id estable por mes/año (evita dos generaciones simultáneas del mismo mes)"""
+	return f"liquidaciones_masivas::{mes}::{año}"
+
+
+def get_cache_key_liquidaciones_masivas(tipo, mes, año):
+	return f"portal_rrhh:liquidaciones_masivas:{tipo}:{mes}:{año}"
+
+
+def publicar_progreso_liquidaciones(progreso, user=None):
+	"""Guarda el último progreso en caché y lo publica por realtime al usuario que lanzó el job"""
+	frappe.cache().set_value(
+		get_cache_key_liquidaciones_masivas("estado", progreso['mes'], progreso['año']),
+		progreso,
+		expires_in_sec=86400
+	)
+	frappe.publish_realtime(LIQUIDACIONES_MASIVAS_EVENT, progreso, user=user)
+
+
+def nuevo_resultado_masivo():
+	"""Estructura acumulada del proceso de generación masiva"""
+	return {
+		'creadas': 0,
+		'omitidas': 0,
+		'errores': [],
+		'por_docente': {}
+	}
+
+
+def registrar_docente(resultado, prev):
+	"""Devuelve (creando si hace falta) la entrada por_docente de una previsión"""
+	employee_name = prev.get('employee_name', 'Desconocido')
+	
+	if employee_name not in resultado['por_docente']:
+		resultado['por_docente'][employee_name] = {
+			'employee': prev.get('employee'),
+			'liquidaciones': [],
+			'creadas': 0,
+			'errores': 0
+		}
+	
+	return resultado['por_docente'][employee_name]
+
+
+def registrar_error(resultado, prev, error):
+	"""Anota un error de creación en el resumen global y en el del docente"""
+	employee_name = prev.get('employee_name', 'Desconocido')
+	resultado['errores'].append(f"{employee_name} - {prev.get('course', 'N/A')}: {str(error)}")
+	registrar_docente(resultado, prev)['errores'] += 1
+
+
+def registrar_creada(resultado, prev, name, total):
+	"""Anota una liquidación creada en el resumen global y en el del docente"""
+	docente = registrar_docente(resultado, prev)
+	resultado['creadas'] += 1
+	docente['creadas'] += 1
+	docente['liquidaciones'].append({
+		'name': name,
+		'course': prev['course'],
+		'total': total
+	})
+
+
+def nueva_liquidacion(prev, mes, año):
+	"""Documento nuevo (sin guardar) de una liquidación en Borrador a partir de una previsión"""
+	doc = frappe.new_doc(DOCTYPE_NAME)
+	doc.employee = prev['employee']
+	doc.mes = mes
+	doc.año = año
+	doc.company = prev['company']
+	doc.source_document_type = prev['source_type']
+	doc.source_document = prev['source_doc']
+	doc.course = prev['course']
+	doc.precio_hora = prev['precio_hora']
+	doc.horas_extras = flt(prev.get('horas_extras', 0))
+	doc.precio_hora_extra = flt(prev.get('precio_hora_extra', 0))
+	doc.es_ultimo_mes = prev.get('es_ultimo_mes', 0)
+	doc.estado = "Borrador"  # Estado Borrador para permitir edición
+	return doc
+
+
+def insertar_liquidacion(prev, mes, año):
+	"""Crea una liquidación en Borrador a partir de una previsión (validate del DocType incluido)"""
+	doc = nueva_liquidacion(prev, mes, año)
+	doc.insert()
+	# NO hacemos submit() - queda en docstatus=0 (Borrador)
+	return doc
+
+
+def crear_liquidaciones_una_a_una(previsiones, mes, año, resultado=None):
+	"""Crea las liquidaciones documento a documento comprobando antes si ya existen"""
+	resultado = resultado or nuevo_resultado_masivo()
+	
+	for prev in previsiones:
+		registrar_docente(resultado, prev)
+		
+		try:
+			# Verificar nuevamente si ya existe (por si se creó entre la previsión y ahora)
+			if existe_liquidacion(prev['source_doc'], prev['course'], mes, año, employee=prev['employee']):
+				resultado['omitidas'] += 1
+				continue
+			
+			doc = insertar_liquidacion(prev, mes, año)
+			# Usar el total calculado por el DocType
+			registrar_creada(resultado, prev, doc.name, doc.total)
+			
+		except frappe.exceptions.ValidationError as e:
+			registrar_error(resultado, prev, e)
+		except Exception as e:
+			registrar_error(resultado, prev, e)
+			frappe.log_error(message=str(e)[:500], title="Liquidaciones Masivas Error")
+	
+	return resultado
+
+
+# Vacaciones: 30 días / 360 del bruto. SS empresa sobre el bruto sin vacaciones
+PORCENTAJE_VACACIONES = 0.0833
+PORCENTAJE_SS_EMPRESA = 0.3207
+
+
+def calcular_importes_liquidacion(horas_normales, horas_extras, precio_hora, precio_hora_extra, vacaciones_acumuladas=0):
+	"""
+	Importes de una liquidación con las mismas reglas que el DocType:
+	vacaciones PORCENTAJE_VACACIONES del bruto y SS PORCENTAJE_SS_EMPRESA de la base,
+	que es el bruto menos vacaciones más las vacaciones acumuladas (solo en el último mes).
+	"""
+	bruto = flt(horas_normales) * flt(precio_hora) + flt(horas_extras) * flt(precio_hora_extra)
+	vacaciones_mes = round(bruto * PORCENTAJE_VACACIONES, 2)
+	bruto_menos_vacaciones = bruto - vacaciones_mes
+	base_ss = bruto_menos_vacaciones + flt(vacaciones_acumuladas)
+	importe_ss = round(base_ss * PORCENTAJE_SS_EMPRESA, 2)
+	
+	return {
+		'bruto': bruto,
+		'vacaciones_mes': vacaciones_mes,
+		'bruto_menos_vacaciones': bruto_menos_vacaciones,
+		'vacaciones_acumuladas': flt(vacaciones_acumuladas),
+		'base_ss': base_ss,
+		'importe_ss': importe_ss,
+		'total': base_ss + importe_ss
+	}
+
+
+def get_vacaciones_acumuladas(previsiones, año):
+	"""
+	Equivalente en bloque de obtener_vacaciones_acumuladas() para las previsiones
+	de último mes: {(employee, course): vacaciones de las liquidaciones validadas del año}
+	"""
+	employees = list({p['employee'] for p in previsiones if cint(p.get('es_ultimo_mes'))})
+	if not employees:
+		return {}
+	
+	rows = frappe.db.sql("""
+		SELECT employee, course, SUM(vacaciones_mes) AS total
+		FROM `tabLiquidacion Nomina`
+		WHERE employee IN %(employees)s
+		AND año = %(año)s
+		AND docstatus = 1
+		GROUP BY employee, course
+	""", {"employees": employees, "año": int(año)}, as_dict=True)
+	
+	return {(r.employee, r.course): round(flt(r.total), 2) for r in rows}
+
+
+BULK_CHUNK_SIZE = 200
+
+BULK_FIELDS = [
+	"name", "owner", "modified_by", "creation", "modified", "docstatus",
+	"employee", "employee_name", "dni_nie", "designation", "company",
+	"mes", "año", "course", "source_document_type", "source_document",
+	"horas_normales", "horas_extras", "total_horas", "dias_trabajados",
+	"precio_hora", "precio_hora_extra",
+	"bruto", "vacaciones_mes", "bruto_menos_vacaciones", "vacaciones_acumuladas",
+	"base_ss", "importe_ss", "total", "estado", "es_ultimo_mes"
+]
+
+
+def crear_liquidaciones_bulk(previsiones, mes, año, chunk_size=BULK_CHUNK_SIZE, on_chunk=None):
+	"""
+	Crea las liquidaciones por bloques.
+	
+	- Las existentes se descartan con una única consulta (get_liquidaciones_existentes).
+	- Cada documento se prepara en memoria con los importes de calcular_importes_liquidacion
+	  (vacaciones acumuladas incluidas en el último mes) y pasa por el validate del DocType.
+	- Los nombres se asignan con set_new_name(), igual que en doc.insert().
+	- Cada bloque se inserta con frappe.db.bulk_insert dentro de un savepoint; si el bloque
+	  falla se deshace y se reintenta documento a documento para aislar el error.
+	- Las previsiones sin curso pasan siempre por la creación normal.
+	
+	on_chunk: callback opcional (bloque, resultado) llamado tras procesar cada bloque.
+	"""
+	resultado = nuevo_resultado_masivo()
+	existentes = get_liquidaciones_existentes(mes, año)
+	
+	pendientes = []
+	for prev in previsiones:
+		registrar_docente(resultado, prev)
+		
+		if prev.get('course') and liquidacion_existente(existentes, prev['source_doc'], prev['course'], employee=prev['employee']):
+			resultado['omitidas'] += 1
+			continue
+		
+		pendientes.append(prev)
+	
+	vacaciones_acumuladas = get_vacaciones_acumuladas(pendientes, año)
+	
+	for i in range(0, len(pendientes), chunk_size):
+		bloque = pendientes[i:i + chunk_size]
+		con_curso = [p for p in bloque if p.get('course')]
+		sin_curso = [p for p in bloque if not p.get('course')]
+		
+		if con_curso:
+			insertar_bloque_liquidaciones(con_curso, mes, año, resultado, vacaciones_acumuladas)
+		if sin_curso:
+			crear_liquidaciones_una_a_una(sin_curso, mes, año, resultado)
+		
+		if on_chunk:
+			on_chunk(bloque, resultado)
+	
+	return resultado
+
+
+def preparar_liquidacion_bulk(prev, mes, año, vacaciones_acumuladas=0):
+	"""
+	Documento en memoria listo para bulk_insert: valores de la previsión, importes
+	de calcular_importes_liquidacion y validate del DocType (que puede recalcularlos).
+	"""
+	doc = nueva_liquidacion(prev, mes, año)
+	horas_normales = flt(prev.get('horas_normales'))
+	importes = calcular_importes_liquidacion(
+		horas_normales, doc.horas_extras, doc.precio_hora, doc.precio_hora_extra,
+		vacaciones_acumuladas if cint(doc.es_ultimo_mes) else 0
+	)
+	doc.update({
+		'employee_name': prev.get('employee_name'),
+		'dni_nie': prev.get('dni_nie'),
+		'designation': prev.get('designation'),
+		'horas_normales': horas_normales,
+		'total_horas': horas_normales + doc.horas_extras,
+		'dias_trabajados': cint(prev.get('dias_trabajados')),
+		**importes
+	})
+	
+	doc.run_method("before_validate")
+	doc.run_method("validate")
+	return doc
+
+
+def insertar_bloque_liquidaciones(bloque, mes, año, resultado, vacaciones_acumuladas=None):
+	"""Inserta un bloque de previsiones con bulk_insert protegido por un savepoint"""
+	savepoint = "liquidaciones_bulk"
+	ahora = now()
+	usuario = frappe.session.user
+	vacaciones_acumuladas = vacaciones_acumuladas or {}
+	
+	preparadas = []
+	for prev in bloque:
+		try:
+			doc = preparar_liquidacion_bulk(
+				prev, mes, año,
+				vacaciones_acumuladas.get((prev['employee'], prev['course']), 0)
+			)
+		except frappe.exceptions.ValidationError as e:
+			registrar_error(resultado, prev, e)
+			continue
+		except Exception as e:
+			registrar_error(resultado, prev, e)
+			frappe.log_error(message=str(e)[:500], title="Liquidaciones Masivas Error")
+			continue
+		preparadas.append((prev, doc))
+	
+	if not preparadas:
+		return
+	
+	frappe.db.savepoint(savepoint)
+	try:
+		filas = []
+		for _prev, doc in preparadas:
+			# Nombre con el autoname del DocType (make_autoname/getseries de frappe)
+			doc.set_new_name()
+			doc.update({
+				'owner': usuario, 'modified_by': usuario,
+				'creation': ahora, 'modified': ahora, 'docstatus': 0
+			})
+			filas.append(tuple(doc.get(f) for f in BULK_FIELDS))
+		
+		frappe.db.bulk_insert(DOCTYPE_NAME, BULK_FIELDS, filas)
+		
+	except Exception as e:
+		frappe.db.rollback(save_point=savepoint)
+		frappe.log_error(message=str(e)[:500], title="Liquidaciones Masivas Bulk Error")
+		# Reintentar el bloque documento a documento para aislar las filas con error
+		crear_liquidaciones_una_a_una([prev for prev, _doc in preparadas], mes, año, resultado)
+		return
+	
+	for prev, doc in preparadas:
+		registrar_creada(resultado, prev, doc.name, doc.total)
+
+
+def get_liquidaciones_existentes(mes, año):
+	"""
+	Obtiene en una sola consulta las liquidaciones no canceladas del mes.
+	Devuelve un set con las claves (employee, course) y (source_document, course).
+	"""
+	rows = frappe.db.sql("""
+		SELECT employee, source_document, course
+		FROM `tabLiquidacion Nomina`
+		WHERE mes = %(mes)s
+		AND año = %(año)s
+		AND docstatus != 2
+	""", {"mes": mes, "año": int(año)}, as_dict=True)
+	
+	existentes = set()
+	for row in rows:
+		if row.employee:
+			existentes.add(("EMP", row.employee, row.course))
+		if row.source_document:
+			existentes.add(("DOC", row.source_document, row.course))
+	
+	return existentes
+
+
+def liquidacion_existente(existentes, source_doc, course, employee=None):
+	"""Equivalente en memoria de existe_liquidacion() sobre get_liquidaciones_existentes()"""
+	if employee and ("EMP", employee, course) in existentes:
+		return True
+	return ("DOC", source_doc, course) in existentes
+
+
+def get_course_displays(courses):
+	"""Devuelve {course: custom_display_identifier} para varios cursos en una consulta"""
+	courses = [c for c in set(courses or []) if c]
+	if not courses:
+		return {}
+	
+	rows = frappe.get_all("Course",
+		filters={"name": ["in", courses]},
+		fields=["name", "custom_display_identifier"],
+		ignore_permissions=True
+	)
+	
+	return {r.name: r.custom_display_identifier or r.name for r in rows}
+
+
+def get_cursos_fuentes(job_offers, modificaciones):
+	"""
+	Cursos de los Job Offers y de las Modificaciones RRHH del mes, con las
+	funciones del DocType (get_courses_from_job_offer / get_courses_from_modificacion),
+	que son la fuente de verdad, llamadas una sola vez por documento distinto.
+
+	Returns:
+		(cursos por Job Offer, cursos por Modificación)
+	"""
+	cursos_jo = {}
+	for jo in job_offers:
+		if jo.name not in cursos_jo:
+			cursos_jo[jo.name] = get_courses_from_job_offer(jo.name)
+
+	cursos_mod = {}
+	for mod in modificaciones:
+		if mod.name not in cursos_mod:
+			cursos_mod[mod.name] = get_courses_from_modificacion(mod.name)
+
+	return cursos_jo, cursos_mod
+
+
+def get_horas_cursos_mes(courses, mes, año):
+	"""
+	Horas de calendario del mes de varios cursos. Se calculan con
+	calcular_horas_mes_desde_calendario (la misma regla que la Liquidacion Nomina)
+	una sola vez por curso distinto: varios docentes/documentos pueden compartir
+	curso, así que se reutiliza el resultado.
+	"""
+	return {c: calcular_horas_mes_desde_calendario(c, mes, año) for c in set(courses or []) if c}
+
+
 def calcular_resumen(items):
 	"""Calcula el resumen de una lista de liquidaciones/previsiones"""
 	if not items:
@@ -995,229 +1353,90 @@ def enviar_liquidaciones_asesoria(liquidaciones_ids, mes, año):
 	Genera un Excel profesional y lo envía por email.
 	Marca las liquidaciones como 'Enviado a Asesoría'.
 	"""
-	import io
-	from openpyxl import Workbook
-	from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-	from openpyxl.utils import get_column_letter
-	
 	if isinstance(liquidaciones_ids, str):
 		liquidaciones_ids = json.loads(liquidaciones_ids)
 	
 	if not liquidaciones_ids:
 		frappe.throw(_("No se han seleccionado liquidaciones para enviar"))
 	
-	# Obtener liquidaciones con datos completos
-	liquidaciones_data = []
+	# Todas deben existir, estar validadas (docstatus=1) y ser del mes enviado:
+	# el Excel solo incluye las del mes y se marcan como enviadas todas las seleccionadas
+	liquidaciones = {
+		liq.name: liq for liq in frappe.get_all(DOCTYPE_NAME,
+			filters={"name": ["in", liquidaciones_ids]},
+			fields=["name", "docstatus", "mes", "año"]
+		)
+	}
 	for liq_id in liquidaciones_ids:
-		doc = frappe.get_doc(DOCTYPE_NAME, liq_id)
-		
-		# Solo permitir enviar liquidaciones validadas (docstatus=1)
-		if doc.docstatus != 1:
+		liq = liquidaciones.get(liq_id)
+		if not liq:
+			frappe.throw(_("{0} {1} no encontrada").format(_(DOCTYPE_NAME), liq_id), frappe.DoesNotExistError)
+		if liq.docstatus != 1:
 			frappe.throw(_("Solo se pueden enviar liquidaciones validadas. '{0}' no está validada.").format(liq_id))
-		
-		# Obtener provincia y empresa del documento origen
-		provincia = ""
-		empresa = doc.company or ""
-		
-		if doc.source_document_type == "Job Offer" and doc.source_document:
-			jo_data = frappe.db.get_value("Job Offer", doc.source_document, 
-				["custom_provincia", "company"], as_dict=True)
-			if jo_data:
-				provincia = jo_data.get("custom_provincia") or ""
-				empresa = jo_data.get("company") or empresa
-		elif doc.source_document_type == "Modificaciones RRHH" and doc.source_document:
-			mr_data = frappe.db.get_value("Modificaciones RRHH", doc.source_document,
-				["custom_provincia", "company"], as_dict=True)
-			if mr_data:
-				provincia = mr_data.get("custom_provincia") or ""
-				empresa = mr_data.get("company") or empresa
-		
-		# Obtener course_display
-		course_display = frappe.db.get_value('Course', doc.course, 'custom_display_identifier') or doc.course
-		
-		liquidaciones_data.append({
-			'name': doc.name,
-			'mes': doc.mes,
-			'año': doc.año,
-			'employee_name': doc.employee_name,
-			'dni_nie': doc.dni_nie,
-			'designation': doc.designation,
-			'company': empresa,
-			'provincia': provincia,
-			'course': doc.course,
-			'course_display': course_display,
-			'horas_normales': doc.horas_normales,
-			'horas_extras': doc.horas_extras,
-			'total_horas': doc.total_horas,
-			'precio_hora': doc.precio_hora,
-			'bruto': doc.bruto,
-			'vacaciones_mes': doc.vacaciones_mes,
-			'bruto_menos_vacaciones': doc.bruto_menos_vacaciones,
-			'vacaciones_acumuladas': doc.vacaciones_acumuladas,
-			'base_ss': doc.base_ss,
-			'importe_ss': doc.importe_ss,
-			'total': doc.total,
-			'es_ultimo_mes': doc.es_ultimo_mes,
-			'source_document_type': doc.source_document_type,
-			'source_document': doc.source_document
-		})
+		if liq.mes != mes or cint(liq.año) != cint(año):
+			frappe.throw(_("La liquidación '{0}' es de {1} {2}, no de {3} {4}.").format(liq_id, liq.mes, liq.año, mes, año))
+	
+	filters = {"mes": mes, "año": año, "docstatus": 1, "names": liquidaciones_ids}
 	
 	# Crear Excel
-	wb = Workbook()
-	ws = wb.active
-	ws.title = f"Liquidaciones {mes} {año}"
-	
-	# Estilos
-	header_font = Font(bold=True, color="FFFFFF", size=11)
-	header_fill = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
-	header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-	
-	currency_format = '#,##0.00 €'
-	number_format = '#,##0.00'
-	
-	thin_border = Border(
-		left=Side(style='thin'),
-		right=Side(style='thin'),
-		top=Side(style='thin'),
-		bottom=Side(style='thin')
+	writer = ExcelStreamWriter(f"Liquidaciones {mes} {año}", ASESORIA_COLUMNAS, header_color="1F4E79")
+	# Filas que se van a escribir (el subtítulo va antes que los datos en streaming)
+	total_liquidaciones = count_liquidaciones_export(filters)
+	
+	# Título y subtítulo con fecha de generación
+	writer.write_title(f"LIQUIDACIONES DE NÓMINAS - {mes.upper()} {año}")
+	writer.write_title(
+		f"Generado el {frappe.utils.now_datetime().strftime('%d/%m/%Y %H:%M')} - Total: {total_liquidaciones} liquidaciones",
+		style="liq_subtitle"
 	)
+	writer.write_blank()
+	writer.write_header()
 	
-	alt_fill = PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid")
-	ultimo_mes_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
-	
-	# Título
-	ws.merge_cells('A1:R1')
-	title_cell = ws['A1']
-	title_cell.value = f"LIQUIDACIONES DE NÓMINAS - {mes.upper()} {año}"
-	title_cell.font = Font(bold=True, size=14, color="1F4E79")
-	title_cell.alignment = Alignment(horizontal="center", vertical="center")
-	ws.row_dimensions[1].height = 30
-	
-	# Subtítulo con fecha de generación
-	ws.merge_cells('A2:R2')
-	subtitle_cell = ws['A2']
-	subtitle_cell.value = f"Generado el {frappe.utils.now_datetime().strftime('%d/%m/%Y %H:%M')} - Total: {len(liquidaciones_data)} liquidaciones"
-	subtitle_cell.font = Font(italic=True, size=10, color="666666")
-	subtitle_cell.alignment = Alignment(horizontal="center")
-	ws.row_dimensions[2].height = 20
-	
-	# Headers
-	headers = [
-		("Mes", 10),
-		("Año", 8),
-		("Docente", 25),
-		("DNI/NIE", 12),
-		("Cargo", 15),
-		("Empresa", 20),
-		("Provincia", 15),
-		("Curso", 30),
-		("Horas N.", 10),
-		("Horas E.", 10),
-		("Total H.", 10),
-		("€/Hora", 10),
-		("Bruto+V", 12),
-		("Vacaciones", 12),
-		("Bruto", 12),
-		("SS Empresa", 12),
-		("TOTAL", 12),
-		("Últ. Mes", 10)
-	]
-	
-	header_row = 4
-	for col_idx, (header_name, width) in enumerate(headers, 1):
-		cell = ws.cell(row=header_row, column=col_idx, value=header_name)
-		cell.font = header_font
-		cell.fill = header_fill
-		cell.alignment = header_alignment
-		cell.border = thin_border
-		ws.column_dimensions[get_column_letter(col_idx)].width = width
-	
-	ws.row_dimensions[header_row].height = 25
-	
-	# Datos
-	data_alignment = Alignment(vertical="center")
-	currency_alignment = Alignment(horizontal="right", vertical="center")
-	
-	for row_idx, liq in enumerate(liquidaciones_data, header_row + 1):
-		row_data = [
-			liq['mes'],
-			liq['año'],
-			liq['employee_name'],
-			liq['dni_nie'],
-			liq['designation'],
-			liq['company'],
-			liq['provincia'],
-			liq['course_display'],
-			liq['horas_normales'],
-			liq['horas_extras'],
-			liq['total_horas'],
-			liq['precio_hora'],
-			liq['bruto'],
-			liq['vacaciones_mes'],
-			liq['bruto_menos_vacaciones'],
-			liq['importe_ss'],
-			liq['total'],
-			"Sí" if liq['es_ultimo_mes'] else "No"
-		]
-		
-		for col_idx, value in enumerate(row_data, 1):
-			cell = ws.cell(row=row_idx, column=col_idx, value=value)
-			cell.border = thin_border
-			cell.alignment = data_alignment
-			
-			# Formato numérico/moneda
-			if col_idx in [9, 10, 11]:  # Horas
-				cell.number_format = number_format
-			elif col_idx in [12, 13, 14, 15, 16, 17]:  # Importes
-				cell.number_format = currency_format
-				cell.alignment = currency_alignment
+	# Datos (la fila 5 es la primera tras título, subtítulo, línea en blanco y cabecera)
+	totales = ColumnTotals(len(ASESORIA_COLUMNAS), [8, 9, 10, 12, 13, 14, 15, 16])
+	
+	with frappe.db.unbuffered_cursor():
+		for row_idx, liq in enumerate(iter_liquidaciones_export(filters, order_by="employee_name asc, course asc"), 5):
+			row_data = [
+				liq.mes,
+				liq.año,
+				liq.employee_name,
+				liq.dni_nie,
+				liq.designation,
+				liq.empresa_origen,
+				liq.provincia,
+				liq.course_display,
+				flt(liq.horas_normales),
+				flt(liq.horas_extras),
+				flt(liq.total_horas),
+				flt(liq.precio_hora),
+				flt(liq.bruto),
+				flt(liq.vacaciones_mes),
+				flt(liq.bruto_menos_vacaciones),
+				flt(liq.importe_ss),
+				flt(liq.total),
+				"Sí" if liq.es_ultimo_mes else "No"
+			]
 			
 			# Colores alternados o último mes
-			if liq['es_ultimo_mes']:
-				cell.fill = ultimo_mes_fill
+			if liq.es_ultimo_mes:
+				fill = "ultimo"
 			elif row_idx % 2 == 0:
-				cell.fill = alt_fill
+				fill = "alt"
+			else:
+				fill = ""
+			
+			writer.write_row(row_data, fill=fill)
+			totales.add(row_data)
 	
 	# Fila de totales
-	total_row = header_row + len(liquidaciones_data) + 1
-	ws.cell(row=total_row, column=1, value="TOTALES").font = Font(bold=True)
-	ws.cell(row=total_row, column=1).border = thin_border
-	
-	for col_idx in range(2, 9):
-		ws.cell(row=total_row, column=col_idx).border = thin_border
-	
-	# Sumar columnas numéricas
-	sum_cols = {
-		9: sum(l['horas_normales'] for l in liquidaciones_data),
-		10: sum(l['horas_extras'] for l in liquidaciones_data),
-		11: sum(l['total_horas'] for l in liquidaciones_data),
-		13: sum(l['bruto'] for l in liquidaciones_data),
-		14: sum(l['vacaciones_mes'] for l in liquidaciones_data),
-		15: sum(l['bruto_menos_vacaciones'] for l in liquidaciones_data),
-		16: sum(l['importe_ss'] for l in liquidaciones_data),
-		17: sum(l['total'] for l in liquidaciones_data)
-	}
-	
-	for col_idx, total_value in sum_cols.items():
-		cell = ws.cell(row=total_row, column=col_idx, value=total_value)
-		cell.font = Font(bold=True)
-		cell.border = thin_border
-		if col_idx in [9, 10, 11]:
-			cell.number_format = number_format
-		else:
-			cell.number_format = currency_format
-			cell.alignment = currency_alignment
-	
-	ws.cell(row=total_row, column=18).border = thin_border
-	
-	# Guardar Excel en memoria
-	excel_buffer = io.BytesIO()
-	wb.save(excel_buffer)
-	excel_buffer.seek(0)
-	excel_content = excel_buffer.getvalue()
+	writer.write_totals(totales.row())
+	total_horas = totales.sums[10]
+	total_importe = totales.sums[16]
 	
 	# Nombre del archivo
 	filename = f"Liquidaciones_{mes}_{año}_{frappe.utils.now_datetime().strftime('%Y%m%d_%H%M%S')}.xlsx"
+	excel_path = writer.save_to_tempfile()
 	
 	# Obtener usuarios con rol Asesoría
 	asesoria_users = frappe.get_all(
@@ -1229,20 +1448,13 @@ def enviar_liquidaciones_asesoria(liquidaciones_ids, mes, año):
 	recipients = [u.parent for u in asesoria_users if u.parent and "@" in u.parent]
 	
 	if not recipients:
+		os.remove(excel_path)
 		frappe.throw(_("No se encontraron usuarios con rol Asesoría para enviar el email"))
 	
-	# Guardar archivo temporal para adjuntar
-	file_doc = frappe.get_doc({
-		"doctype": "File",
-		"file_name": filename,
-		"content": excel_content,
-		"is_private": 1
-	})
-	file_doc.insert(ignore_permissions=True)
+	# Guardar archivo para adjuntar (el email lo referencia por su File)
+	file_doc = attach_tempfile(excel_path, filename)
 	
 	# Enviar email
-	total_importe = sum(l['total'] for l in liquidaciones_data)
-	
 	frappe.sendmail(
 		recipients=recipients,
 		subject=f"Liquidaciones de Nóminas - {mes} {año}",
@@ -1259,11 +1471,11 @@ def enviar_liquidaciones_asesoria(liquidaciones_ids, mes, año):
 				<table style="width: 100%; border-collapse: collapse;">
 					<tr>
 						<td style="padding: 8px 0; border-bottom: 1px solid #ddd;">Total liquidaciones:</td>
-						<td style="padding: 8px 0; border-bottom: 1px solid #ddd; text-align: right; font-weight: bold;">{len(liquidaciones_data)}</td>
+						<td style="padding: 8px 0; border-bottom: 1px solid #ddd; text-align: right; font-weight: bold;">{writer.rows_written}</td>
 					</tr>
 					<tr>
 						<td style="padding: 8px 0; border-bottom: 1px solid #ddd;">Total horas:</td>
-						<td style="padding: 8px 0; border-bottom: 1px solid #ddd; text-align: right; font-weight: bold;">{sum(l['total_horas'] for l in liquidaciones_data):.2f}h</td>
+						<td style="padding: 8px 0; border-bottom: 1px solid #ddd; text-align: right; font-weight: bold;">{total_horas:.2f}h</td>
 					</tr>
 					<tr>
 						<td style="padding: 8px 0;">Importe total:</td>
@@ -1278,20 +1490,25 @@ def enviar_liquidaciones_asesoria(liquidaciones_ids, mes, año):
 			</p>
 		</div>
 		""",
-		attachments=[{
-			"fname": filename,
-			"fcontent": excel_content
-		}],
+		attachments=[{"fid": file_doc.name}],
 		now=True
 	)
 	
 	# Actualizar estado de las liquidaciones
-	liquidaciones_actualizadas = []
-	for liq_id in liquidaciones_ids:
-		doc = frappe.get_doc(DOCTYPE_NAME, liq_id)
-		doc.db_set("estado", "Enviado a Asesoría", update_modified=True)
-		doc.db_set("fecha_envio_asesoria", today(), update_modified=False)
-		liquidaciones_actualizadas.append(liq_id)
+	liquidaciones_actualizadas = list(liquidaciones_ids)
+	frappe.db.sql("""
+		UPDATE `tabLiquidacion Nomina`
+		SET estado = 'Enviado a Asesoría',
+			fecha_envio_asesoria = %(fecha)s,
+			modified = %(modified)s,
+			modified_by = %(user)s
+		WHERE name IN %(names)s
+	""", {
+		"fecha": today(),
+		"modified": now(),
+		"user": frappe.session.user,
+		"names": tuple(liquidaciones_actualizadas)
+	})
 	
 	frappe.db.commit()
 	
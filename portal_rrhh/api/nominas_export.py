@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Grupo ATU and contributors
+# For license information, please see license.txt
+
+"""
+Exportación de liquidaciones a Excel.
+
+Pipeline compartido por generar_reporte_excel y enviar_liquidaciones_asesoria:
+- Una única consulta con JOIN a Job Offer / Modificaciones RRHH / Course
+  para obtener provincia, empresa y course_display de cada liquidación.
+- openpyxl en modo write-only con estilos con nombre (NamedStyle), de forma
+  que las filas se escriben en streaming y no se guarda el libro en memoria.
+- El libro se guarda en un fichero temporal que se mueve a la carpeta de
+  ficheros del sitio y se registra como File sin leerlo en memoria.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import frappe
+from frappe.utils import flt
+
+
+DOCTYPE_NAME = "Liquidacion Nomina"
+
+CURRENCY_FORMAT = '#,##0.00 €'
+NUMBER_FORMAT = '#,##0.00'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def get_export_conditions(filters):
+	"""Condiciones y valores de la consulta de exportación (names admite lista o JSON)"""
+	conditions = ["liq.mes = %(mes)s", "liq.año = %(año)s"]
+	values = {"mes": filters["mes"], "año": int(filters["año"])}
+
+	if filters.get("docstatus") is not None:
+		conditions.append("liq.docstatus = %(docstatus)s")
+		values["docstatus"] = filters["docstatus"]
+
+	names = filters.get("names")
+	if isinstance(names, str):
+		names = json.loads(names)
+	if names:
+		conditions.append("liq.name IN %(names)s")
+		values["names"] = tuple(names)
+
+	return conditions, values
+
+
+def count_liquidaciones_export(filters):
+	"""Número de liquidaciones que exportará iter_liquidaciones_export con los mismos filtros"""
+	conditions, values = get_export_conditions(filters)
+	return frappe.db.sql(f"""
+		SELECT COUNT(*) FROM `tabLiquidacion Nomina` liq
+		WHERE {" AND ".join(conditions)}
+	""", values)[0][0]
+
+
+def iter_liquidaciones_export(filters, order_by="company asc, employee_name asc"):
+	"""
+	Itera las liquidaciones que cumplen los filtros junto con la provincia y empresa
+	del documento origen y el custom_display_identifier del curso, en una sola consulta.
+
+	Args:
+		filters: dict con mes, año, docstatus y opcionalmente names (lista de IDs o JSON)
+		order_by: orden de las filas (columnas de Liquidacion Nomina)
+	"""
+	conditions, values = get_export_conditions(filters)
+	order_by = ", ".join(f"liq.{part.strip()}" for part in order_by.split(","))
+
+	return frappe.db.sql(f"""
+		SELECT
+			liq.*,
+			COALESCE(jo.custom_provincia, mr.custom_provincia, '') AS provincia,
+			COALESCE(jo.company, mr.company, liq.company, '') AS empresa_origen,
+			COALESCE(NULLIF(c.custom_display_identifier, ''), liq.course) AS course_display
+		FROM `tabLiquidacion Nomina` liq
+		LEFT JOIN `tabJob Offer` jo
+			ON liq.source_document_type = 'Job Offer' AND jo.name = liq.source_document
+		LEFT JOIN `tabModificaciones RRHH` mr
+			ON liq.source_document_type = 'Modificaciones RRHH' AND mr.name = liq.source_document
+		LEFT JOIN `tabCourse` c
+			ON c.name = liq.course
+		WHERE {" AND ".join(conditions)}
+		ORDER BY {order_by}
+	""", values, as_dict=True, as_iterator=True)
+
+
+class ExcelStreamWriter:
+	"""
+	Escritor de hojas Excel en modo write-only.
+
+	Las columnas se definen como tuplas (cabecera, ancho, formato) donde formato es
+	None, 'number' o 'currency'. Los estilos de celda se registran una vez como
+	NamedStyle y cada fila solo referencia su nombre.
+	"""
+
+	def __init__(self, title, columns, header_color="4472C4"):
+		from openpyxl import Workbook
+		from openpyxl.utils import get_column_letter
+
+		self.columns = columns
+		self.rows_written = 0
+		self.wb = Workbook(write_only=True)
+		self.ws = self.wb.create_sheet(title=title[:31])
+
+		self._register_styles(header_color)
+
+		# En write-only los anchos deben fijarse antes de escribir filas
+		for idx, (_header, width, _fmt) in enumerate(columns, 1):
+			self.ws.column_dimensions[get_column_letter(idx)].width = width
+
+	def _register_styles(self, header_color):
+		from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+		side = Side(style='thin')
+		border = Border(left=side, right=side, top=side, bottom=side)
+		fills = {
+			"": None,
+			"alt": PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid"),
+			"ultimo": PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid"),
+		}
+		formats = {
+			"text": None,
+			"number": NUMBER_FORMAT,
+			"currency": CURRENCY_FORMAT,
+		}
+
+		def add(name, **kwargs):
+			style = NamedStyle(name=name)
+			for key, value in kwargs.items():
+				if value is not None:
+					setattr(style, key, value)
+			self.wb.add_named_style(style)
+
+		add("liq_title", font=Font(bold=True, size=14, color=header_color))
+		add("liq_subtitle", font=Font(italic=True, size=10, color="666666"))
+		add("liq_header",
+			font=Font(bold=True, color="FFFFFF", size=11),
+			fill=PatternFill(start_color=header_color, end_color=header_color, fill_type="solid"),
+			alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+			border=border)
+
+		for fmt_name, number_format in formats.items():
+			alignment = Alignment(horizontal="right", vertical="center") if fmt_name == "currency" else Alignment(vertical="center")
+			for fill_name, fill in fills.items():
+				add(f"liq_{fmt_name}_{fill_name}".rstrip("_"),
+					border=border, alignment=alignment, fill=fill, number_format=number_format)
+			add(f"liq_{fmt_name}_total",
+				font=Font(bold=True), border=border, alignment=alignment, number_format=number_format)
+
+	def _cells(self, values, styles):
+		from openpyxl.cell import WriteOnlyCell
+
+		cells = []
+		for value, style in zip(values, styles):
+			cell = WriteOnlyCell(self.ws, value=value)
+			if style:
+				cell.style = style
+			cells.append(cell)
+		return cells
+
+	def write_title(self, text, style="liq_title"):
+		self.ws.append(self._cells([text], [style]))
+
+	def write_blank(self):
+		self.ws.append([])
+
+	def write_header(self):
+		headers = [c[0] for c in self.columns]
+		self.ws.append(self._cells(headers, ["liq_header"] * len(headers)))
+
+	def write_row(self, values, fill=""):
+		styles = [
+			f"liq_{fmt or 'text'}_{fill}".rstrip("_")
+			for _header, _width, fmt in self.columns
+		]
+		self.ws.append(self._cells(values, styles))
+		self.rows_written += 1
+
+	def write_totals(self, values):
+		styles = [f"liq_{fmt or 'text'}_total" for _header, _width, fmt in self.columns]
+		self.ws.append(self._cells(values, styles))
+
+	def save_to_tempfile(self):
+		"""Guarda el libro en un fichero temporal y devuelve su ruta"""
+		fd, path = tempfile.mkstemp(suffix=".xlsx")
+		os.close(fd)
+		self.wb.save(path)
+		return path
+
+
+class ColumnTotals:
+	"""Acumula totales por columna mientras se escriben las filas"""
+
+	def __init__(self, size, sum_columns):
+		self.size = size
+		self.sums = {col: 0 for col in sum_columns}
+
+	def add(self, values):
+		for col in self.sums:
+			self.sums[col] += flt(values[col])
+
+	def row(self, label="TOTALES"):
+		values = [None] * self.size
+		values[0] = label
+		for col, total in self.sums.items():
+			values[col] = total
+		return values
+
+
+def attach_tempfile(path, filename, is_private=1):
+	"""
+	Crea un File a partir del fichero temporal sin cargarlo en memoria: el
+	fichero se mueve a la carpeta de ficheros del sitio y el hash y el tamaño
+	se calculan leyendo por bloques.
+	"""
+	try:
+		content_hash = hashlib.md5()
+		with open(path, "rb") as f:
+			for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+				content_hash.update(block)
+
+		folder = ("private", "files") if is_private else ("public", "files")
+		stored_name = filename
+		if os.path.exists(frappe.get_site_path(*folder, stored_name)):
+			stem, ext = os.path.splitext(filename)
+			stored_name = f"{stem}{frappe.generate_hash(length=6)}{ext}"
+		stored_path = frappe.get_site_path(*folder, stored_name)
+
+		shutil.move(path, stored_path)
+		path = stored_path
+
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": filename,
+			"file_url": ("/private/files/" if is_private else "/files/") + stored_name,
+			"file_size": os.path.getsize(stored_path),
+			"content_hash": content_hash.hexdigest(),
+			"is_private": is_private
+		})
+		file_doc.insert(ignore_permissions=True)
+		path = None
+		return file_doc
+	finally:
+		# Si no llegó a crearse el File no debe quedar el fichero
+		if path and os.path.exists(path):
+			os.remove(path)
@@ -0,0 +1,91 @@
+"""
+Batch permission evaluation.
+
+frappe.has_permission(doctype, "read", name) loads and checks one document at
+a time. The helpers here turn the same rules frappe.get_list applies (role
+permissions, "if owner", User Permissions, shared documents and
+permission_query_conditions hooks) into one SQL predicate on
+`tab<doctype>`, so a whole result set is filtered in a single query or the
+predicate is merged into an existing one.
+
+Document-level has_permission hooks (hooks.py `has_permission`) cannot be
+expressed in SQL. For doctypes with such a hook the SQL predicate only narrows
+the candidates: filter_readable then checks each candidate of the given set
+with frappe.has_permission, and paged listings apply it to the rows of the page.
+"""
+
+import frappe
+from frappe.model.db_query import DatabaseQuery
+
+
+NO_ACCESS = "1 = 0"
+CHUNK_SIZE = 1000
+
+
+def has_permission_hooks(doctype):
+    """Whether an app registers a document-level has_permission hook for the doctype."""
+    return bool(frappe.get_hooks("has_permission").get(doctype))
+
+
+def get_permission_predicate(doctype, user=None):
+    """
+    SQL condition on `tab<doctype>` matching the documents the user can read.
+    Returns "" when the user can read every document and NO_ACCESS when none.
+
+    This is the condition frappe.get_list applies. For doctypes with
+    has_permission hooks it is a superset of the readable documents: callers
+    post-filter the rows of the page with filter_readable, so page sizes and
+    counts are approximate for those doctypes.
+    """
+    query = DatabaseQuery(doctype, user=user or frappe.session.user)
+    query.conditions = []
+    try:
+        match_conditions = query.build_match_conditions(as_condition=True)
+    except frappe.PermissionError:
+        return NO_ACCESS
+
+    # Without role permissions the only access is through shared documents,
+    # which build_match_conditions adds to query.conditions
+    conditions = [c for c in (*query.conditions, match_conditions) if c]
+    if not conditions:
+        return ""
+    return " and ".join(f"({c})" for c in conditions)
+
+
+def filter_readable(doctype, names, user=None):
+    """Subset of names the user can read, checked in chunks of CHUNK_SIZE."""
+    user = user or frappe.session.user
+    names = list({n for n in names if n})
+    if not names:
+        return set()
+
+    predicate = get_permission_predicate(doctype, user)
+    if predicate == NO_ACCESS:
+        return set()
+
+    readable = set()
+    if not predicate:
+        readable.update(names)
+    else:
+        for i in range(0, len(names), CHUNK_SIZE):
+            readable.update(_matching_names(doctype, predicate, names[i:i + CHUNK_SIZE]))
+
+    if has_permission_hooks(doctype):
+        readable = _check_each(doctype, readable, user)
+    return readable
+
+
+def _matching_names(doctype, predicate, names):
+    return frappe.db.sql_list(
+        f"""
+        SELECT `tab{doctype}`.name
+        FROM `tab{doctype}`
+        WHERE `tab{doctype}`.name IN %(names)s AND ({predicate})
+        """,
+        {"names": tuple(names)}
+    )
+
+
+def _check_each(doctype, names, user):
+    """Names passing frappe.has_permission, for doctypes with has_permission hooks."""
+    return {n for n in names if frappe.has_permission(doctype, "read", n, user=user)}
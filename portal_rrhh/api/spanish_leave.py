@@ -1,7 +1,13 @@
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate, today, date_diff, add_days
-from hrms.hr import utils as hrms_utils
+from frappe.utils import cint, flt, getdate, today, date_diff, add_days
+from frappe.query_builder import Order
+from frappe.query_builder.functions import Count
+
+from portal_rrhh.api.attachments import add_attachments, get_attachments
+from portal_rrhh.api.employee import parse_cursor
+from portal_rrhh.api.holidays import get_employee_holiday_list, get_holiday_calendar
+from portal_rrhh.api.team import get_team_membership
 
 @frappe.whitelist()
 def get_dashboard_data(employee=None):
@@ -70,7 +76,7 @@ def get_dashboard_data(employee=None):
     
     # Check if user is an approver
     # We check if this user is set as leave_approver for anyone active
-    team_members_count = frappe.db.count("Employee", {"leave_approver": frappe.session.user, "status": "Active"})
+    team_members_count = len(get_team_membership().leave_approver_of)
     dashboard["is_approver"] = team_members_count > 0
     dashboard["team_members_count"] = team_members_count
     
@@ -89,9 +95,10 @@ def get_dashboard_data(employee=None):
     return dashboard
 
 @frappe.whitelist()
-def get_my_leaves(employee=None):
+def get_my_leaves(employee=None, with_attachments=1):
     """
     Get all leave applications for the employee
+    with_attachments: If 0, attachments are not included (load them with get_leave_attachments)
     """
     if not employee:
         employee = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
@@ -106,123 +113,131 @@ def get_my_leaves(employee=None):
         order_by="modified desc"
     )
     
-    # Fetch attachments (múltiples por solicitud)
-    if leaves:
-        leave_names = [l.name for l in leaves]
-        files = frappe.get_all("File", filters={
-            "attached_to_doctype": "Spanish Leave Application",
-            "attached_to_name": ["in", leave_names]
-        }, fields=["name", "file_url", "file_name", "attached_to_name"])
-        
-        # Agrupar archivos por solicitud
-        file_map = {}
-        for f in files:
-            if f.attached_to_name not in file_map:
-                file_map[f.attached_to_name] = []
-            file_map[f.attached_to_name].append({
-                "name": f.name,
-                "file_url": f.file_url,
-                "file_name": f.file_name
-            })
-        
-        for l in leaves:
-            l["attachments"] = file_map.get(l.name, [])
-            # Mantener compatibilidad con código anterior
-            l["attachment"] = l["attachments"][0]["file_url"] if l["attachments"] else None
+    # Adjuntos (múltiples por solicitud); con with_attachments=0 se piden aparte
+    # con get_leave_attachments
+    if cint(with_attachments):
+        add_attachments(leaves, "Spanish Leave Application")
 
     return leaves
 
+TEAM_REQUESTS_PAGE_LENGTH = 50
+HISTORY_STATUSES = ["Aprobada", "Rechazada", "Cancelada"]
+TEAM_REQUEST_FIELDS = [
+    "name", "employee", "employee_name", "leave_type", "status", "from_date", "to_date", "total_days",
+    "request_type", "total_hours", "description", "request_date", "creation", "modified"
+]
+
 @frappe.whitelist()
-def get_team_requests(status=None, employee=None, leave_type=None, location=None, only_my_team=None):
+def get_team_requests(status=None, employee=None, leave_type=None, location=None, only_my_team=None, with_attachments=1,
+                      limit=None, cursor=None, count="exact"):
     """
-    Get requests for employees reporting to the current user.
+    Get requests for employees reporting to the current user, newest first.
     status: 'Abierta' (Pending), 'History' (Approved/Rejected/Cancelled), or None (All)
     employee: Filter by specific employee
     leave_type: Filter by specific leave type
     location: Filter by employee's custom_centro (Room)
     only_my_team: If True and user has "Validar HC" role, filter by leave_approver = current user
+    with_attachments: If 0, attachments are not included (load them with get_leave_attachments)
+    limit: Page size (0 for every request)
+    cursor: [creation, name] of the last request of the previous page
+    count: 'exact' (default) or 'none' to skip the total (e.g. when loading the next pages)
+
+    Returns {data, total, has_more, next_cursor} when limit or cursor is given.
+    Without them it returns the plain list of every request, as older clients
+    (the previously built SpanishLeave bundle) expect.
     """
-    filters = {}
-    
+    paged = limit is not None or bool(cursor)
+    if not paged:
+        count = "none"
+    elif limit is None:
+        limit = TEAM_REQUESTS_PAGE_LENGTH
+
+    Leave = frappe.qb.DocType("Spanish Leave Application")
+    query = frappe.qb.from_(Leave)
+
     # Permission Filter
     roles = frappe.get_roles(frappe.session.user)
     if frappe.session.user != "Administrator":
         if "Responsable Departamento" in roles:
-            filters["leave_approver"] = frappe.session.user
+            query = query.where(Leave.leave_approver == frappe.session.user)
         elif "Validador HR" not in roles and "Validar HC" not in roles:
-            filters["leave_approver"] = frappe.session.user
+            query = query.where(Leave.leave_approver == frappe.session.user)
         elif "Validar HC" in roles and only_my_team:
             # Si tiene rol "Validar HC" y activó el filtro "Solo mi equipo", filtrar por leave_approver
-            filters["leave_approver"] = frappe.session.user
+            query = query.where(Leave.leave_approver == frappe.session.user)
 
     # Status Filter
     if status == 'Abierta' or status == 'Pending':
-        filters["status"] = "Abierta"
+        query = query.where(Leave.status == "Abierta")
     elif status == 'History':
-        filters["status"] = ["in", ["Aprobada", "Rechazada", "Cancelada"]]
+        query = query.where(Leave.status.isin(HISTORY_STATUSES))
     elif status:
-        filters["status"] = status
+        query = query.where(Leave.status == status)
     
     # Employee Filter
     if employee:
-        filters["employee"] = employee
+        query = query.where(Leave.employee == employee)
         
     # Leave Type Filter
     if leave_type:
-        filters["leave_type"] = leave_type
+        query = query.where(Leave.leave_type == leave_type)
 
-    # Location Filter (via Employee)
+    # Location Filter (join with Employee instead of loading the employees of the room)
     if location:
-        # Fetch employees in this location
-        employees_in_location = frappe.get_all("Employee", filters={"custom_centro": location}, pluck="name")
-        if not employees_in_location:
-            return [] # No employees in this location
-        
-        # Merge with existing employee filter if present
-        if filters.get("employee"):
-            if filters["employee"] not in employees_in_location:
-                return []
-        else:
-             filters["employee"] = ["in", employees_in_location]
-
-    requests = frappe.get_all(
-        "Spanish Leave Application",
-        filters=filters,
-        fields=["name", "employee", "employee_name", "leave_type", "status", "from_date", "to_date", "total_days", "request_type", "total_hours", "description", "request_date", "creation", "modified"],
-        order_by="creation desc"
+        Employee = frappe.qb.DocType("Employee")
+        query = query.inner_join(Employee).on(Employee.name == Leave.employee).where(Employee.custom_centro == location)
+
+    total = None
+    if count != "none":
+        total = query.select(Count(Leave.name)).run()[0][0]
+
+    # Keyset: solicitudes anteriores a (creation, name) del cursor
+    cursor = parse_cursor(cursor)
+    if cursor:
+        last_creation, last_name = cursor
+        query = query.where(
+            (Leave.creation < last_creation)
+            | ((Leave.creation == last_creation) & (Leave.name < last_name))
+        )
+
+    query = (
+        query.select(*[Leave[f] for f in TEAM_REQUEST_FIELDS])
+        .orderby(Leave.creation, order=Order.desc)
+        .orderby(Leave.name, order=Order.desc)
     )
+    limit = cint(limit)
+    if limit:
+        # Una fila extra para saber si hay más páginas
+        query = query.limit(limit + 1)
 
-    # Fetch attachments (múltiples por solicitud)
-    if requests:
-        request_names = [r.name for r in requests]
-        files = frappe.get_all("File", filters={
-            "attached_to_doctype": "Spanish Leave Application",
-            "attached_to_name": ["in", request_names]
-        }, fields=["name", "file_url", "file_name", "attached_to_name"])
-        
-        # Agrupar archivos por solicitud
-        file_map = {}
-        for f in files:
-            if f.attached_to_name not in file_map:
-                file_map[f.attached_to_name] = []
-            file_map[f.attached_to_name].append({
-                "name": f.name,
-                "file_url": f.file_url,
-                "file_name": f.file_name
-            })
-        
-        for r in requests:
-            r["attachments"] = file_map.get(r.name, [])
-            # Mantener compatibilidad con código anterior
-            r["attachment"] = r["attachments"][0]["file_url"] if r["attachments"] else None
+    requests = query.run(as_dict=True)
+
+    has_more = bool(limit) and len(requests) > limit
+    if has_more:
+        requests = requests[:limit]
+    next_cursor = [str(requests[-1].creation), requests[-1].name] if has_more else None
 
-    return requests
+    # Adjuntos (múltiples por solicitud); con with_attachments=0 se piden aparte
+    # con get_leave_attachments
+    if cint(with_attachments):
+        add_attachments(requests, "Spanish Leave Application")
+
+    if not paged:
+        return requests
+
+    return {
+        "data": requests,
+        "total": total,
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }
 
 @frappe.whitelist()
-def get_team_leaves(month_start=None, month_end=None, employee=None, leave_type=None, location=None):
+def get_team_leaves(month_start=None, month_end=None, employee=None, leave_type=None, location=None, with_attachments=1):
     """
     Get approved and pending leaves for the team calendar/gantt
     Includes both 'Aprobada' and 'Abierta' (pending) requests for planning
+    with_attachments: If 0, attachments are not included (load them with get_leave_attachments)
     """
     filters = {
         "status": ["in", ["Aprobada", "Abierta"]], 
@@ -263,29 +278,10 @@ def get_team_leaves(month_start=None, month_end=None, employee=None, leave_type=
         order_by="from_date asc"
     )
 
-    # Fetch attachments (múltiples por solicitud)
-    if leaves:
-        leave_names = [l.name for l in leaves]
-        files = frappe.get_all("File", filters={
-            "attached_to_doctype": "Spanish Leave Application",
-            "attached_to_name": ["in", leave_names]
-        }, fields=["name", "file_url", "file_name", "attached_to_name"])
-        
-        # Agrupar archivos por solicitud
-        file_map = {}
-        for f in files:
-            if f.attached_to_name not in file_map:
-                file_map[f.attached_to_name] = []
-            file_map[f.attached_to_name].append({
-                "name": f.name,
-                "file_url": f.file_url,
-                "file_name": f.file_name
-            })
-        
-        for l in leaves:
-            l["attachments"] = file_map.get(l.name, [])
-            # Mantener compatibilidad con código anterior
-            l["attachment"] = l["attachments"][0]["file_url"] if l["attachments"] else None
+    # Adjuntos (múltiples por solicitud); con with_attachments=0 se piden aparte
+    # con get_leave_attachments
+    if cint(with_attachments):
+        add_attachments(leaves, "Spanish Leave Application")
 
     return leaves
 
@@ -414,25 +410,19 @@ def get_leave_form_context(employee=None):
     )
     
     # 3. Holidays
-    # Get holiday list name for display
-    holiday_list_name = frappe.db.get_value("Employee", employee, "holiday_list")
+    # Employee holiday list, or the company default if the employee has none
+    holiday_list_name = get_employee_holiday_list(employee)
     
     holidays = []
-    if not holiday_list_name:
-         # Try to get default company holiday list if employee has none
-         company = frappe.db.get_value("Employee", employee, "company")
-         if company:
-             holiday_list_name = frappe.db.get_value("Company", company, "default_holiday_list")
-    
     if holiday_list_name:
-        # Fetch holidays for huge range to be safe (current year and next)
+        # Current year and next, from the cached holiday calendar
         start_year = getdate(today_date).year
-        end_date = f"{start_year + 1}-12-31"
-        start_date = f"{start_year}-01-01"
+        start_date = getdate(f"{start_year}-01-01")
+        end_date = getdate(f"{start_year + 1}-12-31")
         
-        holidays_list = hrms_utils.get_holidays_for_employee(employee, start_date, end_date)
+        calendar = get_holiday_calendar([holiday_list_name], start_date, end_date)
         # convert dates to strings
-        holidays = [str(h.get("holiday_date")) for h in holidays_list]
+        holidays = [str(d) for d in calendar.dates(holiday_list_name, start_date, end_date)]
 
     # Get Rooms (Centers) for filters
     rooms = frappe.get_all("Room", fields=["name", "room_name"], order_by="room_name asc")
@@ -454,6 +444,7 @@ def calculate_effective_days(from_date, to_date):
     if not employee:
         return 0
         
+    # Same rule the Spanish Leave Application uses on save, so the preview matches the saved total_days
     from spanish_leave.spanish_leave.doctype.spanish_leave_application.spanish_leave_application import count_working_days_excluding_holidays
     
     days = count_working_days_excluding_holidays(
@@ -478,10 +469,11 @@ def get_my_team_members():
 
     roles = frappe.get_roles(frappe.session.user)
     if frappe.session.user != "Administrator":
-        if "Responsable Departamento" in roles:
-            filters["leave_approver"] = frappe.session.user
-        elif "Validador HR" not in roles and "Validar HC" not in roles:
-            filters["leave_approver"] = frappe.session.user
+        if "Responsable Departamento" in roles or ("Validador HR" not in roles and "Validar HC" not in roles):
+            team = get_team_membership().leave_approver_of
+            if not team:
+                return []
+            filters["name"] = ["in", team]
 
     employees = frappe.get_all("Employee", 
         filters=filters,
@@ -490,6 +482,39 @@ def get_my_team_members():
     )
     return employees
 
+@frappe.whitelist()
+def get_leave_attachments(names):
+    """
+    Attachments of several leave applications, for listings loaded with with_attachments=0.
+    names: list (or JSON list) of Spanish Leave Application names
+    Returns {name: [{name, file_url, file_name}]} for the requests the user can see
+    in the listings (own requests, requests they approve, or any for HR validators).
+    """
+    import json
+    if isinstance(names, str):
+        names = json.loads(names)
+
+    user = frappe.session.user
+    roles = frappe.get_roles(user)
+    sees_all = user == "Administrator" or (
+        "Responsable Departamento" not in roles
+        and ("Validador HR" in roles or "Validar HC" in roles)
+    )
+
+    if not sees_all and names:
+        employee = frappe.db.get_value("Employee", {"user_id": user}, "name")
+        or_filters = {"leave_approver": user}
+        if employee:
+            or_filters["employee"] = employee
+        names = frappe.get_all(
+            "Spanish Leave Application",
+            filters={"name": ["in", names]},
+            or_filters=or_filters,
+            pluck="name"
+        )
+
+    return get_attachments("Spanish Leave Application", names)
+
 @frappe.whitelist()
 def delete_attachment(file_name, docname):
     """
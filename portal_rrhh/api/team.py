@@ -0,0 +1,181 @@
+"""
+Per-user team membership resolver.
+
+A user's team (their own employee, direct reports, employees where they are
+leave approver, departments where they are approver and the employees in
+them) is cached in Redis per user. Employee and Department doc events clear
+the cache, so every module resolves "who does this user manage" the same way
+without re-running the membership queries on each call.
+"""
+
+import frappe
+
+
+TEAM_CACHE_PREFIX = "portal_rrhh:team_membership:"
+TEAM_CACHE_TTL = 6 * 3600
+ACTIVE_EMPLOYEES_KEY = TEAM_CACHE_PREFIX + "__active__"
+
+HR_ROLES = ("HR Manager", "HR User")
+DEPT_MANAGER_ROLES = ("Responsable de Departamento", "Responsable Departamento")
+APPROVER_PARENTFIELDS = ["leave_approvers", "expense_approvers", "shift_request_approver"]
+
+# Employee fields that change somebody's team membership
+EMPLOYEE_TEAM_FIELDS = ("status", "user_id", "leave_approver", "reports_to", "department")
+
+
+def is_hr_user(roles):
+    return any(r in roles for r in HR_ROLES)
+
+
+def is_dept_manager(roles):
+    return any(r in roles for r in DEPT_MANAGER_ROLES)
+
+
+def get_team_membership(user=None):
+    """
+    Cached team membership of a user:
+    employee, departments, leave_approver_of, direct_reports, department_employees.
+    Employee lists only contain active employees.
+    """
+    if not user:
+        user = frappe.session.user
+
+    key = TEAM_CACHE_PREFIX + user
+    membership = frappe.cache().get_value(key)
+    if membership is None:
+        membership = _load_team_membership(user)
+        frappe.cache().set_value(key, membership, expires_in_sec=TEAM_CACHE_TTL)
+
+    return frappe._dict(membership)
+
+
+def _load_team_membership(user):
+    employee = frappe.db.get_value("Employee", {"user_id": user}, "name")
+
+    departments = list(dict.fromkeys(frappe.get_all(
+        "Department Approver",
+        filters={"approver": user, "parentfield": ["in", APPROVER_PARENTFIELDS]},
+        pluck="parent"
+    )))
+
+    # Single query for every active employee related to the user
+    or_filters = {"leave_approver": user}
+    if employee:
+        or_filters["reports_to"] = employee
+    if departments:
+        or_filters["department"] = ["in", departments]
+
+    rows = frappe.get_all(
+        "Employee",
+        filters={"status": "Active"},
+        or_filters=or_filters,
+        fields=["name", "leave_approver", "reports_to", "department"]
+    )
+    department_set = set(departments)
+
+    return {
+        "employee": employee,
+        "departments": departments,
+        "leave_approver_of": [r.name for r in rows if r.leave_approver == user],
+        "direct_reports": [r.name for r in rows if employee and r.reports_to == employee],
+        "department_employees": [r.name for r in rows if r.department in department_set],
+    }
+
+
+def get_active_employees():
+    """All active employee IDs (cached alongside team memberships)."""
+    employees = frappe.cache().get_value(ACTIVE_EMPLOYEES_KEY)
+    if employees is None:
+        employees = frappe.get_all("Employee", filters={"status": "Active"}, pluck="name")
+        frappe.cache().set_value(ACTIVE_EMPLOYEES_KEY, employees, expires_in_sec=TEAM_CACHE_TTL)
+    return list(employees)
+
+
+def get_managed_employees(user=None):
+    """
+    Get employees that the current user manages (as department head).
+    Returns a list of employee IDs that this user can manage.
+    """
+    if not user:
+        user = frappe.session.user
+
+    if user == "Administrator":
+        # Admin sees all active employees
+        return get_active_employees()
+
+    roles = frappe.get_roles(user)
+    if is_hr_user(roles):
+        # HR managers can see all employees
+        return get_active_employees()
+
+    team = get_team_membership(user)
+    allowed_employees = set(team.leave_approver_of) | set(team.direct_reports)
+    if is_dept_manager(roles):
+        allowed_employees.update(team.department_employees)
+
+    return list(allowed_employees)
+
+
+def clear_team_cache(doc=None, method=None):
+    """
+    Drop the cached team memberships affected by an Employee or Department
+    change (doc_events handler); every membership when called without a doc.
+    """
+    if doc is None:
+        frappe.cache().delete_keys(TEAM_CACHE_PREFIX)
+        return
+
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if doc.doctype == "Employee":
+        if before and not any(doc.has_value_changed(f) for f in EMPLOYEE_TEAM_FIELDS):
+            return
+        users = _employee_team_users([d for d in (doc, before) if d])
+        if not before or doc.has_value_changed("status"):
+            frappe.cache().delete_value(ACTIVE_EMPLOYEES_KEY)
+    else:
+        users = _department_approvers([d for d in (doc, before) if d])
+
+    if users:
+        frappe.cache().delete_value([TEAM_CACHE_PREFIX + user for user in users])
+
+
+def _employee_team_users(employees):
+    """
+    Users whose membership includes these Employee versions: the employee's
+    own user, its leave approver, the user of its reports_to manager and the
+    approvers of its department.
+    """
+    users = set()
+    managers = set()
+    departments = set()
+    for emp in employees:
+        users.update(u for u in (emp.user_id, emp.leave_approver) if u)
+        if emp.reports_to:
+            managers.add(emp.reports_to)
+        if emp.department:
+            departments.add(emp.department)
+
+    if managers:
+        users.update(u for u in frappe.get_all(
+            "Employee", filters={"name": ["in", list(managers)]}, pluck="user_id"
+        ) if u)
+
+    if departments:
+        users.update(frappe.get_all(
+            "Department Approver",
+            filters={"parent": ["in", list(departments)], "parentfield": ["in", APPROVER_PARENTFIELDS]},
+            pluck="approver"
+        ))
+
+    return users
+
+
+def _department_approvers(departments):
+    """Approver users of these Department versions (current and before save)."""
+    return {
+        row.approver
+        for dept in departments
+        for parentfield in APPROVER_PARENTFIELDS
+        for row in dept.get(parentfield) or []
+        if row.approver
+    }
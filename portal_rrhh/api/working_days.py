@@ -0,0 +1,109 @@
+"""
+Working-day arithmetic.
+
+A day is a working day for an employee when its weekday is in the weekday
+mask of the employee's holiday list and it is not a holiday. The mask is
+every weekday not used as a weekly off in the list for that year, or
+Monday to Friday when the list has no weekly offs. Callers that classify
+weekends the way the attendance reports always have (Saturday and Sunday)
+pass weekdays=DEFAULT_WORKING_WEEKDAYS to use a fixed mask instead; with a
+Sunday-only list the derived mask would make Saturdays working days.
+
+WorkingDays builds, per year, a prefix sum of working days over the cached
+holiday bitsets (holidays.get_holiday_calendar), so "working days between
+A and B" is a subtraction per year spanned. Leave coverage lives in
+leave_index.LeaveIndex.
+"""
+
+from array import array
+from datetime import date
+
+from frappe.utils import getdate
+
+from portal_rrhh.api.holidays import day_of_year, get_employee_holiday_list, get_holiday_calendar
+
+
+ALL_WEEKDAYS = 0b1111111
+# Bit n = date.weekday() n (Monday = 0)
+DEFAULT_WORKING_WEEKDAYS = 0b0011111
+
+
+def days_in_year(year):
+    return date(year + 1, 1, 1).toordinal() - date(year, 1, 1).toordinal()
+
+
+class WorkingDays:
+    """Working days of one holiday list, with per-year prefix sums."""
+
+    def __init__(self, holiday_calendar, holiday_list, weekdays=None):
+        self.calendar = holiday_calendar
+        self.holiday_list = holiday_list
+        # Fixed working weekdays mask; None derives it from the list's weekly offs
+        self.weekdays = weekdays
+        self._years = {}
+
+    def weekday_mask(self, year):
+        """Working weekdays of the list in the year (bit n = weekday n)."""
+        return self._year(year)[0]
+
+    def _year(self, year):
+        cached = self._years.get(year)
+        if cached:
+            return cached
+
+        holidays, offs = self.calendar.years.get((self.holiday_list, year), (0, 0))
+        jan1 = date(year, 1, 1)
+        first_weekday = jan1.weekday()
+
+        off_weekdays = 0
+        bits = offs
+        while bits:
+            low = bits & -bits
+            off_weekdays |= 1 << (first_weekday + low.bit_length() - 1) % 7
+            bits ^= low
+        if self.weekdays is not None:
+            mask = self.weekdays
+        else:
+            mask = ALL_WEEKDAYS & ~off_weekdays if off_weekdays else DEFAULT_WORKING_WEEKDAYS
+
+        # prefix[i]: working days among the first i days of the year
+        n = days_in_year(year)
+        prefix = array("H", [0]) * (n + 1)
+        count = 0
+        for i in range(n):
+            if mask >> (first_weekday + i) % 7 & 1 and not holidays >> i & 1:
+                count += 1
+            prefix[i + 1] = count
+
+        cached = self._years[year] = (mask, prefix)
+        return cached
+
+    def is_working_day(self, d):
+        prefix = self._year(d.year)[1]
+        i = day_of_year(d)
+        return prefix[i + 1] != prefix[i]
+
+    def count(self, start_date, end_date):
+        """Working days between start_date and end_date, both included."""
+        if end_date < start_date:
+            return 0
+
+        total = 0
+        for year in range(start_date.year, end_date.year + 1):
+            prefix = self._year(year)[1]
+            first = day_of_year(start_date) if year == start_date.year else 0
+            last = day_of_year(end_date) if year == end_date.year else len(prefix) - 2
+            total += prefix[last + 1] - prefix[first]
+        return total
+
+
+def get_working_days(holiday_list, start_date, end_date):
+    """WorkingDays of a holiday list with the holidays of the range loaded."""
+    return WorkingDays(get_holiday_calendar([holiday_list], start_date, end_date), holiday_list)
+
+
+def count_working_days(employee, from_date, to_date):
+    """Working days of the employee between from_date and to_date, both included."""
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    holiday_list = get_employee_holiday_list(employee)
+    return get_working_days(holiday_list, from_date, to_date).count(from_date, to_date)
@@ -0,0 +1,68 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-attendance-summary")
+@click.option("--employee", help="Only rebuild this employee")
+@click.option("--from-date", help="First date to rebuild (YYYY-MM-DD)")
+@click.option("--to-date", help="Last date to rebuild (YYYY-MM-DD)")
+@pass_context
+def rebuild_attendance_summary(context, employee=None, from_date=None, to_date=None):
+    """Rebuild the Daily Attendance Summary table from Employee Checkin."""
+    import frappe
+    from portal_rrhh.api.attendance_summary import rebuild_summaries
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rows = rebuild_summaries(
+            [employee] if employee else None,
+            from_date=from_date,
+            to_date=to_date
+        )
+        frappe.db.commit()
+        click.echo(f"Daily Attendance Summary: {rows} rows rebuilt")
+    finally:
+        frappe.destroy()
+
+
+@click.command("rebuild-contract-status")
+@click.option("--employee", help="Only rebuild this employee")
+@pass_context
+def rebuild_contract_status(context, employee=None):
+    """Rebuild the Employee Contract Status index from Job Offer and Modificaciones RRHH."""
+    import frappe
+    from portal_rrhh.api.contract_status import rebuild_contract_status as rebuild
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rows = rebuild([employee] if employee else None)
+        frappe.db.commit()
+        click.echo(f"Employee Contract Status: {rows} rows rebuilt")
+    finally:
+        frappe.destroy()
+
+
+@click.command("rebuild-competency-gaps")
+@click.option("--cycle", help="Only rebuild this appraisal cycle")
+@pass_context
+def rebuild_competency_gaps(context, cycle=None):
+    """Rebuild the Competency Gap Summary from the completed appraisals."""
+    import frappe
+    from portal_rrhh.api.competency_gaps import rebuild_competency_gaps as rebuild
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rows = rebuild([cycle] if cycle else None)
+        frappe.db.commit()
+        click.echo(f"Competency Gap Summary: {rows} rows rebuilt")
+    finally:
+        frappe.destroy()
+
+
+commands = [rebuild_attendance_summary, rebuild_contract_status, rebuild_competency_gaps]
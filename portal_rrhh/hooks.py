@@ -140,9 +140,126 @@ website_route_rules = [
 
 doc_events = {
     "Job Offer": {
-        "on_update": "portal_rrhh.api.onboarding.create_onboarding_process_if_needed",
-        "on_submit": "portal_rrhh.api.onboarding.create_onboarding_process_if_needed",
-        "on_update_after_submit": "portal_rrhh.api.onboarding.create_onboarding_process_if_needed"
+        "on_update": [
+            "portal_rrhh.api.onboarding.create_onboarding_process_if_needed",
+            "portal_rrhh.api.contract_status.on_job_offer_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_submit": [
+            "portal_rrhh.api.onboarding.create_onboarding_process_if_needed",
+            "portal_rrhh.api.contract_status.on_job_offer_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_update_after_submit": [
+            "portal_rrhh.api.onboarding.create_onboarding_process_if_needed",
+            "portal_rrhh.api.contract_status.on_job_offer_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_cancel": [
+            "portal_rrhh.api.contract_status.on_job_offer_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_trash": [
+            "portal_rrhh.api.contract_status.on_job_offer_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ]
+    },
+    "Modificaciones RRHH": {
+        "on_update": [
+            "portal_rrhh.api.contract_status.on_modificacion_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_submit": [
+            "portal_rrhh.api.contract_status.on_modificacion_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_update_after_submit": [
+            "portal_rrhh.api.contract_status.on_modificacion_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_cancel": [
+            "portal_rrhh.api.contract_status.on_modificacion_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_trash": [
+            "portal_rrhh.api.contract_status.on_modificacion_change",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ]
+    },
+    "Employee Checkin": {
+        "on_update": [
+            "portal_rrhh.api.attendance_summary.on_checkin_change",
+            "portal_rrhh.api.department.clear_dashboard_cache"
+        ],
+        "on_trash": [
+            "portal_rrhh.api.attendance_summary.on_checkin_change",
+            "portal_rrhh.api.department.clear_dashboard_cache"
+        ]
+    },
+    "Spanish Leave Application": {
+        "after_insert": "portal_rrhh.api.department.clear_dashboard_cache",
+        "on_update": "portal_rrhh.api.department.clear_dashboard_cache",
+        "on_trash": "portal_rrhh.api.department.clear_dashboard_cache"
+    },
+    "Employee": {
+        "after_insert": [
+            "portal_rrhh.api.team.clear_team_cache",
+            "portal_rrhh.api.contract_status.on_employee_change",
+            "portal_rrhh.api.employee_search.invalidate_search_index",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_update": [
+            "portal_rrhh.api.team.clear_team_cache",
+            "portal_rrhh.api.contract_status.on_employee_change",
+            "portal_rrhh.api.employee_search.invalidate_search_index",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "on_trash": [
+            "portal_rrhh.api.team.clear_team_cache",
+            "portal_rrhh.api.contract_status.on_employee_change",
+            "portal_rrhh.api.employee_search.invalidate_search_index",
+            "portal_rrhh.portal_rrhh.employee_data.clear_rrhh_inconsistencies"
+        ],
+        "after_rename": "portal_rrhh.api.employee_search.invalidate_search_index"
+    },
+    "Competency": {
+        "on_update": "portal_rrhh.api.evaluaciones.clear_competency_cache",
+        "on_trash": "portal_rrhh.api.evaluaciones.clear_competency_cache"
+    },
+    "Competency Appraisal": {
+        "after_insert": "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache",
+        # on_update also runs on submit
+        "on_update": [
+            "portal_rrhh.api.competency_gaps.on_appraisal_change",
+            "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache"
+        ],
+        "on_submit": "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache",
+        "on_cancel": [
+            "portal_rrhh.api.competency_gaps.on_appraisal_change",
+            "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache"
+        ],
+        "on_update_after_submit": [
+            "portal_rrhh.api.competency_gaps.on_appraisal_change",
+            "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache"
+        ],
+        "on_trash": [
+            "portal_rrhh.api.competency_gaps.on_appraisal_change",
+            "portal_rrhh.api.evaluaciones.clear_appraisal_statistics_cache"
+        ]
+    },
+    "Holiday List": {
+        "on_update": "portal_rrhh.api.holidays.clear_holiday_cache",
+        "on_trash": "portal_rrhh.api.holidays.clear_holiday_cache"
+    },
+    "File": {
+        "after_insert": "portal_rrhh.api.attachments.clear_attachment_cache",
+        "on_update": "portal_rrhh.api.attachments.clear_attachment_cache",
+        "on_trash": "portal_rrhh.api.attachments.clear_attachment_cache"
+    },
+    # Department Approver is a child table: its changes fire the Department events
+    "Department": {
+        "on_update": "portal_rrhh.api.team.clear_team_cache",
+        "on_trash": "portal_rrhh.api.team.clear_team_cache"
     }
 }
 
@@ -167,6 +284,12 @@ doc_events = {
 # 	],
 # }
 
+scheduler_events = {
+    "hourly": [
+        "portal_rrhh.portal_rrhh.employee_data.refresh_rrhh_inconsistencies"
+    ]
+}
+
 # Testing
 # -------
 
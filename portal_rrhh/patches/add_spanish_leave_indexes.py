@@ -0,0 +1,20 @@
+import frappe
+
+
+def execute():
+    """Composite indexes for the team request listings of Spanish Leave Application."""
+    if not frappe.db.table_exists("Spanish Leave Application"):
+        return
+
+    # Approver views: leave_approver + status, newest first
+    frappe.db.add_index(
+        "Spanish Leave Application",
+        ["leave_approver", "status", "creation"],
+        index_name="leave_approver_status_creation_index"
+    )
+    # Employee filter and per-employee lookups by status
+    frappe.db.add_index(
+        "Spanish Leave Application",
+        ["employee", "status"],
+        index_name="employee_status_index"
+    )
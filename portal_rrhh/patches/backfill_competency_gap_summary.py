@@ -0,0 +1,17 @@
+import frappe
+
+
+def execute():
+    """
+    Backfill Competency Gap Summary from the existing appraisals.
+
+    The gap analysis keeps computing from the appraisals until the rebuild job
+    finishes and sets competency_gaps.GAP_SUMMARY_READY_KEY.
+    """
+    frappe.enqueue(
+        "portal_rrhh.api.competency_gaps.rebuild_competency_gaps",
+        queue="long",
+        timeout=3600,
+        job_id="rebuild_competency_gap_summary",
+        deduplicate=True
+    )
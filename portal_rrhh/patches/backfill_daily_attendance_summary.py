@@ -0,0 +1,17 @@
+import frappe
+
+
+def execute():
+    """
+    Backfill Daily Attendance Summary from the existing Employee Checkin history.
+
+    The reports keep computing from raw checkins until the rebuild job finishes
+    and sets attendance_summary.SUMMARY_READY_KEY.
+    """
+    frappe.enqueue(
+        "portal_rrhh.api.attendance_summary.rebuild_summaries",
+        queue="long",
+        timeout=7200,
+        job_id="rebuild_daily_attendance_summary",
+        deduplicate=True
+    )
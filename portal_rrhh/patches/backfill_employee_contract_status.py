@@ -0,0 +1,17 @@
+import frappe
+
+
+def execute():
+    """
+    Backfill Employee Contract Status from the existing Job Offers.
+
+    The listings keep deriving the status from the Job Offers until the rebuild
+    job finishes and sets contract_status.CONTRACT_STATUS_READY_KEY.
+    """
+    frappe.enqueue(
+        "portal_rrhh.api.contract_status.rebuild_contract_status",
+        queue="long",
+        timeout=3600,
+        job_id="rebuild_employee_contract_status",
+        deduplicate=True
+    )
@@ -0,0 +1,8 @@
+# Copyright (c) 2026, Grupo ATU and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class EmployeeContractStatus(Document):
+	pass
@@ -1,12 +1,19 @@
 import frappe
 from frappe import _
-from frappe.utils import today, getdate
+from frappe.utils import today, getdate, now_datetime
+
+from portal_rrhh.api.employee import parse_cursor
+from portal_rrhh.api.employee_search import SEARCH_FIELDS, SEARCH_MATCH_LIMIT, search_employees
 
 @frappe.whitelist(allow_guest=False)
 @frappe.whitelist(allow_guest=False)
-def get_employees_list(filters=None, limit=20, offset=0, search_term=None):
+def get_employees_list(filters=None, limit=20, offset=0, search_term=None, cursor=None):
     """
     Get list of employees for the portal
+
+    cursor is the [employee_name, name] of the last row of the previous page
+    (keyset pagination, see next_cursor in the result). It is ignored when
+    searching: the matches are ranked by relevance and paged by offset.
     """
     try:
         # Default filters: no status restriction to allow active/inactive employees
@@ -19,33 +26,72 @@ def get_employees_list(filters=None, limit=20, offset=0, search_term=None):
                 filters = json.loads(filters)
             default_filters.update(filters)
 
-        # Build OR filters for search
+        # Search through the shared employee search index (name, DNI/NIE, emails, user...)
         or_filters = None
-        if search_term:
-            or_filters = {
-                "employee_name": ["like", f"%{search_term}%"],
-                "personal_email": ["like", f"%{search_term}%"],
-                "company_email": ["like", f"%{search_term}%"],
-                "custom_dninie": ["like", f"%{search_term}%"],
-                "attendance_device_id": ["like", f"%{search_term}%"],
-                "name": ["like", f"%{search_term}%"],
-                "user_id": ["like", f"%{search_term}%"],
-                "first_name": ["like", f"%{search_term}%"],
-                "last_name": ["like", f"%{search_term}%"]
-            }
+        search_order = None
+        if search_term and search_term.strip():
+            matches = search_employees(search_term)
+            if not matches:
+                return {"employees": [], "total_count": 0, "has_more": False, "next_cursor": None}
+            if len(matches) < SEARCH_MATCH_LIMIT:
+                default_filters["name"] = ["in", matches]
+                search_order = {name: i for i, name in enumerate(matches)}
+            else:
+                # Too broad for a ranked IN list: plain LIKE filter ordered by name
+                or_filters = {field: ["like", f"%{search_term.strip()}%"] for field in SEARCH_FIELDS}
 
         # Determine page_length
         # limit=0 means no limit (fetch all matching), similar to Frappe's link search
         limit_val = int(limit) if limit is not None else 20
         page_length = limit_val if limit_val > 0 else None
-        start = int(offset) if offset else 0
+        cursor = parse_cursor(cursor) if not search_order else None
+        start = int(offset) if offset and not cursor else 0
+
+        page_filters = [
+            [field, *value] if isinstance(value, (list, tuple)) else [field, "=", value]
+            for field, value in default_filters.items()
+        ]
+
+        # Total count for pagination, with the same permissions as the page
+        # (get_list without ignore_permissions)
+        total_employees = frappe.get_list(
+            "Employee",
+            filters=page_filters,
+            or_filters=or_filters,
+            fields=["name"],
+            limit_page_length=None
+        )
+        total_count = len(total_employees)
+
+        next_cursor = None
+        if search_order:
+            # Rank every readable match (at most SEARCH_MATCH_LIMIT) before paging,
+            # so each page holds the next best matches
+            ranked = sorted((e.name for e in total_employees), key=search_order.get)
+            page_names = ranked[start:start + page_length] if page_length else ranked[start:]
+            has_more = bool(page_length) and start + len(page_names) < total_count
+            page_filters = [["name", "in", page_names or [""]]]
+            list_kwargs = {"limit_page_length": None}
+        else:
+            if cursor:
+                # Keyset: rows after the cursor's (employee_name, name)
+                last_name, last_id = (frappe.db.escape(v) for v in cursor)
+                page_filters.append(
+                    f"(`tabEmployee`.employee_name > {last_name} OR "
+                    f"(`tabEmployee`.employee_name = {last_name} AND `tabEmployee`.name > {last_id}))"
+                )
+            # One extra row tells whether there is a next page
+            list_kwargs = {
+                "limit_page_length": page_length + 1 if page_length else None,
+                "limit_start": start
+            }
 
         # Fetch employees using standard frappe.get_list which handles permissions
         # We do NOT use ignore_permissions=True here.
         employees = frappe.get_list(
             "Employee",
-            filters=default_filters,
-            or_filters=or_filters,
+            filters=page_filters,
+            or_filters=None if search_order else or_filters,
             fields=[
                 "name",
                 "employee_name",
@@ -63,36 +109,18 @@ def get_employees_list(filters=None, limit=20, offset=0, search_term=None):
                 "attendance_device_id",
                 "user_id"
             ],
-            limit_page_length=page_length,
-            limit_start=start,
-            order_by="employee_name asc"
+            order_by="employee_name asc, name asc",
+            **list_kwargs
         )
 
-        # Total count for pagination
-        # We also respect permissions here by not using ignore_permissions
-        # However, get_count usually ignores permissions by default or is efficient?
-        # frappe.db.count doesn't respect permissions easily with complex filters.
-        # We use get_list with limit=None and count=True if available, or just len of unpaginated?
-        # For performance, usually get_all/get_list is used.
-        # Let's use a separate count query or if list is small... 
-        # But for pagination we need total.
-        # Replicating the previous logic but SAFE:
-        
-        # Ideally we want `frappe.db.count` but with permission filters. 
-        # Since we can't easily inject permission SQL into db.count, we might have to use get_list just for IDs if the dataset is smallish ( < 10k).
-        # OR we rely on "has_more" logic by fetching limit + 1.
-        
-        # Let's try to fetch total count using get_list with only 'name' field, unlimited?
-        # That might be heavy if there are 1000s of employees.
-        # Safe strict approach: 
-        total_employees = frappe.get_list(
-            "Employee",
-            filters=default_filters,
-            or_filters=or_filters,
-            fields=["name"],
-            limit_page_length=None
-        )
-        total_count = len(total_employees)
+        if search_order:
+            # Best matches first
+            employees.sort(key=lambda e: search_order[e.name])
+        else:
+            has_more = bool(page_length) and len(employees) > page_length
+            if has_more:
+                employees = employees[:page_length]
+                next_cursor = [employees[-1].employee_name, employees[-1].name]
 
         # Format the data
         for employee in employees:
@@ -119,7 +147,8 @@ def get_employees_list(filters=None, limit=20, offset=0, search_term=None):
         return {
             "employees": employees,
             "total_count": total_count,
-            "has_more": (start + len(employees)) < total_count
+            "has_more": has_more,
+            "next_cursor": next_cursor
         }
 
     except Exception as e:
@@ -144,15 +173,25 @@ def get_departments_list():
         frappe.log_error(f"Error getting departments: {str(e)}")
         frappe.throw(_("Error getting departments: {0}").format(str(e)))
 
+RRHH_SNAPSHOT_KEY = "portal_rrhh:rrhh_inconsistencies"
+
+
 @frappe.whitelist(allow_guest=False)
 def get_rrhh_dashboard_stats():
     """
     Get dashboard statistics for RRHH department
     Identifies problems, missing data, and inconsistencies
+    
+    Reads the snapshot built by refresh_rrhh_inconsistencies (hourly, and on the
+    first read after a relevant Employee / Job Offer / Modificaciones RRHH change)
+    and keeps only the documents the current user can read.
     """
     try:
-        today_date = today()
-        today_dt = getdate(today_date)
+        snapshot = frappe.cache().get_value(RRHH_SNAPSHOT_KEY)
+        if snapshot is None:
+            snapshot = refresh_rrhh_inconsistencies()
+        
+        today_dt = getdate(today())
         
         stats = {
             "employees_missing_data": [],
@@ -169,224 +208,256 @@ def get_rrhh_dashboard_stats():
         }
         
         # 1. Empleados sin datos personales importantes
-        employees = []
         if frappe.has_permission("Employee", "read"):
-            employees = frappe.get_list(
+            total = frappe.get_list(
                 "Employee",
                 filters={"status": "Active"},
-                fields=[
-                    "name",
-                    "employee_name",
-                    "custom_dninie",
-                    "cell_number",
-                    "personal_email",
-                    "company_email",
-                    "custom_no_seguridad_social",
-                    "department",
-                    "designation"
-                ]
+                fields=["count(name) as total"]
             )
-        
-        stats["summary"]["total_employees"] = len(employees)
-        
-        for emp in employees:
-            missing_fields = []
-            if not emp.get("custom_dninie"):
-                missing_fields.append("DNI/NIE")
-            if not emp.get("cell_number"):
-                missing_fields.append("Teléfono")
-            if not emp.get("personal_email") and not emp.get("company_email"):
-                missing_fields.append("Email")
-            if not emp.get("custom_no_seguridad_social"):
-                missing_fields.append("Número Seguridad Social")
+            stats["summary"]["total_employees"] = total[0].total if total else 0
             
-            if missing_fields:
-                stats["employees_missing_data"].append({
-                    "employee_name": emp.name,
-                    "employee_display_name": emp.employee_name or emp.name,
-                    "department": emp.department or "Sin departamento",
-                    "designation": emp.designation or "Sin cargo",
-                    "missing_fields": missing_fields,
-                    "missing_count": len(missing_fields)
-                })
-        
-        stats["summary"]["employees_missing_data_count"] = len(stats["employees_missing_data"])
+            allowed = get_readable_names("Employee", [e["employee_name"] for e in snapshot["employees_missing_data"]])
+            stats["employees_missing_data"] = [
+                e for e in snapshot["employees_missing_data"] if e["employee_name"] in allowed
+            ]
         
         # 2. Job Offers con fecha fin vencida pero workflow_state = "Alta"
-        # 2. Job Offers con fecha fin vencida pero workflow_state = "Alta"
-        job_offers = []
-        try:
-            if frappe.has_permission("Job Offer", "read"):
-                job_offers = frappe.get_list(
-                    "Job Offer",
-                    filters={
-                        "docstatus": 1,
-                        "workflow_state": "Alta"
-                    },
-                    fields=[
-                        "name",
-                        "applicant_name",
-                        "custom_dninie",
-                        "custom_fecha_fin",
-                        "workflow_state",
-                        "designation",
-                        "company"
-                    ]
-                )
-        except frappe.PermissionError:
-            job_offers = []
-        
-        for jo in job_offers:
-            if jo.get("custom_fecha_fin"):
-                fecha_fin = getdate(jo["custom_fecha_fin"])
-                if fecha_fin < today_dt:
-                    # Buscar empleado relacionado por DNI
-                    employee_name = None
-                    if jo.get("custom_dninie"):
-                        employee = frappe.db.get_value("Employee",
-                            {"custom_dninie": jo["custom_dninie"], "status": "Active"},
-                            "name"
-                        )
-                        if employee:
-                            employee_name = employee
-                    
-                    stats["job_offers_expired_active"].append({
-                        "job_offer_name": jo.name,
-                        "applicant_name": jo.applicant_name or "N/A",
-                        "employee_name": employee_name,
-                        "custom_dninie": jo.custom_dninie or "N/A",
-                        "fecha_fin": jo.custom_fecha_fin,
-                        "dias_vencido": (today_dt - fecha_fin).days,
-                        "designation": jo.designation or "N/A",
-                        "company": jo.company or "N/A"
-                    })
-        
-        stats["summary"]["job_offers_expired_active_count"] = len(stats["job_offers_expired_active"])
+        if frappe.has_permission("Job Offer", "read"):
+            allowed = get_readable_names("Job Offer", [jo["job_offer_name"] for jo in snapshot["job_offers_expired_active"]])
+            stats["job_offers_expired_active"] = [
+                dict(jo, dias_vencido=(today_dt - getdate(jo["fecha_fin"])).days)
+                for jo in snapshot["job_offers_expired_active"]
+                if jo["job_offer_name"] in allowed
+            ]
         
         # 3. Modificaciones RRHH con fecha fin vencida pero workflow_state = "Alta"
-        modificaciones = []
-        try:
-            if frappe.has_permission("Modificaciones RRHH", "read"):
-                modificaciones = frappe.get_list(
-                    "Modificaciones RRHH",
-                    filters={
-                        "docstatus": 1,
-                        "workflow_state": "Alta"
-                    },
-                    fields=[
-                        "name",
-                        "employee",
-                        "end_date",
-                        "workflow_state",
-                        "designation",
-                        "company",
-                        "tipo_actualizacion",
-                        "job_offer"
-                    ]
-                )
-        except frappe.PermissionError:
-            modificaciones = []
-        
-        for mod in modificaciones:
-            if mod.get("end_date"):
-                fecha_fin = getdate(mod["end_date"])
-                if fecha_fin < today_dt:
-                    employee_name = None
-                    employee_display_name = None
-                    if mod.get("employee"):
-                        employee_display_name = frappe.db.get_value("Employee",
-                            mod["employee"],
-                            "employee_name"
-                        )
-                        employee_name = mod["employee"]
-                    
-                    stats["modificaciones_expired_active"].append({
-                        "modificacion_name": mod.name,
-                        "employee_name": employee_name,
-                        "employee_display_name": employee_display_name or "N/A",
-                        "end_date": mod.end_date,
-                        "dias_vencido": (today_dt - fecha_fin).days,
-                        "designation": mod.designation or "N/A",
-                        "company": mod.company or "N/A",
-                        "tipo_actualizacion": mod.tipo_actualizacion or "N/A",
-                        "job_offer": mod.job_offer or "N/A"
-                    })
-        
-        stats["summary"]["modificaciones_expired_active_count"] = len(stats["modificaciones_expired_active"])
+        if frappe.has_permission("Modificaciones RRHH", "read"):
+            allowed = get_readable_names("Modificaciones RRHH", [m["modificacion_name"] for m in snapshot["modificaciones_expired_active"]])
+            stats["modificaciones_expired_active"] = [
+                dict(mod, dias_vencido=(today_dt - getdate(mod["end_date"])).days)
+                for mod in snapshot["modificaciones_expired_active"]
+                if mod["modificacion_name"] in allowed
+            ]
         
         # 4. Job Offers en "Baja" pero con Modificaciones RRHH relacionadas en "Alta"
-        # 4. Job Offers en "Baja" pero con Modificaciones RRHH relacionadas en "Alta"
-        job_offers_baja = []
-        try:
-            if frappe.has_permission("Job Offer", "read"):
-                job_offers_baja = frappe.get_list(
-                    "Job Offer",
-                    filters={
-                        "docstatus": 1,
-                        "workflow_state": "Baja"
-                    },
-                    fields=["name", "applicant_name", "custom_dninie", "designation", "company"]
-                )
-        except frappe.PermissionError:
-            job_offers_baja = []
-        
-        for jo_baja in job_offers_baja:
-            # Buscar modificaciones RRHH relacionadas que estén en "Alta"
-            modificaciones_alta = []
-            try:
-                if frappe.has_permission("Modificaciones RRHH", "read"):
-                    modificaciones_alta = frappe.get_list(
-                        "Modificaciones RRHH",
-                        filters={
-                            "docstatus": 1,
-                            "workflow_state": "Alta",
-                            "job_offer": jo_baja.name
-                        },
-                        fields=["name", "employee", "tipo_actualizacion", "start_date", "end_date"]
-                    )
-            except frappe.PermissionError:
-                modificaciones_alta = []
-            
-            if modificaciones_alta:
-                employee_name = None
-                employee_display_name = None
-                if modificaciones_alta[0].get("employee"):
-                    employee_display_name = frappe.db.get_value("Employee",
-                        modificaciones_alta[0]["employee"],
-                        "employee_name"
+        if frappe.has_permission("Job Offer", "read") and frappe.has_permission("Modificaciones RRHH", "read"):
+            inconsistencies = snapshot["job_offers_baja_modificaciones_alta"]
+            allowed_jo = get_readable_names("Job Offer", [jo["job_offer_name"] for jo in inconsistencies])
+            allowed_mod = get_readable_names(
+                "Modificaciones RRHH",
+                [m["name"] for jo in inconsistencies for m in jo["modificaciones"]]
+            )
+            for jo in inconsistencies:
+                if jo["job_offer_name"] not in allowed_jo:
+                    continue
+                modificaciones = [m for m in jo["modificaciones"] if m["name"] in allowed_mod]
+                if not modificaciones:
+                    continue
+                if len(modificaciones) != len(jo["modificaciones"]):
+                    first = modificaciones[0]
+                    jo = dict(
+                        jo,
+                        employee_name=first["employee"],
+                        employee_display_name=first["employee_display_name"],
+                        modificaciones=modificaciones
                     )
-                    employee_name = modificaciones_alta[0]["employee"]
-                
-                stats["job_offers_baja_modificaciones_alta"].append({
-                    "job_offer_name": jo_baja.name,
-                    "job_offer_state": "Baja",
-                    "applicant_name": jo_baja.applicant_name or "N/A",
-                    "employee_name": employee_name,
-                    "employee_display_name": employee_display_name or "N/A",
-                    "custom_dninie": jo_baja.custom_dninie or "N/A",
-                    "designation": jo_baja.designation or "N/A",
-                    "company": jo_baja.company or "N/A",
-                    "modificaciones_count": len(modificaciones_alta),
-                    "modificaciones": [
-                        {
-                            "name": m.name,
-                            "tipo_actualizacion": m.tipo_actualizacion or "N/A",
-                            "start_date": m.start_date,
-                            "end_date": m.end_date
-                        }
-                        for m in modificaciones_alta
+                stats["job_offers_baja_modificaciones_alta"].append(dict(
+                    jo,
+                    modificaciones_count=len(jo["modificaciones"]),
+                    modificaciones=[
+                        {k: m[k] for k in ("name", "tipo_actualizacion", "start_date", "end_date")}
+                        for m in jo["modificaciones"]
                     ]
-                })
+                ))
         
-        stats["summary"]["job_offers_baja_modificaciones_alta_count"] = len(stats["job_offers_baja_modificaciones_alta"])
+        for key in ("employees_missing_data", "job_offers_expired_active",
+                    "modificaciones_expired_active", "job_offers_baja_modificaciones_alta"):
+            stats["summary"][f"{key}_count"] = len(stats[key])
         
         # Ordenar por severidad (más problemas primero)
         stats["employees_missing_data"].sort(key=lambda x: x["missing_count"], reverse=True)
         stats["job_offers_expired_active"].sort(key=lambda x: x["dias_vencido"], reverse=True)
         stats["modificaciones_expired_active"].sort(key=lambda x: x["dias_vencido"], reverse=True)
         
+        stats["generated_at"] = snapshot["generated_at"]
         return stats
         
     except Exception as e:
         frappe.log_error(f"Error getting RRHH dashboard stats: {str(e)}")
         frappe.throw(_("Error getting dashboard statistics: {0}").format(str(e)))
+
+
+def get_readable_names(doctype, names):
+    """Subset of names the current user can read (one permission-aware query)"""
+    if not names:
+        return set()
+    
+    return set(frappe.get_list(
+        doctype,
+        filters={"name": ["in", list(set(names))]},
+        pluck="name",
+        limit_page_length=0
+    ))
+
+
+def refresh_rrhh_inconsistencies():
+    """
+    Scheduled job (hourly): run the RRHH inconsistency scan for all documents
+    and store it as a snapshot. Permissions are applied when the snapshot is read.
+    """
+    snapshot = scan_rrhh_inconsistencies()
+    frappe.cache().set_value(RRHH_SNAPSHOT_KEY, snapshot)
+    return snapshot
+
+
+# Employee fields read by the scan (changes to other fields keep the snapshot)
+RRHH_SCAN_EMPLOYEE_FIELDS = (
+    "status", "employee_name", "custom_dninie", "cell_number", "personal_email",
+    "company_email", "custom_no_seguridad_social", "department", "designation"
+)
+
+
+def _drop_rrhh_snapshot():
+    frappe.cache().delete_value(RRHH_SNAPSHOT_KEY)
+
+
+def clear_rrhh_inconsistencies(doc, method=None):
+    """
+    Employee / Job Offer / Modificaciones RRHH doc_events: drop the snapshot so
+    the next dashboard read rescans instead of showing already fixed issues.
+    """
+    if doc.doctype == "Employee" and method == "on_update" and doc.get_doc_before_save():
+        if not any(doc.has_value_changed(f) for f in RRHH_SCAN_EMPLOYEE_FIELDS):
+            return
+
+    _drop_rrhh_snapshot()
+    # Again after commit, in case a read rescanned the old rows meanwhile
+    frappe.db.after_commit.add(_drop_rrhh_snapshot)
+
+
+def scan_rrhh_inconsistencies():
+    """The four RRHH checks, each as a single joined query"""
+    today_dt = getdate(today())
+    
+    # 1. Empleados activos sin DNI/NIE, teléfono, email o número de Seguridad Social
+    employees_missing_data = []
+    for emp in frappe.db.sql("""
+        SELECT name, employee_name, custom_dninie, cell_number, personal_email,
+            company_email, custom_no_seguridad_social, department, designation
+        FROM `tabEmployee`
+        WHERE status = 'Active'
+            AND (IFNULL(custom_dninie, '') = ''
+                OR IFNULL(cell_number, '') = ''
+                OR (IFNULL(personal_email, '') = '' AND IFNULL(company_email, '') = '')
+                OR IFNULL(custom_no_seguridad_social, '') = '')
+    """, as_dict=True):
+        missing_fields = []
+        if not emp.custom_dninie:
+            missing_fields.append("DNI/NIE")
+        if not emp.cell_number:
+            missing_fields.append("Teléfono")
+        if not emp.personal_email and not emp.company_email:
+            missing_fields.append("Email")
+        if not emp.custom_no_seguridad_social:
+            missing_fields.append("Número Seguridad Social")
+        
+        employees_missing_data.append({
+            "employee_name": emp.name,
+            "employee_display_name": emp.employee_name or emp.name,
+            "department": emp.department or "Sin departamento",
+            "designation": emp.designation or "Sin cargo",
+            "missing_fields": missing_fields,
+            "missing_count": len(missing_fields)
+        })
+    
+    # 2. Job Offers en "Alta" con fecha fin vencida, con el empleado activo del mismo DNI
+    job_offers_expired_active = [
+        {
+            "job_offer_name": jo.name,
+            "applicant_name": jo.applicant_name or "N/A",
+            "employee_name": jo.employee,
+            "custom_dninie": jo.custom_dninie or "N/A",
+            "fecha_fin": jo.custom_fecha_fin,
+            "designation": jo.designation or "N/A",
+            "company": jo.company or "N/A"
+        }
+        for jo in frappe.db.sql("""
+            SELECT jo.name, jo.applicant_name, jo.custom_dninie, jo.custom_fecha_fin,
+                jo.designation, jo.company,
+                (SELECT e.name FROM `tabEmployee` e
+                    WHERE e.custom_dninie = jo.custom_dninie AND e.status = 'Active'
+                    LIMIT 1) AS employee
+            FROM `tabJob Offer` jo
+            WHERE jo.docstatus = 1
+                AND jo.workflow_state = 'Alta'
+                AND jo.custom_fecha_fin < %(today)s
+        """, {"today": today_dt}, as_dict=True)
+    ]
+    
+    # 3. Modificaciones RRHH en "Alta" con fecha fin vencida
+    modificaciones_expired_active = [
+        {
+            "modificacion_name": mod.name,
+            "employee_name": mod.employee or None,
+            "employee_display_name": mod.employee_display_name or "N/A",
+            "end_date": mod.end_date,
+            "designation": mod.designation or "N/A",
+            "company": mod.company or "N/A",
+            "tipo_actualizacion": mod.tipo_actualizacion or "N/A",
+            "job_offer": mod.job_offer or "N/A"
+        }
+        for mod in frappe.db.sql("""
+            SELECT m.name, m.employee, e.employee_name AS employee_display_name, m.end_date,
+                m.designation, m.company, m.tipo_actualizacion, m.job_offer
+            FROM `tabModificaciones RRHH` m
+            LEFT JOIN `tabEmployee` e ON e.name = m.employee
+            WHERE m.docstatus = 1
+                AND m.workflow_state = 'Alta'
+                AND m.end_date < %(today)s
+        """, {"today": today_dt}, as_dict=True)
+    ]
+    
+    # 4. Job Offers en "Baja" con Modificaciones RRHH relacionadas en "Alta"
+    inconsistencies = {}
+    for row in frappe.db.sql("""
+        SELECT jo.name AS job_offer, jo.applicant_name, jo.custom_dninie, jo.designation,
+            jo.company, m.name, m.employee, e.employee_name AS employee_display_name,
+            m.tipo_actualizacion, m.start_date, m.end_date
+        FROM `tabJob Offer` jo
+        INNER JOIN `tabModificaciones RRHH` m
+            ON m.job_offer = jo.name AND m.docstatus = 1 AND m.workflow_state = 'Alta'
+        LEFT JOIN `tabEmployee` e ON e.name = m.employee
+        WHERE jo.docstatus = 1
+            AND jo.workflow_state = 'Baja'
+        ORDER BY jo.modified DESC, m.modified DESC
+    """, as_dict=True):
+        entry = inconsistencies.get(row.job_offer)
+        if entry is None:
+            # El empleado mostrado es el de la primera modificación
+            entry = inconsistencies[row.job_offer] = {
+                "job_offer_name": row.job_offer,
+                "job_offer_state": "Baja",
+                "applicant_name": row.applicant_name or "N/A",
+                "employee_name": row.employee or None,
+                "employee_display_name": (row.employee_display_name if row.employee else None) or "N/A",
+                "custom_dninie": row.custom_dninie or "N/A",
+                "designation": row.designation or "N/A",
+                "company": row.company or "N/A",
+                "modificaciones": []
+            }
+        entry["modificaciones"].append({
+            "name": row.name,
+            "employee": row.employee or None,
+            "employee_display_name": (row.employee_display_name if row.employee else None) or "N/A",
+            "tipo_actualizacion": row.tipo_actualizacion or "N/A",
+            "start_date": row.start_date,
+            "end_date": row.end_date
+        })
+    
+    return {
+        "generated_at": str(now_datetime()),
+        "employees_missing_data": employees_missing_data,
+        "job_offers_expired_active": job_offers_expired_active,
+        "modificaciones_expired_active": modificaciones_expired_active,
+        "job_offers_baja_modificaciones_alta": list(inconsistencies.values())
+    }
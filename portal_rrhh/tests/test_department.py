@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+import frappe
+from erpnext.setup.doctype.employee.test_employee import make_employee
+from frappe.tests.utils import FrappeTestCase
+
+from portal_rrhh.api.department import get_team_members
+
+
+class TestGetTeamMembers(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.employees = [
+            make_employee(f"portal-team-member-{i}@example.com", company="_Test Company")
+            for i in range(20)
+        ]
+
+    def count_queries(self, employees):
+        """Queries run by get_team_members for a manager of the given employees."""
+        with patch("portal_rrhh.api.department.get_managed_employees", return_value=employees), \
+                patch.object(frappe.db, "sql", wraps=frappe.db.sql) as sql:
+            members = get_team_members()
+
+        self.assertEqual(len(members), len(employees))
+        return sql.call_count
+
+    def test_query_count_does_not_depend_on_team_size(self):
+        small_team = self.employees[:2]
+        # Warm up request-independent caches (meta, defaults) first
+        self.count_queries(small_team)
+
+        small = self.count_queries(small_team)
+        large = self.count_queries(self.employees)
+
+        self.assertEqual(small, large)
@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from hrms_integrations.hrms_integrations.doctype.liquidacion_nomina.liquidacion_nomina import (
+    calcular_horas_mes_desde_calendario
+)
+
+from portal_rrhh.api.nominas import get_horas_cursos_mes
+
+
+class TestHorasCursosMes(FrappeTestCase):
+    mes = "Marzo"
+    año = 2026
+
+    def test_bulk_matches_per_course_hours(self):
+        courses = frappe.get_all("Course", pluck="name", limit=5)
+        if not courses:
+            self.skipTest("No hay cursos en el sitio de pruebas")
+
+        # Cursos repetidos, como cuando varios docentes comparten curso
+        with patch(
+            "portal_rrhh.api.nominas.calcular_horas_mes_desde_calendario",
+            wraps=calcular_horas_mes_desde_calendario
+        ) as calcular:
+            bulk = get_horas_cursos_mes(courses + courses, self.mes, self.año)
+
+        self.assertEqual(calcular.call_count, len(courses))
+        for course in courses:
+            self.assertEqual(bulk[course], calcular_horas_mes_desde_calendario(course, self.mes, self.año))
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import frappe
+from erpnext.setup.doctype.employee.test_employee import make_employee
+from frappe.permissions import add_user_permission
+from frappe.tests.utils import FrappeTestCase
+
+from portal_rrhh.api.permissions import filter_readable, get_permission_predicate
+
+
+TEST_USER = "portal-permissions-user@example.com"
+DENIED_BY_HOOK = set()
+
+
+def deny_listed_employees(doc, ptype=None, user=None, debug=False):
+    """has_permission hook used by the tests: hides the employees in DENIED_BY_HOOK."""
+    return doc.name not in DENIED_BY_HOOK
+
+
+class TestBatchPermissions(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.employees = [
+            make_employee(f"portal-permissions-{i}@example.com", company="_Test Company")
+            for i in range(6)
+        ]
+
+        if not frappe.db.exists("User", TEST_USER):
+            frappe.get_doc({
+                "doctype": "User",
+                "email": TEST_USER,
+                "first_name": "Portal Permissions",
+                "send_welcome_email": 0,
+                "roles": [{"role": "HR User"}]
+            }).insert(ignore_permissions=True)
+
+        # Restricted to half of the employees through User Permissions
+        for employee in cls.employees[:3]:
+            add_user_permission("Employee", employee, TEST_USER, ignore_permissions=True)
+
+    def per_row(self, names):
+        return {n for n in names if frappe.has_permission("Employee", "read", n, user=TEST_USER)}
+
+    def by_predicate(self, names):
+        predicate = get_permission_predicate("Employee", user=TEST_USER)
+        return set(frappe.db.sql_list(
+            f"SELECT name FROM `tabEmployee` WHERE name IN %(names)s AND ({predicate or '1 = 1'})",
+            {"names": tuple(names)}
+        ))
+
+    def batch(self, names):
+        return filter_readable("Employee", names, user=TEST_USER)
+
+    def test_batch_matches_per_row(self):
+        readable = self.batch(self.employees)
+
+        self.assertEqual(readable, self.by_predicate(self.employees))
+        self.assertEqual(readable, self.per_row(self.employees))
+        self.assertEqual(readable, set(self.employees[:3]))
+
+    def test_has_permission_hooks_are_honored(self):
+        get_hooks = frappe.get_hooks
+
+        def hooks(hook=None, *args, **kwargs):
+            if hook == "has_permission":
+                return {"Employee": ["portal_rrhh.tests.test_permissions.deny_listed_employees"]}
+            return get_hooks(hook, *args, **kwargs)
+
+        DENIED_BY_HOOK.add(self.employees[0])
+        try:
+            with patch.object(frappe, "get_hooks", side_effect=hooks):
+                readable = self.batch(self.employees)
+                expected = self.per_row(self.employees)
+                # The SQL predicate cannot apply the hook: it is a superset
+                candidates = self.by_predicate(self.employees)
+        finally:
+            DENIED_BY_HOOK.clear()
+
+        self.assertEqual(readable, expected)
+        self.assertEqual(readable, set(self.employees[1:3]))
+        self.assertEqual(candidates, set(self.employees[:3]))